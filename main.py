@@ -5,9 +5,10 @@ from utils import voice_utils as vu
 from utils import signature_utils as su
 from utils import face_utils as fu
 from utils.config import BIOMETRIC_CONFIG
-from utils.indexer import update_index
+from utils.indexer import update_index_for_subject, start_index_listener
 import time
 import json
+from datetime import datetime, timedelta
 
 def clear_screen():
     #os.system('cls' if os.name == 'nt' else 'clear')
@@ -20,7 +21,7 @@ def view_audit_logs():
     """Интерфейс для просмотра и анализа аудит-логов"""
     while True:
         print("\n=== Анализ логов аудита ===\n")
-        print("1. Показать все логи (последние 100)")
+        print("1. Показать все логи (постранично)")
         print("2. Фильтр по таблице")
         print("3. Фильтр по пользователю")
         print("4. Фильтр по дате")
@@ -32,40 +33,40 @@ def view_audit_logs():
         choice = input("Выберите действие (1-8): ").strip()
 
         if choice == '1':
-            logs = lu.fetch_all_logs()
-            print_audit_logs(logs)
+            show_audit_log_pages()
             
         elif choice == '2':
             table = input("Введите имя таблицы: ")
-            logs = lu.filter_logs_by_table(table_name=table)
-            print_audit_logs(logs)
+            show_audit_log_pages(table_name=table)
             
         elif choice == '3':
             user = input("Введите имя пользователя: ")
-            logs = lu.filter_logs_by_user(user=user)
-            print_audit_logs(logs)
+            show_audit_log_pages(user=user)
             
         elif choice == '4':
             start = input("Начальная дата (YYYY-MM-DD): ")
             end = input("Конечная дата (YYYY-MM-DD): ")
-            logs = lu.filter_logs_by_date(start_date=start, end_date=end)
-            print_audit_logs(logs)
+            show_audit_log_pages(start_date=start, end_date=end)
             
         elif choice == '5':
-            logs = lu.fetch_all_logs()
-            lu.export_logs_to_csv(logs)
+            file_format = input("Формат (csv/parquet/arrow) [csv]: ").strip() or 'csv'
+            filename = input(f"Файл [audit_export.{file_format}]: ").strip() or f"audit_export.{file_format}"
+            try:
+                lu.export_audit_logs(filename, file_format)
+            except (ValueError, ImportError) as e:
+                print(f"Ошибка экспорта: {e}")
             
         elif choice == '6':
             stats = lu.analyze_user_activity()
             print("\nАктивность пользователей:")
-            for row in stats.get('user_stats', []):
-                print(f"{row['changed_by']}: {row['changes_count']} изменений")
+            for changed_by, changes_count in stats:
+                print(f"{changed_by}: {changes_count} изменений")
                 
         elif choice == '7':
             stats = lu.analyze_table_changes()
             print("\nИзменения по таблицам:")
-            for row in stats.get('table_stats', []):
-                print(f"{row['table_name']}: {row['changes_count']} изменений")
+            for table_name, changes_count in stats:
+                print(f"{table_name}: {changes_count} изменений")
                 
         elif choice == '8':
             return
@@ -74,6 +75,50 @@ def view_audit_logs():
             print("Неверный выбор.")
         input("\nНажмите Enter для продолжения...")
 
+def print_search_latency(title, stats):
+    print(f"\n{title}")
+    if not stats:
+        print("  Нет поисков за это окно")
+        return
+    print(f"  {'Тип':<10} {'Поисков':>8} {'p50 мс':>9} {'p95 мс':>9} {'p99 мс':>9} "
+          f"{'В мин.':>8} {'Пик/мин':>8} {'Найдено':>8}")
+    for search_type, row in stats.items():
+        print(f"  {search_type:<10} {row['searches']:>8} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+              f"{row['p99_ms']:>9.1f} {row['per_minute']:>8.2f} {row['peak_per_minute']:>8} "
+              f"{row['hit_rate']:>7.0%}")
+
+def view_search_analytics():
+    """Задержки и частота поиска за окно и сравнение с предыдущим окном той же длины"""
+    hours = input("Окно, часов [24]: ").strip()
+    try:
+        window = timedelta(hours=float(hours) if hours else 24)
+    except ValueError:
+        print("Неверное число часов.")
+        return
+    end = datetime.now()
+    current = lu.analyze_search_latency(end - window, end)
+    previous = lu.analyze_search_latency(end - 2 * window, end - window)
+    print_search_latency(f"Последние {window}:", current)
+    print_search_latency(f"Предыдущее окно ({window}):", previous)
+
+    for search_type, row in current.items():
+        before = previous.get(search_type)
+        if before and before['p95_ms']:
+            change = (row['p95_ms'] - before['p95_ms']) / before['p95_ms']
+            print(f"  {search_type}: p95 {before['p95_ms']:.1f} → {row['p95_ms']:.1f} мс ({change:+.0%}), "
+                  f"найдено {before['hit_rate']:.0%} → {row['hit_rate']:.0%}")
+
+def show_audit_log_pages(**filters):
+    """Логи по LOG_PAGE_SIZE записей, следующая страница — по Enter"""
+    after = None
+    while True:
+        logs, after = lu.fetch_logs_page(after=after, **filters)
+        print_audit_logs(logs)
+        if after is None:
+            return
+        if input("\nEnter — следующая страница, q — хватит: ").strip().lower() == 'q':
+            return
+
 def print_audit_logs(logs):
     if not logs:
         print("\n⚠️ Нет записей для отображения")
@@ -150,10 +195,13 @@ def register_biometric(biometric_type, extract_func, save_func, sensor_type='cam
         print(f"{biometric_type.capitalize()} успешно зарегистрирован")
     else:
         print(f"Ошибка регистрации {biometric_type}")
-    update_index(
+    if subject_id is None:
+        subject_id = dbu.get_subject_by_login(login)
+    update_index_for_subject(
         config['samples_table'],
         config['vector_column'],
-        config['index_file']
+        config['index_file'],
+        subject_id
     )
 
 
@@ -253,10 +301,11 @@ def update_biometric(bio_type, extract_func, current_user_id):
     else:
         print(f"Ошибка обновления {bio_type}")
     
-    update_index(
+    update_index_for_subject(
         config['samples_table'],
         config['vector_column'],
-        config['index_file']
+        config['index_file'],
+        current_user_id
     )
 
 def add_biometric(current_user_id):
@@ -285,22 +334,16 @@ def add_biometric(current_user_id):
     if biometric_type not in missing:
         print("Неверный выбор или этот тип биометрии уже добавлен.")
         return
+    # register_biometric сам обновляет индекс для этого пользователя
     if choice == '1':
         register_biometric('face', fu.extract_face_vector, dbu.save_face_vector, 'camera', current_user_id)
-        config = BIOMETRIC_CONFIG['face']
     elif choice == '2':
         register_biometric('voice', vu.extract_audio_vector, dbu.save_voice_vector, 'mic', current_user_id)
-        config = BIOMETRIC_CONFIG['voice']
     elif choice == '3':
         register_biometric('signature', su.extract_signature_vector, dbu.save_signature_vector, 'signature_pad', current_user_id)
-        config = BIOMETRIC_CONFIG['signature']
     else:
         print("Неверный выбор")
-    update_index(
-        config['samples_table'],
-        config['vector_column'],
-        config['index_file']
-    )
+        return
     print("Биометрия успешно добавлена")
 
 def change_password(current_user_id):
@@ -323,34 +366,41 @@ def change_password(current_user_id):
 
 #TODO: fix voice and signature
 
+def print_users(users):
+    for user in users:
+        print(f"Пользователь: {user['full_name']} (ID: {user['subject_id']})")
+        print(f"  Пол: {user['gender']}")
+        print("   Биометрия:")
+
+        modalities = [f"{biometric_type} ×{count}" for biometric_type, count in user['counts'].items() if count]
+        if modalities:
+            print(f"    {', '.join(modalities)}")
+        else:
+            print("    Нет биометрических образцов")
+        print("-" * 40)
+
+def show_user_pages():
+    """Пользователи по USER_PAGE_SIZE, следующая страница — по Enter (как кнопка «Ещё» в ui_tk)"""
+    users, after_id = dbu.get_users_summary()
+    if not users:
+        print("Не удалось загрузить данные пользователей.(База данных пуста)")
+        return
+    print("Пользователи загружены!")
+    shown = 0
+    while True:
+        print_users(users)
+        shown += len(users)
+        if after_id is None:
+            return
+        if input(f"\nПоказано {shown}. Enter — ещё пользователи, q — к меню: ").strip().lower() == 'q':
+            return
+        users, after_id = dbu.get_users_summary(after_id=after_id)
+
 def main():
     while True:
         #clear_screen()
         print("Загружаем пользователей...")
-        users = dbu.get_all_users_with_biometrics()
-        
-        if users:
-            print("Пользователи загружены!")
-            for user in users:
-                print(f"Пользователь: {user['full_name']} (ID: {user['subject_id']})")
-                print(f"  Пол: {user['gender']}")
-                print("   Биометрия:")
-                
-                if user['biometrics']:
-                    for bio in user['biometrics']:
-                        print(f"    Тип: {bio['sample_type']}, Файл: {bio['file_path']}")
-                        #if bio['sample_type'] == 'face':
-                        #    print(f"      Вектор лица: {bio['feature_vector']}")
-                        #elif bio['sample_type'] == 'voice':
-                        #    print(f"      Текст голоса: {bio['voice_text']}")
-                        #    print(f"      Вектор аудио: {bio['audio_vector']}")
-                        #elif bio['sample_type'] == 'signature':
-                        #    print(f"      Вектор подписи: {bio['signature_vector']}")
-                else:
-                    print("    Нет биометрических образцов")
-                print("-" * 40)
-        else:
-            print("Не удалось загрузить данные пользователей.(База данных пуста)")
+        show_user_pages()
         print("=== Биометрическая система ===\n")
         print("1. Зарегистрироваться по лицу")
         print("2. Зарегистрироваться по голосу")
@@ -359,9 +409,10 @@ def main():
         print("5. Войти по голосу")
         print("6. Войти по подписи")
         print("7. Анализ логов")
-        print("8. Выход\n")
+        print("8. Анализ поиска")
+        print("9. Выход\n")
 
-        choice = input("Выберите действие (1-8): ").strip()
+        choice = input("Выберите действие (1-9): ").strip()
 
         if choice == '1':
             register_biometric('face', fu.extract_face_vector, dbu.save_face_vector, 'camera')
@@ -378,6 +429,8 @@ def main():
         elif choice == '7':
             view_audit_logs()
         elif choice == '8':
+            view_search_analytics()
+        elif choice == '9':
             print("Выход...")
             break
         else:
@@ -399,6 +452,7 @@ def main():
  #/home/kostya/biometric_course_work/dataset/faces/Authorize/Adil_auth.jpg
 
 if __name__ == "__main__":
+    start_index_listener()
     main()
     
 
@@ -9,6 +9,8 @@ DROP TABLE IF EXISTS
 
 DROP TABLE IF EXISTS search_logs CASCADE;
 DROP TABLE IF EXISTS audit_logs CASCADE;
+DROP TABLE IF EXISTS audit_excluded_columns CASCADE;
+DROP TABLE IF EXISTS audit_rollup_hourly, search_rollup_hourly, search_latency_hourly CASCADE;
 
 DROP TABLE IF EXISTS signature_samples CASCADE;
 DROP TABLE IF EXISTS voice_samples CASCADE;
@@ -45,6 +47,10 @@ CREATE TABLE IF NOT EXISTS sensors (
     is_active    BOOLEAN DEFAULT TRUE
 );
 
+-- Один сенсор на (имя, тип, производитель): по нему делается upsert в реестре сенсоров
+CREATE UNIQUE INDEX IF NOT EXISTS sensors_name_type_manufacturer_key
+    ON sensors (sensor_name, sensor_type, manufacturer);
+
 -- 3) CAMERAS (только для sensor_type='camera')
 CREATE TABLE IF NOT EXISTS cameras (
     sensor_id     INT PRIMARY KEY REFERENCES sensors(sensor_id) ON DELETE CASCADE,
@@ -90,7 +96,7 @@ CREATE TABLE IF NOT EXISTS face_samples (
     image_width      INT,
     image_height     INT,
     image_format     VARCHAR(10),
-    feature_vector   JSONB,      -- или ARRAY(128)
+    feature_vector   BYTEA CHECK (octet_length(feature_vector) = 4 * 128),  -- float32[128], little-endian
     confidence_score FLOAT DEFAULT 0.0
 );
 
@@ -100,7 +106,7 @@ CREATE TABLE IF NOT EXISTS voice_samples (
     voice_text       TEXT,
     sampling_rate    INT NOT NULL,
     audio_format     VARCHAR(10) NOT NULL,
-    audio_vector     JSONB,      -- или ARRAY(192)
+    audio_vector     BYTEA CHECK (octet_length(audio_vector) = 4 * 192),    -- float32[192], little-endian
     duration_seconds FLOAT
 );
 
@@ -109,13 +115,82 @@ CREATE TABLE IF NOT EXISTS signature_samples (
     sample_id             INT PRIMARY KEY REFERENCES samples(sample_id) ON DELETE CASCADE,
     signature_image_path  TEXT NOT NULL,
     stroke_speed         FLOAT,
-    signature_vector     JSONB,   -- или ARRAY(256)
+    signature_vector     BYTEA CHECK (octet_length(signature_vector) = 4 * 256),  -- float32[256], little-endian
     stroke_count         INT
 );
 
--- 10) AUDIT_LOG
+-- Помесячные партиции журналов: <таблица>_YYYY_MM плюс <таблица>_default для строк вне диапазона.
+-- ensure_log_partitions создаёт партиции от p_from до текущего месяца + p_months_ahead;
+-- если в default уже попали строки нового месяца, они переносятся в созданную партицию.
+CREATE OR REPLACE FUNCTION ensure_log_partitions(p_table TEXT, p_from DATE DEFAULT CURRENT_DATE,
+                                                 p_months_ahead INT DEFAULT 3)
+RETURNS INT AS $$
+DECLARE
+    month_start DATE := date_trunc('month', p_from)::date;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => p_months_ahead))::date;
+    default_name TEXT := p_table || '_default';
+    partition_name TEXT;
+    has_rows BOOLEAN;
+    created INT := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := p_table || '_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            has_rows := FALSE;
+            IF to_regclass(default_name) IS NOT NULL THEN
+                EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE timestamp >= %L AND timestamp < %L)',
+                               default_name, month_start, month_start + interval '1 month')
+                INTO has_rows;
+            END IF;
+            IF has_rows THEN
+                EXECUTE format('CREATE TEMP TABLE log_partition_move ON COMMIT DROP AS
+                                SELECT * FROM %I WHERE timestamp >= %L AND timestamp < %L',
+                               default_name, month_start, month_start + interval '1 month');
+                EXECUTE format('DELETE FROM %I WHERE timestamp >= %L AND timestamp < %L',
+                               default_name, month_start, month_start + interval '1 month');
+            END IF;
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, p_table, month_start, month_start + interval '1 month');
+            IF has_rows THEN
+                EXECUTE format('INSERT INTO %I SELECT * FROM log_partition_move', partition_name);
+                DROP TABLE log_partition_move;
+            END IF;
+            created := created + 1;
+        END IF;
+        month_start := (month_start + interval '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаляет партиции месяцев старше p_keep_months полных месяцев до текущего
+CREATE OR REPLACE FUNCTION drop_old_log_partitions(p_table TEXT, p_keep_months INT)
+RETURNS INT AS $$
+DECLARE
+    cutoff DATE := (date_trunc('month', CURRENT_DATE) - make_interval(months => p_keep_months))::date;
+    partition_name TEXT;
+    month_text TEXT;
+    dropped INT := 0;
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = p_table::regclass
+    LOOP
+        month_text := substring(partition_name FROM '_(\d{4}_\d{2})$');
+        CONTINUE WHEN month_text IS NULL;
+        IF to_date(month_text, 'YYYY_MM') < cutoff THEN
+            EXECUTE format('DROP TABLE %I', partition_name);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 10) AUDIT_LOG (помесячные партиции по timestamp)
 CREATE TABLE IF NOT EXISTS audit_logs (
-    log_id       SERIAL PRIMARY KEY,
+    log_id       SERIAL,
     timestamp    TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
     subject_id   INT          REFERENCES subjects(subject_id) ON DELETE SET NULL,
     sensor_id    INT          REFERENCES sensors(sensor_id) ON DELETE SET NULL,
@@ -124,13 +199,17 @@ CREATE TABLE IF NOT EXISTS audit_logs (
     operation    VARCHAR(10)  NOT NULL CHECK (operation IN ('INSERT','UPDATE','DELETE')),
     old_data     JSONB,                              
     new_data     JSONB,                              
-    changed_by   TEXT         NOT NULL DEFAULT CURRENT_USER
-);
+    changed_by   TEXT         NOT NULL DEFAULT CURRENT_USER,
+    PRIMARY KEY (log_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE IF NOT EXISTS audit_logs_default PARTITION OF audit_logs DEFAULT;
+SELECT ensure_log_partitions('audit_logs');
 
 
--- 11) SEARCH_LOGS
+-- 11) SEARCH_LOGS (помесячные партиции по timestamp)
 CREATE TABLE IF NOT EXISTS search_logs (
-    search_id          SERIAL PRIMARY KEY,
+    search_id          SERIAL,
     timestamp          TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
     subject_id         INT          REFERENCES subjects(subject_id) ON DELETE SET NULL,
     sensor_id          INT          REFERENCES sensors(sensor_id)  ON DELETE SET NULL,
@@ -141,206 +220,356 @@ CREATE TABLE IF NOT EXISTS search_logs (
     search_time_ms     FLOAT        NOT NULL,
     threshold_used     FLOAT        NOT NULL,
     additional_info    JSONB,       
-    searched_at        TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP
+    searched_at        TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (search_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+CREATE TABLE IF NOT EXISTS search_logs_default PARTITION OF search_logs DEFAULT;
+SELECT ensure_log_partitions('search_logs');
+
+-- ============= АУДИТ =============
+-- Столбцы, которые не копируются в audit_logs целиком: вместо значения пишется
+-- заглушка {"sha256": ..., "dim": ...}. Список можно дополнять без изменения триггеров.
+CREATE TABLE IF NOT EXISTS audit_excluded_columns (
+    table_name   TEXT NOT NULL,
+    column_name  TEXT NOT NULL,
+    PRIMARY KEY (table_name, column_name)
 );
 
-CREATE OR REPLACE FUNCTION log_subjects_change()
+INSERT INTO audit_excluded_columns (table_name, column_name) VALUES
+    ('face_samples', 'feature_vector'),
+    ('voice_samples', 'audio_vector'),
+    ('signature_samples', 'signature_vector')
+ON CONFLICT DO NOTHING;
+
+-- Строка для аудита: исключённые столбцы заменяются хэшем и размерностью.
+-- BYTEA приходит как '\x...' (float32, 4 байта на компоненту), JSONB-массив — как есть.
+CREATE OR REPLACE FUNCTION audit_row(p_row JSONB, p_excluded TEXT[])
+RETURNS JSONB AS $$
+    SELECT CASE WHEN p_excluded IS NULL THEN p_row
+    ELSE (p_row - p_excluded) || COALESCE((
+        SELECT jsonb_object_agg(key, CASE
+            WHEN jsonb_typeof(value) = 'null' THEN value
+            WHEN jsonb_typeof(value) = 'array' THEN jsonb_build_object(
+                'sha256', encode(sha256(convert_to(value::text, 'UTF8')), 'hex'),
+                'dim', jsonb_array_length(value))
+            ELSE jsonb_build_object(
+                'sha256', encode(sha256(decode(substr(value #>> '{}', 3), 'hex')), 'hex'),
+                'dim', (length(value #>> '{}') - 2) / 8)
+            END)
+        FROM jsonb_each(p_row)
+        WHERE key = ANY(p_excluded)
+    ), '{}'::jsonb)
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Аудит на уровне оператора: одна вставка в audit_logs на весь INSERT/UPDATE/DELETE
+-- через таблицы переходов. TG_ARGV[0] — первичный ключ таблицы (по нему сопоставляются
+-- старые и новые строки при UPDATE), TG_ARGV[1] — столбец audit_logs для ссылки
+-- (subject_id, sensor_id, sample_id или '' — без ссылки).
+-- При DELETE ссылка не заполняется: строка уже удалена, данные остаются в old_data.
+CREATE OR REPLACE FUNCTION audit_statement()
 RETURNS TRIGGER AS $$
+DECLARE
+    key_column TEXT := TG_ARGV[0];
+    ref_column TEXT := NULLIF(TG_ARGV[1], '');
+    excluded TEXT[];
 BEGIN
-    IF TG_OP = 'INSERT' THEN
-        INSERT INTO audit_logs (table_name, operation, subject_id, new_data)
-        VALUES ('subjects', 'INSERT', NEW.subject_id, row_to_json(NEW));
-    ELSIF TG_OP = 'UPDATE' THEN
-        INSERT INTO audit_logs (table_name, operation, subject_id, old_data, new_data)
-        VALUES ('subjects', 'UPDATE', OLD.subject_id, row_to_json(OLD), row_to_json(NEW));
-    ELSIF TG_OP = 'DELETE' THEN
-        INSERT INTO audit_logs (table_name, operation, subject_id, old_data)
-        VALUES ('subjects', 'DELETE', OLD.subject_id, row_to_json(OLD));
-    END IF;
-    RETURN NULL;
-END;
-$$ LANGUAGE plpgsql;
-
-CREATE TRIGGER subjects_audit_trigger
-AFTER INSERT OR UPDATE OR DELETE ON subjects
-FOR EACH ROW EXECUTE FUNCTION log_subjects_change();
+    SELECT array_agg(column_name) INTO excluded
+    FROM audit_excluded_columns WHERE table_name = TG_TABLE_NAME;
 
-CREATE OR REPLACE FUNCTION log_samples_change()
-RETURNS TRIGGER AS $$
-BEGIN
     IF TG_OP = 'INSERT' THEN
-        INSERT INTO audit_logs (table_name, operation, new_data)
-        VALUES ('samples', 'INSERT', row_to_json(NEW));
+        INSERT INTO audit_logs (table_name, operation, subject_id, sensor_id, sample_id, new_data)
+        SELECT TG_TABLE_NAME, 'INSERT',
+               CASE WHEN ref_column = 'subject_id' THEN (r ->> ref_column)::int END,
+               CASE WHEN ref_column = 'sensor_id' THEN (r ->> ref_column)::int END,
+               CASE WHEN ref_column = 'sample_id' THEN (r ->> ref_column)::int END,
+               audit_row(r, excluded)
+        FROM (SELECT to_jsonb(n) AS r FROM new_rows n) t;
     ELSIF TG_OP = 'UPDATE' THEN
-        INSERT INTO audit_logs (table_name, operation, old_data, new_data)
-        VALUES ('samples', 'UPDATE', row_to_json(OLD), row_to_json(NEW));
+        INSERT INTO audit_logs (table_name, operation, subject_id, sensor_id, sample_id, old_data, new_data)
+        SELECT TG_TABLE_NAME, 'UPDATE',
+               CASE WHEN ref_column = 'subject_id' THEN (COALESCE(o.r, n.r) ->> ref_column)::int END,
+               CASE WHEN ref_column = 'sensor_id' THEN (COALESCE(o.r, n.r) ->> ref_column)::int END,
+               CASE WHEN ref_column = 'sample_id' THEN (COALESCE(o.r, n.r) ->> ref_column)::int END,
+               audit_row(o.r, excluded), audit_row(n.r, excluded)
+        FROM (SELECT to_jsonb(x) AS r FROM old_rows x) o
+        FULL JOIN (SELECT to_jsonb(x) AS r FROM new_rows x) n
+            ON o.r -> key_column = n.r -> key_column;
     ELSIF TG_OP = 'DELETE' THEN
         INSERT INTO audit_logs (table_name, operation, old_data)
-        VALUES ('samples', 'DELETE', row_to_json(OLD));
+        SELECT TG_TABLE_NAME, 'DELETE', audit_row(to_jsonb(o), excluded)
+        FROM old_rows o;
     END IF;
     RETURN NULL;
 END;
-$$ LANGUAGE plpgsql;
-
-CREATE TRIGGER samples_audit_trigger
-AFTER INSERT OR UPDATE OR DELETE ON samples
-FOR EACH ROW EXECUTE FUNCTION log_samples_change();
-CREATE OR REPLACE FUNCTION log_sensors_change()
+$$ LANGUAGE plpgsql SET bytea_output = 'hex';
+
+CREATE TRIGGER subjects_audit_insert
+AFTER INSERT ON subjects REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('subject_id', 'subject_id');
+CREATE TRIGGER subjects_audit_update
+AFTER UPDATE ON subjects REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('subject_id', 'subject_id');
+CREATE TRIGGER subjects_audit_delete
+AFTER DELETE ON subjects REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('subject_id', 'subject_id');
+
+CREATE TRIGGER samples_audit_insert
+AFTER INSERT ON samples REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', '');
+CREATE TRIGGER samples_audit_update
+AFTER UPDATE ON samples REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', '');
+CREATE TRIGGER samples_audit_delete
+AFTER DELETE ON samples REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', '');
+
+CREATE TRIGGER sensors_audit_insert
+AFTER INSERT ON sensors REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+CREATE TRIGGER sensors_audit_update
+AFTER UPDATE ON sensors REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+CREATE TRIGGER sensors_audit_delete
+AFTER DELETE ON sensors REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+
+CREATE TRIGGER face_samples_audit_insert
+AFTER INSERT ON face_samples REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+CREATE TRIGGER face_samples_audit_update
+AFTER UPDATE ON face_samples REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+CREATE TRIGGER face_samples_audit_delete
+AFTER DELETE ON face_samples REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+
+CREATE TRIGGER voice_samples_audit_insert
+AFTER INSERT ON voice_samples REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+CREATE TRIGGER voice_samples_audit_update
+AFTER UPDATE ON voice_samples REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+CREATE TRIGGER voice_samples_audit_delete
+AFTER DELETE ON voice_samples REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+
+CREATE TRIGGER signature_samples_audit_insert
+AFTER INSERT ON signature_samples REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+CREATE TRIGGER signature_samples_audit_update
+AFTER UPDATE ON signature_samples REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+CREATE TRIGGER signature_samples_audit_delete
+AFTER DELETE ON signature_samples REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+
+CREATE TRIGGER cameras_audit_insert
+AFTER INSERT ON cameras REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+CREATE TRIGGER cameras_audit_update
+AFTER UPDATE ON cameras REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+CREATE TRIGGER cameras_audit_delete
+AFTER DELETE ON cameras REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+
+CREATE TRIGGER microphones_audit_insert
+AFTER INSERT ON microphones REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+CREATE TRIGGER microphones_audit_update
+AFTER UPDATE ON microphones REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+CREATE TRIGGER microphones_audit_delete
+AFTER DELETE ON microphones REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+
+CREATE TRIGGER signature_pads_audit_insert
+AFTER INSERT ON signature_pads REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+CREATE TRIGGER signature_pads_audit_update
+AFTER UPDATE ON signature_pads REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+CREATE TRIGGER signature_pads_audit_delete
+AFTER DELETE ON signature_pads REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+
+-- Журналы пишутся по возрастанию времени: BRIN по timestamp почти ничего не весит
+-- и отсекает блоки при фильтре по дате; B-tree (…, timestamp, id) отдают страницы
+-- в порядке ORDER BY timestamp DESC, id DESC для постраничного (keyset) просмотра.
+CREATE INDEX idx_audit_logs_timestamp_brin ON audit_logs USING brin (timestamp);
+CREATE INDEX idx_audit_logs_timestamp ON audit_logs (timestamp DESC, log_id DESC);
+CREATE INDEX idx_audit_logs_table ON audit_logs (table_name, timestamp DESC, log_id DESC);
+CREATE INDEX idx_audit_logs_user ON audit_logs (changed_by, timestamp DESC, log_id DESC);
+
+CREATE INDEX idx_search_logs_timestamp_brin ON search_logs USING brin (timestamp);
+CREATE INDEX idx_search_logs_timestamp ON search_logs (timestamp DESC, search_id DESC);
+CREATE INDEX idx_search_logs_type ON search_logs (search_type, timestamp DESC, search_id DESC);
+
+-- ============= УВЕДОМЛЕНИЯ ОБ ИЗМЕНЕНИЯХ ДЛЯ ИНДЕКСОВ =============
+-- Канал biometric_index, полезная нагрузка — JSON:
+-- {"sample_id": ..., "modality": "face|voice|signature", "op": "insert|update|status|delete", "status": ...}
+-- Векторы в уведомление не попадают (лимит pg_notify — 8000 байт), слушатель
+-- (utils.indexer.IndexChangeListener) дочитывает их сам.
+
+CREATE OR REPLACE FUNCTION notify_samples_change()
 RETURNS TRIGGER AS $$
 BEGIN
-    IF TG_OP = 'INSERT' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, new_data)
-        VALUES ('sensors', 'INSERT', NEW.sensor_id, row_to_json(NEW));
-    ELSIF TG_OP = 'UPDATE' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, old_data, new_data)
-        VALUES ('sensors', 'UPDATE', OLD.sensor_id, row_to_json(OLD), row_to_json(NEW));
+    -- Вставка в samples не уведомляет: вектора ещё нет, событие придёт от таблицы модальности
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.status IS DISTINCT FROM OLD.status OR NEW.subject_id IS DISTINCT FROM OLD.subject_id THEN
+            PERFORM pg_notify('biometric_index', json_build_object(
+                'sample_id', NEW.sample_id, 'modality', NEW.sample_type,
+                'op', 'status', 'status', NEW.status)::text);
+        END IF;
     ELSIF TG_OP = 'DELETE' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, old_data)
-        VALUES ('sensors', 'DELETE', OLD.sensor_id, row_to_json(OLD));
+        PERFORM pg_notify('biometric_index', json_build_object(
+            'sample_id', OLD.sample_id, 'modality', OLD.sample_type,
+            'op', 'delete', 'status', OLD.status)::text);
     END IF;
     RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER sensors_audit_trigger
-AFTER INSERT OR UPDATE OR DELETE ON sensors
-FOR EACH ROW EXECUTE FUNCTION log_sensors_change();
+CREATE TRIGGER samples_index_notify_trigger
+AFTER UPDATE OR DELETE ON samples
+FOR EACH ROW EXECUTE FUNCTION notify_samples_change();
 
-CREATE OR REPLACE FUNCTION log_face_samples_change()
+-- TG_ARGV[0] — модальность, TG_ARGV[1] — столбец с вектором
+CREATE OR REPLACE FUNCTION notify_vector_change()
 RETURNS TRIGGER AS $$
 BEGIN
     IF TG_OP = 'INSERT' THEN
-        INSERT INTO audit_logs (table_name, operation, sample_id, new_data)
-        VALUES ('face_samples', 'INSERT', NEW.sample_id, row_to_json(NEW));
+        PERFORM pg_notify('biometric_index', json_build_object(
+            'sample_id', NEW.sample_id, 'modality', TG_ARGV[0], 'op', 'insert')::text);
     ELSIF TG_OP = 'UPDATE' THEN
-        INSERT INTO audit_logs (table_name, operation, sample_id, old_data, new_data)
-        VALUES ('face_samples', 'UPDATE', OLD.sample_id, row_to_json(OLD), row_to_json(NEW));
+        IF to_jsonb(NEW) -> TG_ARGV[1] IS DISTINCT FROM to_jsonb(OLD) -> TG_ARGV[1] THEN
+            PERFORM pg_notify('biometric_index', json_build_object(
+                'sample_id', NEW.sample_id, 'modality', TG_ARGV[0], 'op', 'update')::text);
+        END IF;
     ELSIF TG_OP = 'DELETE' THEN
-        INSERT INTO audit_logs (table_name, operation, sample_id, old_data)
-        VALUES ('face_samples', 'DELETE', OLD.sample_id, row_to_json(OLD));
+        PERFORM pg_notify('biometric_index', json_build_object(
+            'sample_id', OLD.sample_id, 'modality', TG_ARGV[0], 'op', 'delete')::text);
     END IF;
     RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER face_samples_audit_trigger
+CREATE TRIGGER face_samples_index_notify_trigger
 AFTER INSERT OR UPDATE OR DELETE ON face_samples
-FOR EACH ROW EXECUTE FUNCTION log_face_samples_change();
-
-CREATE OR REPLACE FUNCTION log_voice_samples_change()
-RETURNS TRIGGER AS $$
-BEGIN
-    IF TG_OP = 'INSERT' THEN
-        INSERT INTO audit_logs (table_name, operation, sample_id, new_data)
-        VALUES ('voice_samples', 'INSERT', NEW.sample_id, row_to_json(NEW));
-    ELSIF TG_OP = 'UPDATE' THEN
-        INSERT INTO audit_logs (table_name, operation, sample_id, old_data, new_data)
-        VALUES ('voice_samples', 'UPDATE', OLD.sample_id, row_to_json(OLD), row_to_json(NEW));
-    ELSIF TG_OP = 'DELETE' THEN
-        INSERT INTO audit_logs (table_name, operation, sample_id, old_data)
-        VALUES ('voice_samples', 'DELETE', OLD.sample_id, row_to_json(OLD));
-    END IF;
-    RETURN NULL;
-END;
-$$ LANGUAGE plpgsql;
+FOR EACH ROW EXECUTE FUNCTION notify_vector_change('face', 'feature_vector');
 
-CREATE TRIGGER voice_samples_audit_trigger
+CREATE TRIGGER voice_samples_index_notify_trigger
 AFTER INSERT OR UPDATE OR DELETE ON voice_samples
-FOR EACH ROW EXECUTE FUNCTION log_voice_samples_change();
+FOR EACH ROW EXECUTE FUNCTION notify_vector_change('voice', 'audio_vector');
 
-CREATE OR REPLACE FUNCTION log_signature_samples_change()
-RETURNS TRIGGER AS $$
-BEGIN
-    IF TG_OP = 'INSERT' THEN
-        INSERT INTO audit_logs (table_name, operation, sample_id, new_data)
-        VALUES ('signature_samples', 'INSERT', NEW.sample_id, row_to_json(NEW));
-    ELSIF TG_OP = 'UPDATE' THEN
-        INSERT INTO audit_logs (table_name, operation, sample_id, old_data, new_data)
-        VALUES ('signature_samples', 'UPDATE', OLD.sample_id, row_to_json(OLD), row_to_json(NEW));
-    ELSIF TG_OP = 'DELETE' THEN
-        INSERT INTO audit_logs (table_name, operation, sample_id, old_data)
-        VALUES ('signature_samples', 'DELETE', OLD.sample_id, row_to_json(OLD));
-    END IF;
-    RETURN NULL;
-END;
-$$ LANGUAGE plpgsql;
-
-CREATE TRIGGER signature_samples_audit_trigger
+CREATE TRIGGER signature_samples_index_notify_trigger
 AFTER INSERT OR UPDATE OR DELETE ON signature_samples
-FOR EACH ROW EXECUTE FUNCTION log_signature_samples_change();
+FOR EACH ROW EXECUTE FUNCTION notify_vector_change('signature', 'signature_vector');
+
+-- ============= ПОЧАСОВЫЕ СВОДКИ ЖУРНАЛОВ =============
+-- Аналитика читает сводки (O(число часов)), а не журналы целиком. Сводки пополняются
+-- триггерами на уровне оператора: одна агрегированная вставка на оператор INSERT в журнал.
+-- Удаление старых партиций журналов сводки не трогает — история в них сохраняется.
+
+CREATE TABLE IF NOT EXISTS audit_rollup_hourly (
+    bucket       TIMESTAMP    NOT NULL,
+    table_name   TEXT         NOT NULL,
+    changed_by   TEXT         NOT NULL,
+    operation    VARCHAR(10)  NOT NULL,
+    changes      BIGINT       NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, table_name, changed_by, operation)
+);
 
-CREATE OR REPLACE FUNCTION log_cameras_change()
-RETURNS TRIGGER AS $$
-BEGIN
-    IF TG_OP = 'INSERT' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, new_data)
-        VALUES ('cameras', 'INSERT', NEW.sensor_id, row_to_json(NEW));
-    ELSIF TG_OP = 'UPDATE' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, old_data, new_data)
-        VALUES ('cameras', 'UPDATE', OLD.sensor_id, row_to_json(OLD), row_to_json(NEW));
-    ELSIF TG_OP = 'DELETE' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, old_data)
-        VALUES ('cameras', 'DELETE', OLD.sensor_id, row_to_json(OLD));
-    END IF;
-    RETURN NULL;
-END;
-$$ LANGUAGE plpgsql;
+CREATE TABLE IF NOT EXISTS search_rollup_hourly (
+    bucket            TIMESTAMP    NOT NULL,
+    search_type       VARCHAR(20)  NOT NULL,
+    searches          BIGINT       NOT NULL DEFAULT 0,
+    hits              BIGINT       NOT NULL DEFAULT 0,   -- поиски с candidates_found > 0
+    candidates_total  BIGINT       NOT NULL DEFAULT 0,
+    time_total_ms     FLOAT        NOT NULL DEFAULT 0,
+    time_max_ms       FLOAT        NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, search_type)
+);
 
-CREATE TRIGGER cameras_audit_trigger
-AFTER INSERT OR UPDATE OR DELETE ON cameras
-FOR EACH ROW EXECUTE FUNCTION log_cameras_change();
+-- Гистограмма времени поиска: le_ms — верхняя граница корзины (Infinity для последней)
+CREATE TABLE IF NOT EXISTS search_latency_hourly (
+    bucket       TIMESTAMP    NOT NULL,
+    search_type  VARCHAR(20)  NOT NULL,
+    le_ms        FLOAT        NOT NULL,
+    searches     BIGINT       NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, search_type, le_ms)
+);
 
-CREATE OR REPLACE FUNCTION log_microphones_change()
+CREATE OR REPLACE FUNCTION search_latency_bound(p_time_ms FLOAT)
+RETURNS FLOAT AS $$
+    SELECT COALESCE(
+        (SELECT b FROM unnest(ARRAY[1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]::FLOAT[]) AS b
+         WHERE p_time_ms <= b ORDER BY b LIMIT 1),
+        'Infinity'::FLOAT)
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Строки упорядочены по ключу сводки, чтобы параллельные вставки
+-- блокировали общие строки в одном порядке
+CREATE OR REPLACE FUNCTION rollup_audit_logs()
 RETURNS TRIGGER AS $$
 BEGIN
-    IF TG_OP = 'INSERT' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, new_data)
-        VALUES ('microphones', 'INSERT', NEW.sensor_id, row_to_json(NEW));
-    ELSIF TG_OP = 'UPDATE' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, old_data, new_data)
-        VALUES ('microphones', 'UPDATE', OLD.sensor_id, row_to_json(OLD), row_to_json(NEW));
-    ELSIF TG_OP = 'DELETE' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, old_data)
-        VALUES ('microphones', 'DELETE', OLD.sensor_id, row_to_json(OLD));
-    END IF;
+    INSERT INTO audit_rollup_hourly (bucket, table_name, changed_by, operation, changes)
+    SELECT date_trunc('hour', timestamp), table_name, changed_by, operation, count(*)
+    FROM new_rows
+    GROUP BY 1, 2, 3, 4
+    ORDER BY 1, 2, 3, 4
+    ON CONFLICT (bucket, table_name, changed_by, operation)
+    DO UPDATE SET changes = audit_rollup_hourly.changes + EXCLUDED.changes;
     RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER microphones_audit_trigger
-AFTER INSERT OR UPDATE OR DELETE ON microphones
-FOR EACH ROW EXECUTE FUNCTION log_microphones_change();
-
-CREATE OR REPLACE FUNCTION log_signature_pads_change()
+CREATE OR REPLACE FUNCTION rollup_search_logs()
 RETURNS TRIGGER AS $$
 BEGIN
-    IF TG_OP = 'INSERT' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, new_data)
-        VALUES ('signature_pads', 'INSERT', NEW.sensor_id, row_to_json(NEW));
-    ELSIF TG_OP = 'UPDATE' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, old_data, new_data)
-        VALUES ('signature_pads', 'UPDATE', OLD.sensor_id, row_to_json(OLD), row_to_json(NEW));
-    ELSIF TG_OP = 'DELETE' THEN
-        INSERT INTO audit_logs (table_name, operation, sensor_id, old_data)
-        VALUES ('signature_pads', 'DELETE', OLD.sensor_id, row_to_json(OLD));
-    END IF;
+    INSERT INTO search_rollup_hourly (bucket, search_type, searches, hits,
+                                      candidates_total, time_total_ms, time_max_ms)
+    SELECT date_trunc('hour', timestamp), search_type, count(*),
+           count(*) FILTER (WHERE candidates_found > 0),
+           sum(candidates_found), sum(search_time_ms), max(search_time_ms)
+    FROM new_rows
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (bucket, search_type) DO UPDATE SET
+        searches = search_rollup_hourly.searches + EXCLUDED.searches,
+        hits = search_rollup_hourly.hits + EXCLUDED.hits,
+        candidates_total = search_rollup_hourly.candidates_total + EXCLUDED.candidates_total,
+        time_total_ms = search_rollup_hourly.time_total_ms + EXCLUDED.time_total_ms,
+        time_max_ms = GREATEST(search_rollup_hourly.time_max_ms, EXCLUDED.time_max_ms);
+
+    INSERT INTO search_latency_hourly (bucket, search_type, le_ms, searches)
+    SELECT date_trunc('hour', timestamp), search_type, search_latency_bound(search_time_ms), count(*)
+    FROM new_rows
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (bucket, search_type, le_ms)
+    DO UPDATE SET searches = search_latency_hourly.searches + EXCLUDED.searches;
     RETURN NULL;
 END;
 $$ LANGUAGE plpgsql;
 
-CREATE TRIGGER signature_pads_audit_trigger
-AFTER INSERT OR UPDATE OR DELETE ON signature_pads
-FOR EACH ROW EXECUTE FUNCTION log_signature_pads_change();
+CREATE TRIGGER audit_logs_rollup_trigger
+AFTER INSERT ON audit_logs REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION rollup_audit_logs();
 
-CREATE INDEX idx_audit_logs_table ON audit_logs(table_name);
-CREATE INDEX idx_audit_logs_timestamp ON audit_logs(timestamp);
-CREATE INDEX idx_audit_logs_user ON audit_logs(changed_by);
+CREATE TRIGGER search_logs_rollup_trigger
+AFTER INSERT ON search_logs REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION rollup_search_logs();
 
 -- ============= ИНДЕКСЫ ДЛЯ МНОГОУРОВНЕВОГО ПОИСКА =============
 
 -- 1. Быстрые индексы для предфильтрации
 CREATE INDEX idx_samples_type_status ON samples(sample_type, status);
 CREATE INDEX idx_subjects_active ON subjects(subject_id) WHERE is_active = TRUE;
+-- Образцы пользователя: сводка по пользователям (get_users_summary) и его профиль
+CREATE INDEX idx_samples_subject_active ON samples(subject_id, sample_type) WHERE status = 'active';
 
 -- 2. Составные индексы для первого уровня фильтрации
 CREATE INDEX idx_samples_composite ON samples(sample_type, status) 
@@ -0,0 +1,65 @@
+-- ============= УВЕДОМЛЕНИЯ ОБ ИЗМЕНЕНИЯХ ДЛЯ ИНДЕКСОВ =============
+-- Канал biometric_index, полезная нагрузка — JSON:
+-- {"sample_id": ..., "modality": "face|voice|signature", "op": "insert|update|status|delete", "status": ...}
+-- Векторы в уведомление не попадают (лимит pg_notify — 8000 байт), слушатель дочитывает их сам.
+-- Новые базы получают эти триггеры из 01_create_tables.sql; скрипт нужен для баз,
+-- созданных раньше, и безопасен при повторном запуске.
+
+CREATE OR REPLACE FUNCTION notify_samples_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Вставка в samples не уведомляет: вектора ещё нет, событие придёт от таблицы модальности
+    IF TG_OP = 'UPDATE' THEN
+        IF NEW.status IS DISTINCT FROM OLD.status OR NEW.subject_id IS DISTINCT FROM OLD.subject_id THEN
+            PERFORM pg_notify('biometric_index', json_build_object(
+                'sample_id', NEW.sample_id, 'modality', NEW.sample_type,
+                'op', 'status', 'status', NEW.status)::text);
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('biometric_index', json_build_object(
+            'sample_id', OLD.sample_id, 'modality', OLD.sample_type,
+            'op', 'delete', 'status', OLD.status)::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS samples_index_notify_trigger ON samples;
+CREATE TRIGGER samples_index_notify_trigger
+AFTER UPDATE OR DELETE ON samples
+FOR EACH ROW EXECUTE FUNCTION notify_samples_change();
+
+-- TG_ARGV[0] — модальность, TG_ARGV[1] — столбец с вектором
+CREATE OR REPLACE FUNCTION notify_vector_change()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM pg_notify('biometric_index', json_build_object(
+            'sample_id', NEW.sample_id, 'modality', TG_ARGV[0], 'op', 'insert')::text);
+    ELSIF TG_OP = 'UPDATE' THEN
+        IF to_jsonb(NEW) -> TG_ARGV[1] IS DISTINCT FROM to_jsonb(OLD) -> TG_ARGV[1] THEN
+            PERFORM pg_notify('biometric_index', json_build_object(
+                'sample_id', NEW.sample_id, 'modality', TG_ARGV[0], 'op', 'update')::text);
+        END IF;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM pg_notify('biometric_index', json_build_object(
+            'sample_id', OLD.sample_id, 'modality', TG_ARGV[0], 'op', 'delete')::text);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS face_samples_index_notify_trigger ON face_samples;
+CREATE TRIGGER face_samples_index_notify_trigger
+AFTER INSERT OR UPDATE OR DELETE ON face_samples
+FOR EACH ROW EXECUTE FUNCTION notify_vector_change('face', 'feature_vector');
+
+DROP TRIGGER IF EXISTS voice_samples_index_notify_trigger ON voice_samples;
+CREATE TRIGGER voice_samples_index_notify_trigger
+AFTER INSERT OR UPDATE OR DELETE ON voice_samples
+FOR EACH ROW EXECUTE FUNCTION notify_vector_change('voice', 'audio_vector');
+
+DROP TRIGGER IF EXISTS signature_samples_index_notify_trigger ON signature_samples;
+CREATE TRIGGER signature_samples_index_notify_trigger
+AFTER INSERT OR UPDATE OR DELETE ON signature_samples
+FOR EACH ROW EXECUTE FUNCTION notify_vector_change('signature', 'signature_vector');
@@ -0,0 +1,37 @@
+-- ============= ВЕКТОРЫ В BYTEA (FLOAT32) ВМЕСТО JSONB =============
+-- Для баз, созданных до перехода на BYTEA. Старые JSONB-столбцы переименовываются
+-- в *_json, новые заполняются скриптом:
+--     python -m src.backfill_vectors
+-- Пока строка не перенесена, её вектор NULL и в индекс она не попадает.
+-- После проверки старые столбцы удаляются: python -m src.backfill_vectors --drop-json
+-- Если в базе ещё построчные триггеры аудита, копирующие всю строку, до заполнения
+-- примените sql/05_statement_audit.sql — иначе каждый перенос попадёт в audit_logs целиком.
+
+-- Векторы (и новые, и переименованные JSONB) не копируются в audit_logs:
+-- без этого заполнение записало бы в аудит оба представления каждого вектора
+CREATE TABLE IF NOT EXISTS audit_excluded_columns (
+    table_name   TEXT NOT NULL,
+    column_name  TEXT NOT NULL,
+    PRIMARY KEY (table_name, column_name)
+);
+
+INSERT INTO audit_excluded_columns (table_name, column_name) VALUES
+    ('face_samples', 'feature_vector'),
+    ('voice_samples', 'audio_vector'),
+    ('signature_samples', 'signature_vector'),
+    ('face_samples', 'feature_vector_json'),
+    ('voice_samples', 'audio_vector_json'),
+    ('signature_samples', 'signature_vector_json')
+ON CONFLICT DO NOTHING;
+
+ALTER TABLE face_samples RENAME COLUMN feature_vector TO feature_vector_json;
+ALTER TABLE face_samples ADD COLUMN feature_vector BYTEA
+    CONSTRAINT face_samples_feature_vector_dim CHECK (octet_length(feature_vector) = 4 * 128);
+
+ALTER TABLE voice_samples RENAME COLUMN audio_vector TO audio_vector_json;
+ALTER TABLE voice_samples ADD COLUMN audio_vector BYTEA
+    CONSTRAINT voice_samples_audio_vector_dim CHECK (octet_length(audio_vector) = 4 * 192);
+
+ALTER TABLE signature_samples RENAME COLUMN signature_vector TO signature_vector_json;
+ALTER TABLE signature_samples ADD COLUMN signature_vector BYTEA
+    CONSTRAINT signature_samples_signature_vector_dim CHECK (octet_length(signature_vector) = 4 * 256);
@@ -0,0 +1,32 @@
+-- ============= РЕЕСТР СЕНСОРОВ =============
+-- Раньше каждая регистрация образца добавляла новую строку "Generic {type} Sensor"
+-- (и всегда с sensor_type = 'camera'). Теперь сенсор ищется по
+-- (sensor_name, sensor_type, manufacturer) и создаётся один раз (utils.db_utils.get_sensor_id).
+-- Скрипт исправляет типы, сводит дубликаты к одной строке и добавляет уникальный индекс.
+
+BEGIN;
+
+UPDATE sensors SET sensor_type = 'microphone'
+WHERE sensor_name = 'Generic voice Sensor' AND sensor_type <> 'microphone';
+UPDATE sensors SET sensor_type = 'signature_pad'
+WHERE sensor_name = 'Generic signature Sensor' AND sensor_type <> 'signature_pad';
+
+-- Для каждой группы дубликатов оставляем сенсор с наименьшим id
+CREATE TEMP TABLE sensor_merge ON COMMIT DROP AS
+SELECT sensor_id,
+       min(sensor_id) OVER (PARTITION BY sensor_name, sensor_type, manufacturer) AS keep_id
+FROM sensors
+WHERE manufacturer IS NOT NULL;
+DELETE FROM sensor_merge WHERE sensor_id = keep_id;
+
+UPDATE samples s SET sensor_id = m.keep_id
+FROM sensor_merge m WHERE s.sensor_id = m.sensor_id;
+UPDATE search_logs l SET sensor_id = m.keep_id
+FROM sensor_merge m WHERE l.sensor_id = m.sensor_id;
+
+DELETE FROM sensors WHERE sensor_id IN (SELECT sensor_id FROM sensor_merge);
+
+CREATE UNIQUE INDEX IF NOT EXISTS sensors_name_type_manufacturer_key
+    ON sensors (sensor_name, sensor_type, manufacturer);
+
+COMMIT;
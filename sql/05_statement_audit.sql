@@ -0,0 +1,230 @@
+-- ============= АУДИТ НА УРОВНЕ ОПЕРАТОРА =============
+-- Для баз, созданных со старыми построчными триггерами аудита: каждая строка
+-- *_samples копировала в audit_logs весь вектор через row_to_json.
+-- Новые триггеры пишут аудит одной вставкой на оператор (таблицы переходов),
+-- столбцы из audit_excluded_columns заменяются хэшем и размерностью.
+
+BEGIN;
+
+DROP TRIGGER IF EXISTS subjects_audit_trigger ON subjects;
+DROP TRIGGER IF EXISTS samples_audit_trigger ON samples;
+DROP TRIGGER IF EXISTS sensors_audit_trigger ON sensors;
+DROP TRIGGER IF EXISTS face_samples_audit_trigger ON face_samples;
+DROP TRIGGER IF EXISTS voice_samples_audit_trigger ON voice_samples;
+DROP TRIGGER IF EXISTS signature_samples_audit_trigger ON signature_samples;
+DROP TRIGGER IF EXISTS cameras_audit_trigger ON cameras;
+DROP TRIGGER IF EXISTS microphones_audit_trigger ON microphones;
+DROP TRIGGER IF EXISTS signature_pads_audit_trigger ON signature_pads;
+
+DROP FUNCTION IF EXISTS log_subjects_change();
+DROP FUNCTION IF EXISTS log_samples_change();
+DROP FUNCTION IF EXISTS log_sensors_change();
+DROP FUNCTION IF EXISTS log_face_samples_change();
+DROP FUNCTION IF EXISTS log_voice_samples_change();
+DROP FUNCTION IF EXISTS log_signature_samples_change();
+DROP FUNCTION IF EXISTS log_cameras_change();
+DROP FUNCTION IF EXISTS log_microphones_change();
+DROP FUNCTION IF EXISTS log_signature_pads_change();
+
+-- Столбцы, которые не копируются в audit_logs целиком: вместо значения пишется
+-- заглушка {"sha256": ..., "dim": ...}. Список можно дополнять без изменения триггеров.
+CREATE TABLE IF NOT EXISTS audit_excluded_columns (
+    table_name   TEXT NOT NULL,
+    column_name  TEXT NOT NULL,
+    PRIMARY KEY (table_name, column_name)
+);
+
+INSERT INTO audit_excluded_columns (table_name, column_name) VALUES
+    ('face_samples', 'feature_vector'),
+    ('voice_samples', 'audio_vector'),
+    ('signature_samples', 'signature_vector')
+ON CONFLICT DO NOTHING;
+
+-- Строка для аудита: исключённые столбцы заменяются хэшем и размерностью.
+-- BYTEA приходит как '\x...' (float32, 4 байта на компоненту), JSONB-массив — как есть.
+CREATE OR REPLACE FUNCTION audit_row(p_row JSONB, p_excluded TEXT[])
+RETURNS JSONB AS $$
+    SELECT CASE WHEN p_excluded IS NULL THEN p_row
+    ELSE (p_row - p_excluded) || COALESCE((
+        SELECT jsonb_object_agg(key, CASE
+            WHEN jsonb_typeof(value) = 'null' THEN value
+            WHEN jsonb_typeof(value) = 'array' THEN jsonb_build_object(
+                'sha256', encode(sha256(convert_to(value::text, 'UTF8')), 'hex'),
+                'dim', jsonb_array_length(value))
+            ELSE jsonb_build_object(
+                'sha256', encode(sha256(decode(substr(value #>> '{}', 3), 'hex')), 'hex'),
+                'dim', (length(value #>> '{}') - 2) / 8)
+            END)
+        FROM jsonb_each(p_row)
+        WHERE key = ANY(p_excluded)
+    ), '{}'::jsonb)
+    END
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Аудит на уровне оператора: одна вставка в audit_logs на весь INSERT/UPDATE/DELETE
+-- через таблицы переходов. TG_ARGV[0] — первичный ключ таблицы (по нему сопоставляются
+-- старые и новые строки при UPDATE), TG_ARGV[1] — столбец audit_logs для ссылки
+-- (subject_id, sensor_id, sample_id или '' — без ссылки).
+-- При DELETE ссылка не заполняется: строка уже удалена, данные остаются в old_data.
+CREATE OR REPLACE FUNCTION audit_statement()
+RETURNS TRIGGER AS $$
+DECLARE
+    key_column TEXT := TG_ARGV[0];
+    ref_column TEXT := NULLIF(TG_ARGV[1], '');
+    excluded TEXT[];
+BEGIN
+    SELECT array_agg(column_name) INTO excluded
+    FROM audit_excluded_columns WHERE table_name = TG_TABLE_NAME;
+
+    IF TG_OP = 'INSERT' THEN
+        INSERT INTO audit_logs (table_name, operation, subject_id, sensor_id, sample_id, new_data)
+        SELECT TG_TABLE_NAME, 'INSERT',
+               CASE WHEN ref_column = 'subject_id' THEN (r ->> ref_column)::int END,
+               CASE WHEN ref_column = 'sensor_id' THEN (r ->> ref_column)::int END,
+               CASE WHEN ref_column = 'sample_id' THEN (r ->> ref_column)::int END,
+               audit_row(r, excluded)
+        FROM (SELECT to_jsonb(n) AS r FROM new_rows n) t;
+    ELSIF TG_OP = 'UPDATE' THEN
+        INSERT INTO audit_logs (table_name, operation, subject_id, sensor_id, sample_id, old_data, new_data)
+        SELECT TG_TABLE_NAME, 'UPDATE',
+               CASE WHEN ref_column = 'subject_id' THEN (COALESCE(o.r, n.r) ->> ref_column)::int END,
+               CASE WHEN ref_column = 'sensor_id' THEN (COALESCE(o.r, n.r) ->> ref_column)::int END,
+               CASE WHEN ref_column = 'sample_id' THEN (COALESCE(o.r, n.r) ->> ref_column)::int END,
+               audit_row(o.r, excluded), audit_row(n.r, excluded)
+        FROM (SELECT to_jsonb(x) AS r FROM old_rows x) o
+        FULL JOIN (SELECT to_jsonb(x) AS r FROM new_rows x) n
+            ON o.r -> key_column = n.r -> key_column;
+    ELSIF TG_OP = 'DELETE' THEN
+        INSERT INTO audit_logs (table_name, operation, old_data)
+        SELECT TG_TABLE_NAME, 'DELETE', audit_row(to_jsonb(o), excluded)
+        FROM old_rows o;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql SET bytea_output = 'hex';
+
+-- Старые JSONB-столбцы, если они ещё не удалены (см. sql/03_binary_vectors.sql)
+INSERT INTO audit_excluded_columns (table_name, column_name) VALUES
+    ('face_samples', 'feature_vector_json'),
+    ('voice_samples', 'audio_vector_json'),
+    ('signature_samples', 'signature_vector_json')
+ON CONFLICT DO NOTHING;
+
+DROP TRIGGER IF EXISTS subjects_audit_insert ON subjects;
+CREATE TRIGGER subjects_audit_insert
+AFTER INSERT ON subjects REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('subject_id', 'subject_id');
+DROP TRIGGER IF EXISTS subjects_audit_update ON subjects;
+CREATE TRIGGER subjects_audit_update
+AFTER UPDATE ON subjects REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('subject_id', 'subject_id');
+DROP TRIGGER IF EXISTS subjects_audit_delete ON subjects;
+CREATE TRIGGER subjects_audit_delete
+AFTER DELETE ON subjects REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('subject_id', 'subject_id');
+
+DROP TRIGGER IF EXISTS samples_audit_insert ON samples;
+CREATE TRIGGER samples_audit_insert
+AFTER INSERT ON samples REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', '');
+DROP TRIGGER IF EXISTS samples_audit_update ON samples;
+CREATE TRIGGER samples_audit_update
+AFTER UPDATE ON samples REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', '');
+DROP TRIGGER IF EXISTS samples_audit_delete ON samples;
+CREATE TRIGGER samples_audit_delete
+AFTER DELETE ON samples REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', '');
+
+DROP TRIGGER IF EXISTS sensors_audit_insert ON sensors;
+CREATE TRIGGER sensors_audit_insert
+AFTER INSERT ON sensors REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+DROP TRIGGER IF EXISTS sensors_audit_update ON sensors;
+CREATE TRIGGER sensors_audit_update
+AFTER UPDATE ON sensors REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+DROP TRIGGER IF EXISTS sensors_audit_delete ON sensors;
+CREATE TRIGGER sensors_audit_delete
+AFTER DELETE ON sensors REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+
+DROP TRIGGER IF EXISTS face_samples_audit_insert ON face_samples;
+CREATE TRIGGER face_samples_audit_insert
+AFTER INSERT ON face_samples REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+DROP TRIGGER IF EXISTS face_samples_audit_update ON face_samples;
+CREATE TRIGGER face_samples_audit_update
+AFTER UPDATE ON face_samples REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+DROP TRIGGER IF EXISTS face_samples_audit_delete ON face_samples;
+CREATE TRIGGER face_samples_audit_delete
+AFTER DELETE ON face_samples REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+
+DROP TRIGGER IF EXISTS voice_samples_audit_insert ON voice_samples;
+CREATE TRIGGER voice_samples_audit_insert
+AFTER INSERT ON voice_samples REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+DROP TRIGGER IF EXISTS voice_samples_audit_update ON voice_samples;
+CREATE TRIGGER voice_samples_audit_update
+AFTER UPDATE ON voice_samples REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+DROP TRIGGER IF EXISTS voice_samples_audit_delete ON voice_samples;
+CREATE TRIGGER voice_samples_audit_delete
+AFTER DELETE ON voice_samples REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+
+DROP TRIGGER IF EXISTS signature_samples_audit_insert ON signature_samples;
+CREATE TRIGGER signature_samples_audit_insert
+AFTER INSERT ON signature_samples REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+DROP TRIGGER IF EXISTS signature_samples_audit_update ON signature_samples;
+CREATE TRIGGER signature_samples_audit_update
+AFTER UPDATE ON signature_samples REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+DROP TRIGGER IF EXISTS signature_samples_audit_delete ON signature_samples;
+CREATE TRIGGER signature_samples_audit_delete
+AFTER DELETE ON signature_samples REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sample_id', 'sample_id');
+
+DROP TRIGGER IF EXISTS cameras_audit_insert ON cameras;
+CREATE TRIGGER cameras_audit_insert
+AFTER INSERT ON cameras REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+DROP TRIGGER IF EXISTS cameras_audit_update ON cameras;
+CREATE TRIGGER cameras_audit_update
+AFTER UPDATE ON cameras REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+DROP TRIGGER IF EXISTS cameras_audit_delete ON cameras;
+CREATE TRIGGER cameras_audit_delete
+AFTER DELETE ON cameras REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+
+DROP TRIGGER IF EXISTS microphones_audit_insert ON microphones;
+CREATE TRIGGER microphones_audit_insert
+AFTER INSERT ON microphones REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+DROP TRIGGER IF EXISTS microphones_audit_update ON microphones;
+CREATE TRIGGER microphones_audit_update
+AFTER UPDATE ON microphones REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+DROP TRIGGER IF EXISTS microphones_audit_delete ON microphones;
+CREATE TRIGGER microphones_audit_delete
+AFTER DELETE ON microphones REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+
+DROP TRIGGER IF EXISTS signature_pads_audit_insert ON signature_pads;
+CREATE TRIGGER signature_pads_audit_insert
+AFTER INSERT ON signature_pads REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+DROP TRIGGER IF EXISTS signature_pads_audit_update ON signature_pads;
+CREATE TRIGGER signature_pads_audit_update
+AFTER UPDATE ON signature_pads REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+DROP TRIGGER IF EXISTS signature_pads_audit_delete ON signature_pads;
+CREATE TRIGGER signature_pads_audit_delete
+AFTER DELETE ON signature_pads REFERENCING OLD TABLE AS old_rows
+FOR EACH STATEMENT EXECUTE FUNCTION audit_statement('sensor_id', 'sensor_id');
+
+COMMIT;
@@ -0,0 +1,147 @@
+-- ============= ПАРТИЦИОНИРОВАНИЕ И ИНДЕКСЫ ЖУРНАЛОВ =============
+-- Для баз, созданных до партиционирования: audit_logs и search_logs пересоздаются
+-- как таблицы с помесячными партициями по timestamp, старые строки переносятся,
+-- идентификаторы продолжают прежние последовательности.
+-- Обслуживание (новые партиции наперёд и удаление старых по сроку хранения):
+--     python -m utils.log_utils --maintain
+
+BEGIN;
+
+-- Помесячные партиции журналов: <таблица>_YYYY_MM плюс <таблица>_default для строк вне диапазона.
+-- ensure_log_partitions создаёт партиции от p_from до текущего месяца + p_months_ahead;
+-- если в default уже попали строки нового месяца, они переносятся в созданную партицию.
+CREATE OR REPLACE FUNCTION ensure_log_partitions(p_table TEXT, p_from DATE DEFAULT CURRENT_DATE,
+                                                 p_months_ahead INT DEFAULT 3)
+RETURNS INT AS $$
+DECLARE
+    month_start DATE := date_trunc('month', p_from)::date;
+    last_month DATE := (date_trunc('month', CURRENT_DATE) + make_interval(months => p_months_ahead))::date;
+    default_name TEXT := p_table || '_default';
+    partition_name TEXT;
+    has_rows BOOLEAN;
+    created INT := 0;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        partition_name := p_table || '_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            has_rows := FALSE;
+            IF to_regclass(default_name) IS NOT NULL THEN
+                EXECUTE format('SELECT EXISTS (SELECT 1 FROM %I WHERE timestamp >= %L AND timestamp < %L)',
+                               default_name, month_start, month_start + interval '1 month')
+                INTO has_rows;
+            END IF;
+            IF has_rows THEN
+                EXECUTE format('CREATE TEMP TABLE log_partition_move ON COMMIT DROP AS
+                                SELECT * FROM %I WHERE timestamp >= %L AND timestamp < %L',
+                               default_name, month_start, month_start + interval '1 month');
+                EXECUTE format('DELETE FROM %I WHERE timestamp >= %L AND timestamp < %L',
+                               default_name, month_start, month_start + interval '1 month');
+            END IF;
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                           partition_name, p_table, month_start, month_start + interval '1 month');
+            IF has_rows THEN
+                EXECUTE format('INSERT INTO %I SELECT * FROM log_partition_move', partition_name);
+                DROP TABLE log_partition_move;
+            END IF;
+            created := created + 1;
+        END IF;
+        month_start := (month_start + interval '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Удаляет партиции месяцев старше p_keep_months полных месяцев до текущего
+CREATE OR REPLACE FUNCTION drop_old_log_partitions(p_table TEXT, p_keep_months INT)
+RETURNS INT AS $$
+DECLARE
+    cutoff DATE := (date_trunc('month', CURRENT_DATE) - make_interval(months => p_keep_months))::date;
+    partition_name TEXT;
+    month_text TEXT;
+    dropped INT := 0;
+BEGIN
+    FOR partition_name IN
+        SELECT c.relname FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = p_table::regclass
+    LOOP
+        month_text := substring(partition_name FROM '_(\d{4}_\d{2})$');
+        CONTINUE WHEN month_text IS NULL;
+        IF to_date(month_text, 'YYYY_MM') < cutoff THEN
+            EXECUTE format('DROP TABLE %I', partition_name);
+            dropped := dropped + 1;
+        END IF;
+    END LOOP;
+    RETURN dropped;
+END;
+$$ LANGUAGE plpgsql;
+
+-- audit_logs
+ALTER TABLE audit_logs RENAME TO audit_logs_unpartitioned;
+ALTER INDEX audit_logs_pkey RENAME TO audit_logs_unpartitioned_pkey;
+ALTER TABLE audit_logs_unpartitioned ALTER COLUMN log_id DROP DEFAULT;
+ALTER SEQUENCE audit_logs_log_id_seq OWNED BY NONE;
+
+CREATE TABLE audit_logs (
+    log_id       INT          NOT NULL DEFAULT nextval('audit_logs_log_id_seq'),
+    timestamp    TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    subject_id   INT          REFERENCES subjects(subject_id) ON DELETE SET NULL,
+    sensor_id    INT          REFERENCES sensors(sensor_id) ON DELETE SET NULL,
+    sample_id    INT          REFERENCES samples(sample_id) ON DELETE SET NULL,
+    table_name   TEXT         NOT NULL,
+    operation    VARCHAR(10)  NOT NULL CHECK (operation IN ('INSERT','UPDATE','DELETE')),
+    old_data     JSONB,
+    new_data     JSONB,
+    changed_by   TEXT         NOT NULL DEFAULT CURRENT_USER,
+    PRIMARY KEY (log_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+ALTER SEQUENCE audit_logs_log_id_seq OWNED BY audit_logs.log_id;
+
+CREATE TABLE audit_logs_default PARTITION OF audit_logs DEFAULT;
+SELECT ensure_log_partitions('audit_logs',
+    COALESCE((SELECT min(timestamp)::date FROM audit_logs_unpartitioned), CURRENT_DATE));
+INSERT INTO audit_logs SELECT * FROM audit_logs_unpartitioned;
+DROP TABLE audit_logs_unpartitioned;
+
+-- search_logs
+ALTER TABLE search_logs RENAME TO search_logs_unpartitioned;
+ALTER INDEX search_logs_pkey RENAME TO search_logs_unpartitioned_pkey;
+ALTER TABLE search_logs_unpartitioned ALTER COLUMN search_id DROP DEFAULT;
+ALTER SEQUENCE search_logs_search_id_seq OWNED BY NONE;
+
+CREATE TABLE search_logs (
+    search_id          INT          NOT NULL DEFAULT nextval('search_logs_search_id_seq'),
+    timestamp          TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    subject_id         INT          REFERENCES subjects(subject_id) ON DELETE SET NULL,
+    sensor_id          INT          REFERENCES sensors(sensor_id)  ON DELETE SET NULL,
+    sample_id          INT          REFERENCES samples(sample_id)  ON DELETE SET NULL,
+    search_type        VARCHAR(20)  NOT NULL CHECK (search_type IN ('face','voice','signature')),
+    query_vector_type  VARCHAR(20)  NOT NULL CHECK (query_vector_type IN ('face','voice','signature')),
+    candidates_found   INT          NOT NULL,
+    search_time_ms     FLOAT        NOT NULL,
+    threshold_used     FLOAT        NOT NULL,
+    additional_info    JSONB,
+    searched_at        TIMESTAMP    NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (search_id, timestamp)
+) PARTITION BY RANGE (timestamp);
+ALTER SEQUENCE search_logs_search_id_seq OWNED BY search_logs.search_id;
+
+CREATE TABLE search_logs_default PARTITION OF search_logs DEFAULT;
+SELECT ensure_log_partitions('search_logs',
+    COALESCE((SELECT min(timestamp)::date FROM search_logs_unpartitioned), CURRENT_DATE));
+INSERT INTO search_logs SELECT * FROM search_logs_unpartitioned;
+DROP TABLE search_logs_unpartitioned;
+
+-- Журналы пишутся по возрастанию времени: BRIN по timestamp почти ничего не весит
+-- и отсекает блоки при фильтре по дате; B-tree (…, timestamp, id) отдают страницы
+-- в порядке ORDER BY timestamp DESC, id DESC для постраничного (keyset) просмотра.
+CREATE INDEX idx_audit_logs_timestamp_brin ON audit_logs USING brin (timestamp);
+CREATE INDEX idx_audit_logs_timestamp ON audit_logs (timestamp DESC, log_id DESC);
+CREATE INDEX idx_audit_logs_table ON audit_logs (table_name, timestamp DESC, log_id DESC);
+CREATE INDEX idx_audit_logs_user ON audit_logs (changed_by, timestamp DESC, log_id DESC);
+
+CREATE INDEX idx_search_logs_timestamp_brin ON search_logs USING brin (timestamp);
+CREATE INDEX idx_search_logs_timestamp ON search_logs (timestamp DESC, search_id DESC);
+CREATE INDEX idx_search_logs_type ON search_logs (search_type, timestamp DESC, search_id DESC);
+
+COMMIT;
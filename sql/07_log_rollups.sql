@@ -0,0 +1,125 @@
+-- ============= ПОЧАСОВЫЕ СВОДКИ ЖУРНАЛОВ (миграция) =============
+-- Создаёт сводки и триггеры и заполняет сводки по уже накопленным журналам.
+-- Журналы блокируются от записи на время заполнения, чтобы между ним
+-- и включением триггеров не потерялись строки.
+
+BEGIN;
+
+-- Аналитика читает сводки (O(число часов)), а не журналы целиком. Сводки пополняются
+-- триггерами на уровне оператора: одна агрегированная вставка на оператор INSERT в журнал.
+-- Удаление старых партиций журналов сводки не трогает — история в них сохраняется.
+
+CREATE TABLE IF NOT EXISTS audit_rollup_hourly (
+    bucket       TIMESTAMP    NOT NULL,
+    table_name   TEXT         NOT NULL,
+    changed_by   TEXT         NOT NULL,
+    operation    VARCHAR(10)  NOT NULL,
+    changes      BIGINT       NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, table_name, changed_by, operation)
+);
+
+CREATE TABLE IF NOT EXISTS search_rollup_hourly (
+    bucket            TIMESTAMP    NOT NULL,
+    search_type       VARCHAR(20)  NOT NULL,
+    searches          BIGINT       NOT NULL DEFAULT 0,
+    hits              BIGINT       NOT NULL DEFAULT 0,   -- поиски с candidates_found > 0
+    candidates_total  BIGINT       NOT NULL DEFAULT 0,
+    time_total_ms     FLOAT        NOT NULL DEFAULT 0,
+    time_max_ms       FLOAT        NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, search_type)
+);
+
+-- Гистограмма времени поиска: le_ms — верхняя граница корзины (Infinity для последней)
+CREATE TABLE IF NOT EXISTS search_latency_hourly (
+    bucket       TIMESTAMP    NOT NULL,
+    search_type  VARCHAR(20)  NOT NULL,
+    le_ms        FLOAT        NOT NULL,
+    searches     BIGINT       NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, search_type, le_ms)
+);
+
+CREATE OR REPLACE FUNCTION search_latency_bound(p_time_ms FLOAT)
+RETURNS FLOAT AS $$
+    SELECT COALESCE(
+        (SELECT b FROM unnest(ARRAY[1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]::FLOAT[]) AS b
+         WHERE p_time_ms <= b ORDER BY b LIMIT 1),
+        'Infinity'::FLOAT)
+$$ LANGUAGE sql IMMUTABLE;
+
+-- Строки упорядочены по ключу сводки, чтобы параллельные вставки
+-- блокировали общие строки в одном порядке
+CREATE OR REPLACE FUNCTION rollup_audit_logs()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO audit_rollup_hourly (bucket, table_name, changed_by, operation, changes)
+    SELECT date_trunc('hour', timestamp), table_name, changed_by, operation, count(*)
+    FROM new_rows
+    GROUP BY 1, 2, 3, 4
+    ORDER BY 1, 2, 3, 4
+    ON CONFLICT (bucket, table_name, changed_by, operation)
+    DO UPDATE SET changes = audit_rollup_hourly.changes + EXCLUDED.changes;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION rollup_search_logs()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO search_rollup_hourly (bucket, search_type, searches, hits,
+                                      candidates_total, time_total_ms, time_max_ms)
+    SELECT date_trunc('hour', timestamp), search_type, count(*),
+           count(*) FILTER (WHERE candidates_found > 0),
+           sum(candidates_found), sum(search_time_ms), max(search_time_ms)
+    FROM new_rows
+    GROUP BY 1, 2
+    ORDER BY 1, 2
+    ON CONFLICT (bucket, search_type) DO UPDATE SET
+        searches = search_rollup_hourly.searches + EXCLUDED.searches,
+        hits = search_rollup_hourly.hits + EXCLUDED.hits,
+        candidates_total = search_rollup_hourly.candidates_total + EXCLUDED.candidates_total,
+        time_total_ms = search_rollup_hourly.time_total_ms + EXCLUDED.time_total_ms,
+        time_max_ms = GREATEST(search_rollup_hourly.time_max_ms, EXCLUDED.time_max_ms);
+
+    INSERT INTO search_latency_hourly (bucket, search_type, le_ms, searches)
+    SELECT date_trunc('hour', timestamp), search_type, search_latency_bound(search_time_ms), count(*)
+    FROM new_rows
+    GROUP BY 1, 2, 3
+    ORDER BY 1, 2, 3
+    ON CONFLICT (bucket, search_type, le_ms)
+    DO UPDATE SET searches = search_latency_hourly.searches + EXCLUDED.searches;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+LOCK TABLE audit_logs, search_logs IN SHARE ROW EXCLUSIVE MODE;
+
+DELETE FROM audit_rollup_hourly;
+DELETE FROM search_rollup_hourly;
+DELETE FROM search_latency_hourly;
+
+INSERT INTO audit_rollup_hourly (bucket, table_name, changed_by, operation, changes)
+SELECT date_trunc('hour', timestamp), table_name, changed_by, operation, count(*)
+FROM audit_logs GROUP BY 1, 2, 3, 4;
+
+INSERT INTO search_rollup_hourly (bucket, search_type, searches, hits,
+                                  candidates_total, time_total_ms, time_max_ms)
+SELECT date_trunc('hour', timestamp), search_type, count(*),
+       count(*) FILTER (WHERE candidates_found > 0),
+       sum(candidates_found), sum(search_time_ms), max(search_time_ms)
+FROM search_logs GROUP BY 1, 2;
+
+INSERT INTO search_latency_hourly (bucket, search_type, le_ms, searches)
+SELECT date_trunc('hour', timestamp), search_type, search_latency_bound(search_time_ms), count(*)
+FROM search_logs GROUP BY 1, 2, 3;
+
+DROP TRIGGER IF EXISTS audit_logs_rollup_trigger ON audit_logs;
+DROP TRIGGER IF EXISTS search_logs_rollup_trigger ON search_logs;
+CREATE TRIGGER audit_logs_rollup_trigger
+AFTER INSERT ON audit_logs REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION rollup_audit_logs();
+
+CREATE TRIGGER search_logs_rollup_trigger
+AFTER INSERT ON search_logs REFERENCING NEW TABLE AS new_rows
+FOR EACH STATEMENT EXECUTE FUNCTION rollup_search_logs();
+
+COMMIT;
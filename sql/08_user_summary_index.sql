@@ -0,0 +1,4 @@
+-- Индекс для постраничной сводки пользователей (utils.db_utils.get_users_summary):
+-- подсчёт активных образцов страницы субъектов читает только этот индекс.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_samples_subject_active
+    ON samples(subject_id, sample_type) WHERE status = 'active';
@@ -0,0 +1,107 @@
+"""
+Перенос векторов из старых JSONB-столбцов (*_json, см. sql/03_binary_vectors.sql)
+в BYTEA float32. Запуск из корня проекта:
+
+    python -m src.backfill_vectors              # перенести все модальности
+    python -m src.backfill_vectors --drop-json  # удалить JSONB-столбцы, если всё перенесено
+"""
+import argparse
+import json
+import time
+import psycopg2
+from psycopg2.extras import execute_values
+from utils.config import DB_CONFIG, BIOMETRIC_CONFIG
+from utils.vector_codec import encode_vector
+
+BATCH_SIZE = 5000
+
+
+def json_column_exists(cursor, table_name, column_name):
+    cursor.execute("""
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = %s AND column_name = %s
+    """, (table_name, column_name))
+    return cursor.fetchone() is not None
+
+def backfill_modality(conn, biometric_type):
+    config = BIOMETRIC_CONFIG[biometric_type]
+    table_name = config['samples_table']
+    vector_column = config['vector_column']
+    json_column = vector_column + '_json'
+    dim = config['dim']
+
+    cursor = conn.cursor()
+    if not json_column_exists(cursor, table_name, json_column):
+        print(f"{table_name}: столбца {json_column} нет, переносить нечего")
+        return 0, 0
+
+    start = time.perf_counter()
+    converted = 0
+    skipped = []
+    read_cursor = conn.cursor(name=f'backfill_{table_name}')
+    read_cursor.itersize = BATCH_SIZE
+    read_cursor.execute(f"""
+        SELECT sample_id, {json_column}::text FROM {table_name}
+        WHERE {vector_column} IS NULL AND {json_column} IS NOT NULL
+    """)
+    while True:
+        rows = read_cursor.fetchmany(BATCH_SIZE)
+        if not rows:
+            break
+        values = []
+        for sample_id, text in rows:
+            try:
+                values.append((sample_id, psycopg2.Binary(encode_vector(json.loads(text), dim))))
+            except (ValueError, TypeError) as e:
+                skipped.append(sample_id)
+                print(f"{table_name}: образец {sample_id} пропущен: {e}")
+        if values:
+            execute_values(cursor, f"""
+                UPDATE {table_name} AS t SET {vector_column} = v.vector
+                FROM (VALUES %s) AS v(sample_id, vector)
+                WHERE t.sample_id = v.sample_id
+            """, values, page_size=len(values))
+            converted += len(values)
+    read_cursor.close()
+    conn.commit()
+
+    elapsed = time.perf_counter() - start
+    print(f"{table_name}: перенесено {converted} векторов за {elapsed:.2f} с "
+          f"({converted / max(elapsed, 1e-9):.0f} строк/с), пропущено {len(skipped)}")
+    return converted, len(skipped)
+
+def drop_json_columns(conn):
+    cursor = conn.cursor()
+    for config in BIOMETRIC_CONFIG.values():
+        table_name = config['samples_table']
+        json_column = config['vector_column'] + '_json'
+        if not json_column_exists(cursor, table_name, json_column):
+            continue
+        cursor.execute(f"""
+            SELECT count(*) FROM {table_name}
+            WHERE {json_column} IS NOT NULL AND {config['vector_column']} IS NULL
+        """)
+        remaining = cursor.fetchone()[0]
+        if remaining:
+            print(f"{table_name}: {remaining} строк не перенесено, {json_column} оставлен")
+            continue
+        cursor.execute(f"ALTER TABLE {table_name} DROP COLUMN {json_column}")
+        print(f"{table_name}: столбец {json_column} удалён")
+    conn.commit()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Перенос биометрических векторов из JSONB в BYTEA float32")
+    parser.add_argument('--type', choices=list(BIOMETRIC_CONFIG), help="только одна модальность")
+    parser.add_argument('--drop-json', action='store_true', help="удалить перенесённые JSONB-столбцы")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(**DB_CONFIG)
+    try:
+        if args.drop_json:
+            drop_json_columns(conn)
+        else:
+            for biometric_type in ([args.type] if args.type else BIOMETRIC_CONFIG):
+                backfill_modality(conn, biometric_type)
+    finally:
+        conn.close()
@@ -1,4 +1,5 @@
 import face_recognition
+import numpy as np
 import psycopg2
 
 conn = psycopg2.connect(
@@ -14,7 +15,7 @@ image_path = "/data/faces/ivan_new.jpg"
 
 # Загрузка изображения
 image = face_recognition.load_image_file(image_path)
-face_vector = face_recognition.face_encodings(image)[0].tolist()  # 128-мерный вектор
+face_vector = face_recognition.face_encodings(image)[0]  # 128-мерный вектор
 
 # Вставка в БД
 cursor.execute("""
@@ -27,7 +28,7 @@ sample_id = cursor.fetchone()[0]
 cursor.execute("""
     INSERT INTO face_samples (sample_id, image_width, image_height, image_format, feature_vector)
     VALUES (%s, %s, %s, %s, %s)
-""", (sample_id, 640, 480, 'jpg', face_vector))
+""", (sample_id, 640, 480, 'jpg', psycopg2.Binary(np.asarray(face_vector, dtype='<f4').tobytes())))
 
 conn.commit()
 cursor.close()
@@ -0,0 +1,188 @@
+"""Массовая регистрация: разбор каталога, хэширование паролей, дедупликация и перестройка индексов"""
+import pytest
+
+from utils import bulk_enroll as be
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    def execute(self, sql, params=None):
+        values = params[0]
+        if 'FROM subjects' in sql and 'subject_id' in sql:
+            self.result = [(login, self.db['subjects'][login]) for login in values if login in self.db['subjects']]
+        elif 'FROM subjects' in sql:
+            self.result = [(login,) for login in values if login in self.db['subjects']]
+        elif 'FROM samples' in sql:
+            self.result = [(h,) for h in values if h in self.db['samples']]
+        else:
+            raise AssertionError(sql)
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """subjects: login -> subject_id, samples: sample_hash -> sample_id, details: вставленные строки векторов"""
+    def __init__(self):
+        self.db = {'subjects': {}, 'samples': {}, 'details': [], 'password_hashes': {}}
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def fake_execute_values(cursor, sql, rows, page_size=None, fetch=False):
+    db = cursor.db
+    if 'INTO subjects' in sql:
+        created = []
+        for full_name, gender, login, password_hash in rows:
+            if login not in db['subjects']:
+                db['subjects'][login] = len(db['subjects']) + 1
+                db['password_hashes'][login] = password_hash
+                created.append((db['subjects'][login],))
+        return created
+    if 'INTO samples' in sql:
+        result = []
+        for subject_id, sensor_id, sample_type, sample_hash, file_path in rows:
+            # Как UNIQUE (sample_hash) в схеме
+            assert sample_hash not in db['samples'], f"повторная вставка {sample_hash}"
+            db['samples'][sample_hash] = len(db['samples']) + 1
+            result.append((sample_hash, db['samples'][sample_hash]))
+        return result
+    db['details'].extend(rows)
+    return None
+
+
+class SerialPool:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def map(self, fn, items, chunksize=1):
+        return list(map(fn, items))
+
+
+@pytest.fixture
+def fake_db(monkeypatch):
+    monkeypatch.setattr(be, 'execute_values', fake_execute_values)
+    monkeypatch.setattr(be.dbu, 'get_sensor_id', lambda biometric_type, *args, **kwargs: 1)
+    hashed = []
+    monkeypatch.setattr(be.dbu, 'hash_password', lambda password: hashed.append(password) or f'hash:{password}')
+    conn = FakeConnection()
+    conn.hashed = hashed
+    return conn
+
+
+def record(login, sample_hash, biometric_type='face', password='1234'):
+    return ({'login': login, 'full_name': login, 'password': password, 'biometric_type': biometric_type,
+             'file_path': f'/data/{login}/{sample_hash}.jpg'}, [0.0], sample_hash)
+
+
+def enroll(conn, prepared):
+    hashes, rejected = be._hash_passwords(SerialPool(), conn, prepared)
+    assert rejected == []
+    return be._insert_chunk(conn, prepared, hashes)
+
+
+def test_passwords_hashed_once_per_new_login(fake_db):
+    conn = fake_db
+    conn.db['subjects']['old'] = 7
+    prepared = [record('anna', 'a1'), record('anna', 'a2'), record('anna', 'a3', 'voice'),
+                record('old', 'o1'), record('boris', 'b1', password=None)]
+    prepared[-1][0]['password_hash'] = 'ready-hash'
+
+    hashes, rejected = be._hash_passwords(SerialPool(), conn, prepared)
+    assert conn.hashed == ['1234']
+    assert hashes == {'anna': 'hash:1234', 'boris': 'ready-hash'}
+    assert rejected == []
+
+    missing = [record('nopass', 'n1', password=None)]
+    assert be._hash_passwords(SerialPool(), conn, missing)[1] == [missing[0][0]]
+
+
+def test_duplicates_within_chunk_are_skipped(fake_db):
+    conn = fake_db
+    prepared = [record('anna', 'same'), record('anna', 'same'), record('boris', 'b1')]
+
+    created, inserted, duplicates = enroll(conn, prepared)
+
+    assert (created, inserted, duplicates) == (2, 2, 1)
+    assert sorted(conn.db['samples']) == ['b1', 'same']
+    assert len(conn.db['details']) == 2
+    assert conn.db['password_hashes'] == {'anna': 'hash:1234', 'boris': 'hash:1234'}
+
+
+def test_reimport_of_same_files_inserts_nothing(fake_db):
+    conn = fake_db
+    prepared = [record('anna', 'a1'), record('anna', 'a2', 'signature')]
+    assert enroll(conn, prepared) == (1, 2, 0)
+    conn.hashed.clear()
+
+    assert enroll(conn, prepared) == (0, 0, 2)
+    # Субъект уже есть — повторный импорт не хэширует пароль
+    assert conn.hashed == []
+    assert len(conn.db['samples']) == 2 and len(conn.db['details']) == 2
+
+
+def test_scan_directory(tmp_path):
+    for biometric_type, login, name in [('face', 'anna', '1.jpg'), ('face', 'anna', '2.png'),
+                                        ('voice', 'boris', 'hello.wav'), ('unknown', 'x', 'y.jpg')]:
+        folder = tmp_path / biometric_type / login
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / name).write_bytes(b'data')
+    (tmp_path / 'face' / 'stray.jpg').write_bytes(b'data')
+
+    records = be.scan_directory(str(tmp_path), default_password='secret')
+
+    assert [(r['biometric_type'], r['login'], r['file_path']) for r in records] == [
+        ('face', 'anna', str(tmp_path / 'face' / 'anna' / '1.jpg')),
+        ('face', 'anna', str(tmp_path / 'face' / 'anna' / '2.png')),
+        ('voice', 'boris', str(tmp_path / 'voice' / 'boris' / 'hello.wav')),
+    ]
+    assert all(r['password'] == 'secret' and r['full_name'] == r['login'] for r in records)
+
+
+def test_indexes_rebuilt_when_later_chunk_fails(fake_db, monkeypatch):
+    conn = fake_db
+    monkeypatch.setattr(be, 'ProcessPoolExecutor', SerialPool)
+    monkeypatch.setattr(be, 'BULK_CHUNK_SIZE', 2)
+    monkeypatch.setattr(be, '_prepare', lambda rec: (rec, [0.0], rec['file_path'], None))
+    monkeypatch.setattr(be.dbu, 'get_db_connection', lambda: conn)
+    rebuilt = []
+    monkeypatch.setattr(be, 'update_index', lambda table_name, vector_column, index_path: rebuilt.append(table_name))
+
+    insert_chunk = be._insert_chunk
+
+    def fail_third_chunk(conn, prepared, password_hashes):
+        if conn.commits == 2:
+            raise RuntimeError("обрыв соединения")
+        return insert_chunk(conn, prepared, password_hashes)
+    monkeypatch.setattr(be, '_insert_chunk', fail_third_chunk)
+
+    records = [record(login, login, biometric_type)[0] for login, biometric_type in
+               [('a', 'face'), ('b', 'face'), ('c', 'voice'), ('d', 'face'), ('e', 'signature')]]
+    with pytest.raises(RuntimeError):
+        be.bulk_enroll(records)
+
+    # Закоммиченные пачки (лицо и голос) попадают в индексы, подпись из упавшей — нет
+    assert rebuilt == ['face_samples', 'voice_samples']
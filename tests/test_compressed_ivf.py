@@ -0,0 +1,56 @@
+"""IVF со сжатием sq8/pq: полные векторы вне списков, уникальные субъекты, потеря recall"""
+import numpy as np
+import pytest
+
+from utils.indexer import IVFIndex, load_index, measure_codec_recall_loss, measure_recall
+
+
+@pytest.fixture(scope='module')
+def gallery():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((3000, 32)).astype(np.float32)
+    sample_ids = np.arange(1, 3001)
+    subject_ids = (sample_ids + 2) // 3
+    queries = vectors[:100] + 0.1 * rng.standard_normal((100, 32)).astype(np.float32)
+    return sample_ids, subject_ids, vectors, queries
+
+
+@pytest.fixture(params=['sq8', 'pq'])
+def compressed(request, gallery):
+    sample_ids, subject_ids, vectors, _ = gallery
+    index = IVFIndex(n_clusters=16, n_probe=4, compression=request.param)
+    index.fit(sample_ids, subject_ids, vectors)
+    return index
+
+
+def test_full_vectors_live_outside_lists_and_on_disk_after_save(compressed, gallery, tmp_path):
+    queries = gallery[3]
+    assert compressed.list_vectors == []
+    compressed.save(str(tmp_path))
+    assert isinstance(compressed.rerank_vectors, np.memmap)
+    assert len(compressed._added_vectors) == 0
+
+    compressed.add(100000, 90000, queries[0])
+    assert len(compressed._added_vectors) == 1
+    ids, dists = compressed.search_batch(queries[:1], top_k=1, n_probe=16)
+    assert ids[0, 0] == 90000 and dists[0, 0] == pytest.approx(0.0, abs=1e-5)
+    assert 90000 in compressed.range_search(queries[0], 0.01)
+
+    loaded = load_index(str(tmp_path))
+    assert isinstance(loaded.rerank_vectors, np.memmap) and loaded.list_vectors == []
+    assert measure_recall(loaded, queries) == pytest.approx(measure_recall(compressed, queries), abs=0.02)
+
+
+def test_codec_search_returns_unique_subjects(compressed, gallery):
+    ids, _ = compressed.search_batch(gallery[3], top_k=5, n_probe=16)
+    for row in ids:
+        found = row[row >= 0]
+        assert len(found) == 5 and len(set(found.tolist())) == 5
+
+
+def test_codec_recall_loss_is_measured_and_saved(compressed, gallery, tmp_path):
+    loss = measure_codec_recall_loss(compressed, gallery[3])
+    assert -0.05 <= loss <= 0.2
+    assert compressed.codec is not None and compressed.list_vectors == []
+    compressed.save(str(tmp_path))
+    assert load_index(str(tmp_path)).codec_recall_loss == pytest.approx(loss)
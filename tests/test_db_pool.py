@@ -0,0 +1,137 @@
+"""Пул соединений: выдача и возврат, сброс состояния сессии, ожидание слота, проверка простоявших соединений"""
+import gc
+import threading
+
+import psycopg2
+import psycopg2.extensions
+import pytest
+
+from utils import db_pool
+from utils.db_pool import ConnectionPool, PoolTimeout
+
+
+class FakeInfo:
+    transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+
+class FakeConnection:
+    """Вместо PooledConnection: close() возвращает соединение в пул"""
+    def __init__(self, pool, number):
+        self._pool = pool
+        self.number = number
+        self.closed = 0
+        self.info = FakeInfo()
+        self.rollbacks = 0
+        self.sessions = []
+        self.fail_ping = False
+
+    def close(self):
+        self._pool.putconn(self)
+
+    def disconnect(self):
+        self.closed = 1
+
+    def rollback(self):
+        self.rollbacks += 1
+        self.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def set_session(self, **kwargs):
+        self.sessions.append(kwargs)
+
+    def cursor(self):
+        conn = self
+
+        class Cursor:
+            def execute(self, sql):
+                if conn.fail_ping:
+                    raise psycopg2.OperationalError("server closed the connection")
+
+            def close(self):
+                pass
+
+        return Cursor()
+
+
+@pytest.fixture
+def make_pool(monkeypatch):
+    def connect(self):
+        self.created += 1
+        return FakeConnection(self, self.created)
+
+    monkeypatch.setattr(ConnectionPool, '_connect', connect)
+    return lambda **kwargs: ConnectionPool(**{'minconn': 0, 'maxconn': 2, 'timeout': 0.2, **kwargs})
+
+
+def test_connection_is_reused_after_close(make_pool):
+    pool = make_pool()
+    conn = pool.getconn()
+    assert pool.stats()['in_use'] == 1
+    conn.close()
+    # Повторный close() не возвращает соединение в пул дважды
+    conn.close()
+
+    assert pool.getconn() is conn
+    stats = pool.stats()
+    assert (stats['created'], stats['checkouts'], stats['idle'], stats['in_use']) == (1, 2, 0, 1)
+
+
+def test_returned_connection_is_reset(make_pool):
+    pool = make_pool()
+    conn = pool.getconn()
+    conn.info.transaction_status = psycopg2.extensions.TRANSACTION_STATUS_INTRANS
+    conn.close()
+
+    assert conn.rollbacks == 1
+    assert conn.sessions == [{'isolation_level': 'DEFAULT', 'readonly': 'DEFAULT',
+                              'deferrable': 'DEFAULT', 'autocommit': False}]
+
+
+def test_waits_for_free_slot_then_times_out(make_pool):
+    pool = make_pool()
+    first, second = pool.getconn(), pool.getconn()
+
+    with pytest.raises(PoolTimeout):
+        pool.getconn()
+    assert pool.stats()['timeouts'] == 1
+
+    # Соединение, возвращённое во время ожидания, достаётся ждущему
+    timer = threading.Timer(0.05, first.close)
+    timer.start()
+    assert pool.getconn() is first
+    timer.join()
+    stats = pool.stats()
+    assert stats['exhausted'] == 2 and stats['max_wait_ms'] > 0
+    second.close()
+
+
+def test_broken_idle_connection_is_replaced(make_pool):
+    pool = make_pool(health_check_idle=0.0)
+    conn = pool.getconn()
+    conn.close()
+    conn.fail_ping = True
+
+    fresh = pool.getconn()
+    assert fresh is not conn and conn.closed
+    assert pool.stats()['discarded'] == 1
+
+
+def test_lost_connection_frees_its_slot(make_pool):
+    pool = make_pool(maxconn=1)
+    conn = pool.getconn()
+    del conn
+    gc.collect()
+
+    assert pool.stats()['leaked'] == 1
+    pool.getconn()
+
+
+def test_pool_is_per_process(monkeypatch):
+    created = []
+    monkeypatch.setattr(db_pool, 'ConnectionPool', lambda **kwargs: created.append(kwargs) or object())
+    monkeypatch.setattr(db_pool, '_pool', None)
+
+    pool = db_pool.get_pool()
+    assert db_pool.get_pool() is pool
+    monkeypatch.setattr(db_pool, '_pool_pid', -1)
+    assert db_pool.get_pool() is not pool
+    assert len(created) == 2
@@ -0,0 +1,98 @@
+"""HNSW-граф: recall против точного перебора, сохранение и загрузка, add/remove, range_search"""
+import copy
+
+import numpy as np
+import pytest
+
+from utils.hnsw import HNSWIndex
+from utils.indexer import load_index, measure_recall
+from utils.index_storage import normalize_rows
+
+
+@pytest.fixture(scope='module')
+def gallery():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((1500, 32)).astype(np.float32)
+    sample_ids = np.arange(1, 1501)
+    subject_ids = (sample_ids + 2) // 3
+    queries = vectors[:100] + 0.1 * rng.standard_normal((100, 32)).astype(np.float32)
+    return sample_ids, subject_ids, vectors, queries
+
+
+@pytest.fixture(scope='module')
+def built(gallery):
+    sample_ids, subject_ids, vectors, _ = gallery
+    index = HNSWIndex(M=12, ef_construction=80, ef_search=64)
+    index.fit(sample_ids, subject_ids, vectors)
+    return index
+
+
+@pytest.fixture
+def graph(built):
+    # Тесты меняют граф, поэтому каждый получает свою копию
+    return copy.deepcopy(built)
+
+
+def test_recall_against_brute_force(graph, gallery):
+    assert measure_recall(graph, gallery[3]) >= 0.95
+
+
+def test_search_returns_unique_subjects(graph, gallery):
+    ids, dists = graph.search_batch(gallery[3], top_k=5)
+    for row, row_dists in zip(ids, dists):
+        found = row[row >= 0]
+        assert len(found) == 5 and len(set(found.tolist())) == 5
+        assert np.all(np.diff(row_dists) >= 0)
+
+
+def test_save_load_round_trip(graph, gallery, tmp_path):
+    queries = gallery[3]
+    graph.remove(2)
+    graph.save(str(tmp_path))
+
+    loaded = load_index(str(tmp_path))
+    assert isinstance(loaded, HNSWIndex)
+    assert len(loaded) == len(graph) and 2 not in loaded
+    for return_sample_ids in (False, True):
+        expected = graph.search_batch(queries, top_k=5, return_sample_ids=return_sample_ids)
+        found = loaded.search_batch(queries, top_k=5, return_sample_ids=return_sample_ids)
+        np.testing.assert_array_equal(found[0], expected[0])
+        np.testing.assert_allclose(found[1], expected[1], atol=1e-6)
+
+    # Загруженный через mmap граф принимает новые узлы
+    loaded.add(100000, 90000, queries[0])
+    ids, dists = loaded.search_batch(queries[:1], top_k=1)
+    assert ids[0, 0] == 90000 and dists[0, 0] == pytest.approx(0.0, abs=1e-5)
+
+
+def test_add_and_remove(graph, gallery):
+    queries = gallery[3]
+    graph.add(100000, 90000, queries[0])
+    assert 100000 in graph and len(graph) == 1501
+    ids, _ = graph.search_batch(queries[:1], top_k=1, return_sample_ids=True)
+    assert ids[0, 0] == 100000
+
+    # Повторное добавление заменяет вектор образца
+    graph.add(100000, 90000, queries[1])
+    assert len(graph) == 1501
+    ids, _ = graph.search_batch(queries[1:2], top_k=1, return_sample_ids=True)
+    assert ids[0, 0] == 100000
+
+    assert graph.remove(100000) and not graph.remove(100000)
+    assert 100000 not in graph and len(graph) == 1500
+    ids, _ = graph.search_batch(queries[:2], top_k=5, return_sample_ids=True)
+    assert 100000 not in ids
+
+
+def test_range_search_matches_brute_force(graph, gallery):
+    sample_ids, subject_ids, vectors, queries = gallery
+    normalized = normalize_rows(vectors)
+    for query in queries[:10]:
+        dists = 1.0 - normalized @ normalize_rows(query.reshape(1, -1))[0]
+        expected = set(sample_ids[dists < 0.3].tolist())
+
+        found = graph.range_search(query, 0.3)
+        found_samples = {s for samples in found.values() for s, _ in samples}
+        assert found_samples == expected
+        for subject_id, samples in found.items():
+            assert all(subject_ids[s - 1] == subject_id and d < 0.3 for s, d in samples)
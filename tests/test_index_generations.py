@@ -0,0 +1,103 @@
+"""Поколения индекса (CURRENT, удаление старых) и слияние запросов фоновой перестройки"""
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from utils import indexer
+from utils.index_storage import (
+    CURRENT_FILE, KEEP_GENERATIONS, current_generation, list_generations, make_staging_dir,
+    publish_generation, resolve_index_dir
+)
+
+
+def build(n, seed=0):
+    rng = np.random.default_rng(seed)
+    index = indexer.IVFIndex(n_clusters=4, n_probe=4)
+    sample_ids = np.arange(1, n + 1)
+    index.fit(sample_ids, (sample_ids + 1) // 2, rng.standard_normal((n, 16)).astype(np.float32))
+    return index
+
+
+def publish(index_path, index):
+    staging_dir = make_staging_dir(index_path)
+    index.save(staging_dir)
+    return publish_generation(index_path, staging_dir)
+
+
+def test_publish_switches_current_and_prunes_old_generations(tmp_path):
+    index_path = str(tmp_path / 'face_ivf_index')
+
+    assert publish(index_path, build(40)) == 1
+    assert publish(index_path, build(60)) == 2
+    assert current_generation(index_path) == 'gen-000002'
+    assert resolve_index_dir(index_path) == os.path.join(index_path, 'gen-000002')
+    assert len(indexer.load_index(index_path)) == 60
+
+    for n in (80, 100):
+        publish(index_path, build(n))
+    with open(os.path.join(index_path, CURRENT_FILE), encoding='utf-8') as f:
+        assert f.read().strip() == 'gen-000004'
+    assert list_generations(index_path) == list(range(5 - KEEP_GENERATIONS, 5))
+    assert len(indexer.load_index(index_path)) == 100
+    # Временные каталоги сборки не остаются
+    assert not [name for name in os.listdir(index_path) if name.startswith('.staging-')]
+
+
+@pytest.fixture
+def rebuilder(monkeypatch):
+    """IndexRebuilder с короткой паузой слияния; update_index только считает вызовы"""
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+    release.set()
+
+    def fake_update_index(table_name, vector_column, index_path):
+        calls.append(index_path)
+        started.set()
+        release.wait(5)
+
+    monkeypatch.setattr(indexer, 'update_index', fake_update_index)
+    rebuilder = indexer.IndexRebuilder(coalesce_seconds=0.2)
+    rebuilder.calls, rebuilder.started, rebuilder.release = calls, started, release
+    return rebuilder
+
+
+def test_concurrent_requests_collapse_into_one_rebuild(rebuilder):
+    threads = [threading.Thread(target=rebuilder.request, args=('face_samples', 'feature_vector', 'face_index'))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    rebuilder.wait()
+
+    assert rebuilder.calls == ['face_index']
+    assert rebuilder.stats()['requested'] == 8
+    assert rebuilder.stats()['rebuilds'] == 1
+
+
+def test_requests_during_build_collapse_into_one_more(rebuilder):
+    rebuilder.release.clear()
+    rebuilder.request('face_samples', 'feature_vector', 'face_index')
+    assert rebuilder.started.wait(5)
+    for _ in range(5):
+        rebuilder.request('face_samples', 'feature_vector', 'face_index')
+    rebuilder.release.set()
+    rebuilder.wait()
+
+    assert rebuilder.calls == ['face_index', 'face_index']
+    stats = rebuilder.stats()
+    assert stats['rebuilds'] == 2 and stats['pending'] == 0 and not stats['busy']
+
+
+def test_first_build_for_subject_goes_to_rebuilder(monkeypatch, tmp_path):
+    requests = []
+    monkeypatch.setattr(indexer.index_rebuilder, 'request', lambda *args: requests.append(args))
+    monkeypatch.setattr(indexer, 'update_index', lambda *args: pytest.fail("синхронная сборка"))
+    index_path = str(tmp_path / 'face_ivf_index')
+
+    indexer.update_index_for_subject('face_samples', 'feature_vector', index_path, subject_id=1)
+
+    assert requests == [('face_samples', 'feature_vector', index_path)]
@@ -0,0 +1,280 @@
+"""
+Применение уведомлений biometric_index к загруженному индексу.
+
+Синтетические полезные нагрузки (как их формируют триггеры notify_*_change)
+подаются в IndexChangeListener.apply_events с поддельным соединением.
+Проверка на живой PostgreSQL запускается, если задана переменная
+BIOMETRIC_PG_TEST=1 и база из DB_CONFIG создана скриптом sql/01_create_tables.sql.
+"""
+import json
+import os
+import select
+import threading
+import uuid
+
+import numpy as np
+import pytest
+
+from utils import indexer
+from utils.config import BIOMETRIC_CONFIG, DB_CONFIG
+from utils.vector_codec import encode_vector
+
+FACE = BIOMETRIC_CONFIG['face']
+DIM = FACE['dim']
+
+
+class FakeCursor:
+    def __init__(self, db, queries):
+        self.db = db
+        self.queries = queries
+        self.rows = []
+
+    def execute(self, sql, params=None):
+        sample_ids = params[0]
+        self.queries.append(list(sample_ids))
+        self.rows = [dict(self.db[sample_id]) for sample_id in sample_ids if sample_id in self.db]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    """Вместо таблиц — словарь sample_id -> строка выборки _sync_samples"""
+    def __init__(self):
+        self.db = {}
+        self.queries = []
+
+    def put(self, sample_id, subject_id, vector, status='active', login=None):
+        self.db[sample_id] = {
+            'sample_id': sample_id,
+            'subject_id': subject_id,
+            'status': status,
+            'login': login or f'user{subject_id}',
+            FACE['vector_column']: encode_vector(vector)
+        }
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self.db, self.queries)
+
+
+def random_vectors(n, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+
+
+@pytest.fixture
+def resident_index(monkeypatch):
+    """IVF-индекс из 40 образцов (sample_id 1..40, по два на субъекта), зарегистрированный как загруженный"""
+    vectors = random_vectors(40)
+    sample_ids = list(range(1, 41))
+    subject_ids = [(sample_id + 1) // 2 for sample_id in sample_ids]
+    index = indexer.IVFIndex(n_clusters=4, n_probe=4)
+    index.fit(sample_ids, subject_ids, vectors, {s: f'user{s}' for s in set(subject_ids)})
+
+    key = os.path.abspath(FACE['index_file'])
+    monkeypatch.setitem(indexer.index_registry._entries, key, {
+        'index': index, 'signature': None, 'checksum': None, 'load_time_ms': 0.0, 'loaded_at': 0.0
+    })
+    return index
+
+
+def event(sample_id, op, status=None):
+    payload = {'sample_id': sample_id, 'modality': 'face', 'op': op}
+    if status is not None:
+        payload['status'] = status
+    # Как в слушателе: полезная нагрузка приходит строкой JSON
+    return json.loads(json.dumps(payload))
+
+
+def test_insert_from_another_process_is_added(resident_index):
+    conn = FakeConnection()
+    vector = random_vectors(1, seed=1)[0]
+    conn.put(100, 50, vector)
+    listener = indexer.IndexChangeListener()
+
+    listener.apply_events(conn, [event(100, 'insert')])
+
+    assert 100 in resident_index
+    assert conn.queries == [[100]]
+    subjects, dists = resident_index.search_batch(vector.reshape(1, -1), top_k=1)
+    assert subjects[0, 0] == 50
+    assert dists[0, 0] == pytest.approx(0.0, abs=1e-5)
+
+
+def test_insert_already_applied_is_not_fetched_again(resident_index):
+    conn = FakeConnection()
+    vector = random_vectors(1, seed=1)[0]
+    conn.put(100, 50, vector)
+    # Образец уже добавил update_index_for_subject этого процесса
+    resident_index.add(100, 50, vector)
+
+    indexer.IndexChangeListener().apply_events(conn, [event(100, 'insert')])
+
+    assert conn.queries == []
+    assert len(resident_index) == 41
+
+
+def test_status_event_moves_sample_to_new_subject(resident_index):
+    conn = FakeConnection()
+    vector = random_vectors(1, seed=8)[0]
+    resident_index.add(12, 6, vector)
+    conn.put(12, 33, vector)
+
+    indexer.IndexChangeListener().apply_events(conn, [event(12, 'status', 'active')])
+
+    assert conn.queries == [[12]]
+    assert len(resident_index) == 40
+    subjects, _ = resident_index.search_batch(vector.reshape(1, -1), top_k=1)
+    assert subjects[0, 0] == 33
+
+
+def test_update_replaces_vector(resident_index):
+    conn = FakeConnection()
+    new_vector = random_vectors(1, seed=2)[0]
+    conn.put(5, 3, new_vector)
+
+    indexer.IndexChangeListener().apply_events(conn, [event(5, 'update')])
+
+    assert len(resident_index) == 40
+    ids, dists = resident_index.search_batch(new_vector.reshape(1, -1), top_k=1, return_sample_ids=True)
+    assert ids[0, 0] == 5
+    assert dists[0, 0] == pytest.approx(0.0, abs=1e-5)
+
+
+def test_status_and_delete_events(resident_index):
+    conn = FakeConnection()
+    listener = indexer.IndexChangeListener()
+
+    listener.apply_events(conn, [event(7, 'status', 'inactive'), event(8, 'delete', 'active')])
+    assert 7 not in resident_index and 8 not in resident_index
+    assert len(resident_index) == 38
+    assert conn.queries == []
+
+    # Повторная активация возвращает образец, вектор дочитывается из БД
+    vector = random_vectors(1, seed=3)[0]
+    conn.put(7, 4, vector)
+    listener.apply_events(conn, [event(7, 'status', 'active')])
+    assert 7 in resident_index
+    assert conn.queries == [[7]]
+    assert listener.applied == 3
+
+
+def test_only_latest_event_per_sample_is_applied(resident_index):
+    conn = FakeConnection()
+    conn.put(9, 5, random_vectors(1, seed=4)[0])
+
+    indexer.IndexChangeListener().apply_events(conn, [
+        event(9, 'update'),
+        event(9, 'status', 'inactive')
+    ])
+
+    assert 9 not in resident_index
+    assert conn.queries == []
+
+
+def test_row_deleted_before_fetch_is_removed(resident_index):
+    conn = FakeConnection()
+
+    indexer.IndexChangeListener().apply_events(conn, [event(11, 'update')])
+
+    assert 11 not in resident_index
+
+
+def test_concurrent_changes_keep_lists_consistent(resident_index):
+    vectors = random_vectors(200, seed=5)
+    stop = threading.Event()
+    errors = []
+
+    def search():
+        while not stop.is_set():
+            try:
+                resident_index.search_batch(vectors[:4])
+                resident_index.range_search(vectors[0], 0.5)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    def mutate(offset):
+        for i in range(100):
+            sample_id = 1000 + offset + i
+            resident_index.add(sample_id, sample_id, vectors[(offset + i) % 200])
+            if i % 3 == 0:
+                resident_index.remove(sample_id)
+
+    searchers = [threading.Thread(target=search) for _ in range(2)]
+    writers = [threading.Thread(target=mutate, args=(offset,)) for offset in (0, 100)]
+    for thread in searchers + writers:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    stop.set()
+    for thread in searchers:
+        thread.join()
+
+    assert errors == []
+    for cluster_id in range(len(resident_index.list_vectors)):
+        n = len(resident_index.list_sample_ids[cluster_id])
+        assert len(resident_index.list_vectors[cluster_id]) == n
+        assert len(resident_index.list_subject_ids[cluster_id]) == n
+    assert len(resident_index) == 40 + 2 * (100 - 34)
+
+
+@pytest.mark.skipif(os.environ.get('BIOMETRIC_PG_TEST') != '1',
+                    reason='нужен локальный PostgreSQL со схемой из sql/01_create_tables.sql')
+def test_notify_triggers_reach_resident_index(resident_index):
+    import psycopg2
+
+    listen_conn = psycopg2.connect(**DB_CONFIG)
+    listen_conn.autocommit = True
+    listen_conn.cursor().execute(f"LISTEN {indexer.NOTIFY_CHANNEL}")
+    conn = psycopg2.connect(**DB_CONFIG)
+    listener = indexer.IndexChangeListener()
+
+    def drain():
+        events = []
+        while select.select([listen_conn], [], [], 2.0)[0]:
+            listen_conn.poll()
+            while listen_conn.notifies:
+                events.append(json.loads(listen_conn.notifies.pop(0).payload))
+            if events:
+                break
+        return events
+
+    tag = uuid.uuid4().hex
+    cursor = conn.cursor()
+    try:
+        cursor.execute("""
+            INSERT INTO subjects (full_name, login, password_hash)
+            VALUES ('Тест слушателя', %s, 'x') RETURNING subject_id
+        """, (f'listener-{tag}',))
+        subject_id = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO samples (subject_id, sample_type, sample_hash, file_path)
+            VALUES (%s, 'face', %s, 'test') RETURNING sample_id
+        """, (subject_id, tag))
+        sample_id = cursor.fetchone()[0]
+        cursor.execute("INSERT INTO face_samples (sample_id, feature_vector) VALUES (%s, %s)",
+                       (sample_id, psycopg2.Binary(encode_vector(random_vectors(1, seed=6)[0]))))
+        conn.commit()
+        events = drain()
+        assert [e['op'] for e in events] == ['insert']
+        listener.apply_events(listen_conn, events)
+        assert sample_id in resident_index
+
+        cursor.execute("UPDATE face_samples SET feature_vector = %s WHERE sample_id = %s",
+                       (psycopg2.Binary(encode_vector(random_vectors(1, seed=7)[0])), sample_id))
+        conn.commit()
+        listener.apply_events(listen_conn, drain())
+        assert sample_id in resident_index
+
+        cursor.execute("UPDATE samples SET status = 'inactive' WHERE sample_id = %s", (sample_id,))
+        conn.commit()
+        listener.apply_events(listen_conn, drain())
+        assert sample_id not in resident_index
+    finally:
+        cursor.execute("DELETE FROM subjects WHERE login = %s", (f'listener-{tag}',))
+        conn.commit()
+        conn.close()
+        listen_conn.close()
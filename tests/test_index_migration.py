@@ -0,0 +1,49 @@
+"""Переход с .pkl на поколения: сборка индекса при первом обращении и удаление старого файла"""
+import os
+
+import numpy as np
+import pytest
+
+from utils import indexer
+from utils.config import BIOMETRIC_CONFIG
+
+DIM = 16
+
+
+@pytest.fixture
+def face_index(monkeypatch, tmp_path):
+    """Индекс лица во временном каталоге; рядом — файл старого формата"""
+    index_path = str(tmp_path / 'face_ivf_index')
+    monkeypatch.setitem(BIOMETRIC_CONFIG, 'face', {**BIOMETRIC_CONFIG['face'], 'index_file': index_path})
+    (tmp_path / 'face_ivf_index.pkl').write_bytes(b'old pickle')
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((200, DIM)).astype(np.float32)
+    sample_ids = np.arange(1, 201)
+    subject_ids = (sample_ids + 1) // 2
+    monkeypatch.setattr(indexer, 'fetch_vectors',
+                        lambda table_name, vector_column: (sample_ids, subject_ids, vectors, {}))
+    return index_path
+
+
+def test_missing_index_is_queued_for_build(face_index, monkeypatch):
+    requests = []
+    monkeypatch.setattr(indexer.index_rebuilder, 'request', lambda *args: requests.append(args))
+
+    assert indexer.request_missing_index('face')
+    config = BIOMETRIC_CONFIG['face']
+    assert requests == [(config['samples_table'], config['vector_column'], face_index)]
+
+
+def test_first_build_publishes_generation_and_drops_pickle(face_index, monkeypatch):
+    config = BIOMETRIC_CONFIG['face']
+    indexer.update_index(config['samples_table'], config['vector_column'], face_index)
+
+    assert indexer.index_exists(face_index)
+    assert not os.path.exists(face_index + '.pkl')
+    assert len(indexer.load_index(face_index)) == 200
+
+    requests = []
+    monkeypatch.setattr(indexer.index_rebuilder, 'request', lambda *args: requests.append(args))
+    assert not indexer.request_missing_index('face')
+    assert requests == []
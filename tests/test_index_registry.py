@@ -0,0 +1,74 @@
+"""Кэш загруженных индексов: повторные обращения, перезагрузка по изменению файлов, проверка crc"""
+import os
+
+import numpy as np
+
+from utils import indexer
+from utils.index_storage import make_staging_dir, manifest_path, publish_generation, resolve_index_dir
+
+
+def build(n, seed=0):
+    rng = np.random.default_rng(seed)
+    index = indexer.IVFIndex(n_clusters=4, n_probe=4)
+    sample_ids = np.arange(1, n + 1)
+    index.fit(sample_ids, (sample_ids + 1) // 2, rng.standard_normal((n, 16)).astype(np.float32))
+    return index
+
+
+def publish(index_path, index):
+    staging_dir = make_staging_dir(index_path)
+    index.save(staging_dir)
+    publish_generation(index_path, staging_dir)
+
+
+def test_repeated_get_is_a_hit(tmp_path):
+    index_path = str(tmp_path / 'face_ivf_index')
+    publish(index_path, build(40))
+    registry = indexer.IndexRegistry()
+
+    first = registry.get(index_path)
+    assert registry.get(index_path) is first
+    stats = registry.stats()
+    assert (stats['hits'], stats['misses'], stats['reloads']) == (1, 1, 0)
+    assert stats['indexes'][os.path.abspath(index_path)]['generation'] == 'gen-000001'
+
+
+def test_new_generation_and_delta_are_reloaded(tmp_path):
+    index_path = str(tmp_path / 'face_ivf_index')
+    publish(index_path, build(40))
+    registry = indexer.IndexRegistry()
+    first = registry.get(index_path)
+
+    publish(index_path, build(60))
+    second = registry.get(index_path)
+    assert second is not first and len(second) == 60
+
+    # Дельта, дописанная другим процессом, тоже приводит к перезагрузке
+    vector = np.ones(16, dtype=np.float32)
+    second.save_delta(resolve_index_dir(index_path), [('add', 1000, 500, vector, None)])
+    third = registry.get(index_path)
+    assert third is not second and 1000 in third
+    assert registry.stats()['reloads'] == 2
+
+
+def test_rewrite_with_same_content_is_not_reloaded(tmp_path):
+    index_path = str(tmp_path / 'face_ivf_index')
+    publish(index_path, build(40))
+    registry = indexer.IndexRegistry()
+    first = registry.get(index_path)
+
+    # Манифест перезаписан тем же содержимым: меняется mtime, но не crc
+    path = manifest_path(resolve_index_dir(index_path))
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(data)
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+
+    assert registry.get(index_path) is first
+    stats = registry.stats()
+    assert (stats['misses'], stats['reloads'], stats['hits']) == (1, 0, 1)
+    # Подпись обновлена: следующее обращение не пересчитывает crc
+    assert registry.get(index_path) is first
+    assert registry.stats()['hits'] == 2
@@ -0,0 +1,138 @@
+"""Инкрементальные add/remove в IVFIndex, порог полного переобучения и синхронизация субъекта"""
+import numpy as np
+import pytest
+
+from utils import indexer
+from utils.indexer import IVFIndex
+
+
+@pytest.fixture
+def gallery():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((400, 16)).astype(np.float32)
+    sample_ids = np.arange(1, 401)
+    subject_ids = (sample_ids + 1) // 2
+    return sample_ids, subject_ids, vectors
+
+
+@pytest.fixture
+def index(gallery):
+    index = IVFIndex(n_clusters=8, n_probe=8)
+    index.fit(*gallery)
+    return index
+
+
+def test_add_then_remove(index):
+    vector = np.random.default_rng(1).standard_normal(16).astype(np.float32)
+    index.add(1000, 900, vector, login='new_user')
+
+    assert 1000 in index and len(index) == 401
+    assert index.logins[900] == 'new_user'
+    ids, dists = index.search_batch(vector.reshape(1, -1), top_k=1)
+    assert ids[0, 0] == 900 and dists[0, 0] == pytest.approx(0.0, abs=1e-5)
+    # Списки остаются отсортированными по subject_id
+    for subject_ids in index.list_subject_ids:
+        assert np.all(np.diff(subject_ids) >= 0)
+
+    assert index.remove(1000) and not index.remove(1000)
+    assert 1000 not in index and len(index) == 400
+    ids, _ = index.search_batch(vector.reshape(1, -1), top_k=5)
+    assert 900 not in ids
+
+
+def test_readd_replaces_vector(index, gallery):
+    vectors = gallery[2]
+    index.add(5, 3, vectors[100])
+
+    assert len(index) == 400
+    ids, dists = index.search_batch(vectors[100].reshape(1, -1), top_k=2, return_sample_ids=True)
+    assert set(ids[0].tolist()) == {5, 101}
+    ids, _ = index.search_batch(vectors[4].reshape(1, -1), top_k=1, return_sample_ids=True)
+    assert ids[0, 0] != 5
+
+
+def test_retrain_after_many_changes(index, monkeypatch):
+    monkeypatch.setattr(indexer, 'RETRAIN_MIN_CHANGES', 10)
+    monkeypatch.setattr(indexer, 'RETRAIN_CHANGE_RATIO', 0.05)
+    # Порог — max(10, 0.05 * 400) = 20 изменений
+    for sample_id in range(1, 21):
+        index.remove(sample_id)
+    assert not index.needs_retrain()
+
+    index.remove(21)
+    assert index.needs_retrain()
+
+
+def test_retrain_when_new_samples_drift(index, monkeypatch):
+    monkeypatch.setattr(indexer, 'RETRAIN_MIN_CHANGES', 5)
+    monkeypatch.setattr(indexer, 'RETRAIN_CHANGE_RATIO', 1.0)
+    rng = np.random.default_rng(2)
+
+    # Образцы у самого центроида сдвига не дают
+    for i in range(5):
+        index.add(2000 + i, 2000 + i, index.centroids[0] + 0.01 * rng.standard_normal(16))
+    assert not index.needs_retrain()
+
+    # Образцы, ортогональные всем центроидам (расстояние 1.0 до каждого),
+    # — распределение ушло от обучающего
+    orthogonal = np.linalg.svd(index.centroids)[2][-4:]
+    for i in range(45):
+        index.add(3000 + i, 3000 + i, orthogonal[i % 4])
+    assert index.needs_retrain()
+
+
+class SubjectCursor:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, sql, params=None):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class SubjectConnection:
+    def __init__(self, rows):
+        self.rows = rows
+
+    def cursor(self, cursor_factory=None):
+        return SubjectCursor(self.rows)
+
+    def close(self):
+        pass
+
+
+def test_update_index_for_subject_syncs_samples(index, gallery, monkeypatch, tmp_path):
+    from utils.index_storage import delta_size, make_staging_dir, publish_generation, resolve_index_dir
+    from utils.vector_codec import encode_vector
+
+    index_path = str(tmp_path / 'face_ivf_index')
+    staging_dir = make_staging_dir(index_path)
+    index.save(staging_dir)
+    publish_generation(index_path, staging_dir)
+
+    # Субъект 3: образец 5 деактивирован, образец 6 уже в индексе, 1000 — новый
+    new_vector = np.random.default_rng(3).standard_normal(16).astype(np.float32)
+    rows = [
+        {'sample_id': 5, 'status': 'inactive', 'login': 'user3', 'feature_vector': encode_vector(gallery[2][4])},
+        {'sample_id': 6, 'status': 'active', 'login': 'user3', 'feature_vector': encode_vector(gallery[2][5])},
+        {'sample_id': 1000, 'status': 'active', 'login': 'user3', 'feature_vector': encode_vector(new_vector)},
+    ]
+    monkeypatch.setattr(indexer, 'get_db_connection', lambda: SubjectConnection(rows))
+    registry = indexer.IndexRegistry()
+    monkeypatch.setattr(indexer, 'index_registry', registry)
+
+    indexer.update_index_for_subject('face_samples', 'feature_vector', index_path, subject_id=3)
+
+    resident = registry.get(index_path)
+    assert 5 not in resident and 6 in resident and 1000 in resident
+    assert delta_size(resolve_index_dir(index_path)) > 0
+    # Дельта уже учтена в реестре — индекс не перечитывается
+    assert registry.stats()['reloads'] == 0
+    # Другой процесс получает те же изменения из дельты
+    loaded = indexer.load_index(index_path)
+    assert 5 not in loaded and 1000 in loaded and len(loaded) == 400
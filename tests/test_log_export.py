@@ -0,0 +1,103 @@
+"""Экспорт аудит-логов: границы страниц по keyset-курсору и проверка pyarrow до создания файла"""
+import builtins
+from datetime import datetime, timedelta
+
+import pytest
+
+from utils import log_utils as lu
+
+
+class KeysetCursor:
+    """Отвечает на keyset-запрос ключей страницы по списку (log_id, timestamp)"""
+    def __init__(self, rows, queries):
+        self.rows = rows
+        self.queries = queries
+        self.result = []
+
+    def execute(self, sql, params):
+        self.queries.append(sql)
+        assert 'OFFSET' not in sql
+        rows = sorted(self.rows, key=lambda r: (r[1], r[0]), reverse=True)
+        if '<' in sql:
+            after_ts, after_id = params[0], params[1]
+            rows = [r for r in rows if (r[1], r[0]) < (after_ts, after_id)]
+        self.result = rows[:params[-1]]
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, rows, queries):
+        self.rows = rows
+        self.queries = queries
+
+    def cursor(self):
+        return KeysetCursor(self.rows, self.queries)
+
+    def close(self):
+        pass
+
+
+def in_page(row, conditions, params):
+    """Проверка строки по условиям страницы (только keyset-условия)"""
+    key = (row[1], row[0])
+    values = iter(params)
+    for condition in conditions:
+        bound = (next(values), next(values))
+        if '<' in condition and '>=' not in condition and not key < bound:
+            return False
+        if '>=' in condition and not key >= bound:
+            return False
+    return True
+
+
+@pytest.mark.parametrize('n_rows', [0, 7, 10, 23])
+def test_pages_cover_all_rows_once(monkeypatch, n_rows):
+    base = datetime(2024, 1, 1)
+    # Одинаковые timestamp у соседних записей: граница страницы различает их по log_id
+    rows = [(log_id, base + timedelta(seconds=log_id // 3)) for log_id in range(1, n_rows + 1)]
+    queries = []
+    monkeypatch.setattr(lu, 'get_db_connection', lambda: FakeConnection(rows, queries))
+
+    pages = list(lu._export_pages([], [], page_size=5))
+
+    assert len(pages) == (n_rows + 4) // 5
+    for row in rows:
+        assert sum(in_page(row, conditions, params) for conditions, params in pages) == 1
+    assert all('LIMIT' in sql and 'log_id, timestamp' in sql for sql in queries)
+
+
+def test_log_pages_select_columns_in_display_order(monkeypatch):
+    base = datetime(2024, 1, 1)
+    rows = [(log_id, base + timedelta(seconds=log_id)) for log_id in range(1, 4)]
+    queries = []
+    monkeypatch.setattr(lu, 'get_db_connection', lambda: FakeConnection(rows, queries))
+
+    logs, next_cursor = lu.fetch_logs_page(table_name='subjects', limit=2)
+
+    assert len(logs) == 2 and next_cursor == (rows[1][1], rows[1][0])
+    select = queries[0].split('FROM')[0]
+    assert 'SELECT log_id, timestamp, table_name, operation, subject_id, sensor_id, sample_id, ' \
+           'old_data, new_data, changed_by' in select
+    assert '*' not in select
+
+
+def test_missing_pyarrow_fails_before_file_is_created(monkeypatch, tmp_path):
+    real_import = builtins.__import__
+
+    def no_pyarrow(name, *args, **kwargs):
+        if name.startswith('pyarrow'):
+            raise ImportError(name)
+        return real_import(name, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, '__import__', no_pyarrow)
+    monkeypatch.setattr(lu, 'get_db_connection', lambda: pytest.fail("запрос к БД без pyarrow"))
+    target = tmp_path / 'audit.parquet'
+
+    with pytest.raises(ImportError, match='pip install pyarrow'):
+        lu.export_audit_logs(str(target), 'parquet')
+    assert not target.exists()
@@ -0,0 +1,76 @@
+"""IVFIndex.range_search: точность против перебора и отсечение кластеров по радиусам"""
+import numpy as np
+import pytest
+
+from utils.indexer import IVFIndex
+from utils.index_storage import normalize_rows
+
+
+@pytest.fixture(scope='module')
+def gallery():
+    # 10 плотных групп вокруг случайных центров — кластеры IVF совпадают с группами
+    rng = np.random.default_rng(0)
+    centers = normalize_rows(rng.standard_normal((10, 32)))
+    vectors = np.repeat(centers, 60, axis=0) + 0.05 * rng.standard_normal((600, 32))
+    sample_ids = np.arange(1, 601)
+    subject_ids = (sample_ids + 1) // 2
+    return sample_ids, subject_ids, normalize_rows(vectors).astype(np.float32)
+
+
+@pytest.fixture
+def index(gallery):
+    index = IVFIndex(n_clusters=10, n_probe=2)
+    index.fit(*gallery)
+    return index
+
+
+def scanned_clusters(index, monkeypatch):
+    scanned = []
+    full_vectors = index._full_vectors
+
+    def counting(cluster_id, positions=None):
+        scanned.append(int(cluster_id))
+        return full_vectors(cluster_id, positions)
+
+    monkeypatch.setattr(index, '_full_vectors', counting)
+    return scanned
+
+
+@pytest.mark.parametrize('max_distance', [0.01, 0.05, 0.3, 1.0])
+def test_matches_brute_force(index, gallery, max_distance):
+    sample_ids, subject_ids, vectors = gallery
+    for query in vectors[::50]:
+        dists = 1.0 - vectors @ query
+        expected = {int(s): float(d) for s, d in zip(sample_ids, dists) if d < max_distance}
+
+        found = index.range_search(query, max_distance)
+        flat = {s: d for samples in found.values() for s, d in samples}
+        assert set(flat) == set(expected)
+        for sample_id, distance in flat.items():
+            assert distance == pytest.approx(expected[sample_id], abs=1e-5)
+        for subject_id, samples in found.items():
+            assert all(subject_ids[s - 1] == subject_id for s, _ in samples)
+            assert [d for _, d in samples] == sorted(d for _, d in samples)
+
+
+def test_far_clusters_are_pruned(index, gallery, monkeypatch):
+    scanned = scanned_clusters(index, monkeypatch)
+    query = gallery[2][0]
+
+    found = index.range_search(query, 0.05)
+    assert 1 in found
+    # Группы далеко друг от друга: просматривается только кластер запроса
+    assert len(scanned) == 1
+
+    scanned.clear()
+    index.range_search(query, 2.0)
+    assert sorted(scanned) == list(range(10))
+
+
+def test_added_far_sample_widens_radius(index):
+    # Образец между кластерами попадает в ближайший, радиус этого кластера растёт
+    vector = normalize_rows((index.centroids[0] + index.centroids[1]).reshape(1, -1))[0]
+    index.add(1000, 900, vector)
+
+    found = index.range_search(vector, 0.01)
+    assert [s for s, _ in found[900]] == [1000]
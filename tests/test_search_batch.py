@@ -0,0 +1,90 @@
+"""Пакетный поиск IVFIndex.search_batch и recognize_biometric_batch"""
+import numpy as np
+import pytest
+
+from utils.indexer import IVFIndex
+from utils.index_storage import normalize_rows
+
+
+@pytest.fixture(scope='module')
+def gallery():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((800, 24)).astype(np.float32)
+    sample_ids = np.arange(1, 801)
+    subject_ids = (sample_ids + 3) // 4
+    queries = vectors[::40] + 0.05 * rng.standard_normal((20, 24)).astype(np.float32)
+    return sample_ids, subject_ids, vectors, queries
+
+
+@pytest.fixture(scope='module')
+def index(gallery):
+    index = IVFIndex(n_clusters=16, n_probe=4, top_k=5)
+    index.fit(*gallery[:3], logins={s: f'user{s}' for s in set(gallery[1].tolist())})
+    return index
+
+
+def brute_force(gallery, query, top_k, by_subject):
+    sample_ids, subject_ids, vectors, _ = gallery
+    dists = 1.0 - normalize_rows(vectors) @ normalize_rows(query.reshape(1, -1))[0]
+    order = np.argsort(dists)
+    if not by_subject:
+        return sample_ids[order[:top_k]].tolist(), dists[order[:top_k]]
+    seen = []
+    for i in order:
+        if subject_ids[i] not in seen:
+            seen.append(subject_ids[i])
+        if len(seen) == top_k:
+            break
+    return seen, None
+
+
+def test_batch_matches_single_queries(index, gallery):
+    queries = gallery[3]
+    ids, dists = index.search_batch(queries)
+    assert ids.shape == dists.shape == (len(queries), index.top_k)
+    for qi, query in enumerate(queries):
+        single = index.search(query)
+        assert [sid for sid, _ in single] == ids[qi].tolist()
+        np.testing.assert_allclose([d for _, d in single], dists[qi], atol=1e-6)
+
+
+def test_all_clusters_probed_is_exact(index, gallery):
+    queries = gallery[3]
+    subjects, _ = index.search_batch(queries, n_probe=index.n_clusters)
+    samples, sample_dists = index.search_batch(queries, n_probe=index.n_clusters, return_sample_ids=True)
+    for qi, query in enumerate(queries):
+        expected_subjects, _ = brute_force(gallery, query, 5, by_subject=True)
+        expected_samples, expected_dists = brute_force(gallery, query, 5, by_subject=False)
+        assert subjects[qi].tolist() == expected_subjects
+        assert samples[qi].tolist() == expected_samples
+        np.testing.assert_allclose(sample_dists[qi], expected_dists, atol=1e-5)
+
+
+def test_missing_results_are_padded(gallery):
+    sample_ids, subject_ids, vectors, queries = gallery
+    small = IVFIndex(n_clusters=1, n_probe=1, top_k=5)
+    small.fit(sample_ids[:8], subject_ids[:8], vectors[:8])
+
+    ids, dists = small.search_batch(queries[:3], top_k=5)
+    # 8 образцов — это 2 субъекта
+    assert (ids[:, :2] >= 0).all() and (ids[:, 2:] == -1).all()
+    assert np.isfinite(dists[:, :2]).all() and np.isinf(dists[:, 2:]).all()
+
+
+def test_recognize_biometric_batch(index, gallery, monkeypatch):
+    from utils import db_utils as dbu
+
+    logged = []
+    monkeypatch.setattr(dbu, 'request_missing_index', lambda biometric_type: False)
+    monkeypatch.setattr(dbu, 'get_index', lambda index_path: index)
+    monkeypatch.setattr(dbu, 'log_search', lambda **kwargs: logged.append(kwargs))
+    monkeypatch.setitem(dbu.BIOMETRIC_CONFIG, 'face', {**dbu.BIOMETRIC_CONFIG['face'], 'threshold': 0.05})
+
+    _, subject_ids, vectors, _ = gallery
+    far = -normalize_rows(vectors[:1])
+    results = dbu.recognize_biometric_batch(np.vstack([vectors[0], vectors[41], far[0]]), 'face')
+
+    assert [matches[0][:2] for matches in results[:2]] == [(1, 'user1'), (11, 'user11')]
+    assert all(distance < 0.05 for matches in results for _, _, distance in matches)
+    assert results[2] == []
+    assert len(logged) == 1 and logged[0]['additional_info']['batch_size'] == 3
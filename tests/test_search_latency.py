@@ -0,0 +1,106 @@
+"""
+Перцентили задержки поиска (analyze_search_latency).
+
+Разбор результата и окно по умолчанию проверяются с поддельным соединением.
+Сами перцентили в SQL сравниваются с numpy на живом PostgreSQL, если задана
+переменная BIOMETRIC_PG_TEST=1 и база из DB_CONFIG создана скриптами sql/.
+"""
+import json
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+from utils import log_utils as lu
+from utils.config import DB_CONFIG
+
+
+class FakeCursor:
+    def __init__(self, calls, rows):
+        self.calls = calls
+        self.rows = rows
+
+    def execute(self, sql, params):
+        self.calls.append((sql, params))
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, calls, rows):
+        self.calls = calls
+        self.rows = rows
+
+    def cursor(self):
+        return FakeCursor(self.calls, self.rows)
+
+    def close(self):
+        pass
+
+
+def test_rows_are_reported_per_modality(monkeypatch):
+    calls = []
+    rows = [('face', 200, [12.0, 40.0, 95.0], 15.5, 120.0, 150, 0.4, 1.25, 9)]
+    monkeypatch.setattr(lu, 'get_db_connection', lambda: FakeConnection(calls, rows))
+
+    result = lu.analyze_search_latency('2024-03-01T00:00:00', '2024-03-02T00:00:00', search_type='face')
+
+    assert result == {'face': {
+        'searches': 200, 'p50_ms': 12.0, 'p95_ms': 40.0, 'p99_ms': 95.0,
+        'avg_ms': 15.5, 'max_ms': 120.0, 'hits': 150, 'hit_rate': 0.75,
+        'avg_threshold': 0.4, 'per_minute': 1.25, 'peak_per_minute': 9
+    }}
+    sql, params = calls[0]
+    assert 'percentile_cont(ARRAY[0.5, 0.95, 0.99])' in sql and 'search_type = %s' in sql
+    assert params == [datetime(2024, 3, 1), datetime(2024, 3, 2), 'face',
+                      datetime(2024, 3, 2), datetime(2024, 3, 1)]
+
+
+def test_default_window_is_last_day(monkeypatch):
+    calls = []
+    monkeypatch.setattr(lu, 'get_db_connection', lambda: FakeConnection(calls, []))
+
+    before = datetime.now()
+    assert lu.analyze_search_latency() == {}
+    start, end = calls[0][1][:2]
+    assert before <= end <= datetime.now()
+    assert end - start == timedelta(days=1)
+    assert 'search_type = %s' not in calls[0][0]
+
+
+@pytest.mark.skipif(os.environ.get('BIOMETRIC_PG_TEST') != '1',
+                    reason='нужен локальный PostgreSQL со схемой из sql/')
+def test_percentiles_match_numpy():
+    import psycopg2
+
+    # Окно в прошлом, где нет настоящих логов
+    search_type = 'face'
+    times = np.random.default_rng(0).gamma(2.0, 10.0, 500)
+    end = datetime(2001, 1, 1)
+    conn = psycopg2.connect(**DB_CONFIG)
+    cursor = conn.cursor()
+    try:
+        for i, search_time in enumerate(times):
+            ts = end - timedelta(seconds=i)
+            cursor.execute("""
+                INSERT INTO search_logs (timestamp, searched_at, search_type, query_vector_type,
+                                         candidates_found, search_time_ms, threshold_used, additional_info)
+                VALUES (%s, %s, %s, %s, %s, %s, 0.5, %s)
+            """, (ts, ts, search_type, 'face', i % 2, float(search_time), json.dumps({})))
+        conn.commit()
+
+        stats = lu.analyze_search_latency(end - timedelta(hours=1), end, search_type=search_type)[search_type]
+        assert stats['searches'] == 500 and stats['hit_rate'] == pytest.approx(0.5)
+        for key, q in (('p50_ms', 50), ('p95_ms', 95), ('p99_ms', 99)):
+            assert stats[key] == pytest.approx(np.percentile(times, q), rel=1e-6)
+        assert stats['max_ms'] == pytest.approx(times.max())
+    finally:
+        cursor.execute("DELETE FROM search_logs WHERE timestamp > %s AND timestamp <= %s",
+                       (end - timedelta(hours=1), end))
+        conn.commit()
+        conn.close()
@@ -0,0 +1,94 @@
+"""Фоновая запись search_logs: пачки по размеру и по времени, дозапись при close, отказ одной строки"""
+import time
+
+import psycopg2
+import pytest
+
+from utils import search_log_writer as slw
+from utils.search_log_writer import SearchLogWriter
+
+
+class FakeConnection:
+    closed = 0
+
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return self
+
+    def commit(self):
+        self.db['committed'].extend(self.db.pop('pending', []))
+
+    def rollback(self):
+        self.db.pop('pending', None)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    """batches — размеры вызовов execute_values, committed — записанные строки"""
+    db = {'batches': [], 'committed': [], 'bad': set()}
+
+    def fake_execute_values(cursor, sql, rows, page_size=None):
+        db['batches'].append(len(rows))
+        if any(row[2] in db['bad'] for row in rows):
+            raise psycopg2.IntegrityError("subject_id нарушает внешний ключ")
+        db['pending'] = list(rows)
+
+    monkeypatch.setattr(slw, 'execute_values', fake_execute_values)
+    monkeypatch.setattr(slw, 'get_connection', lambda: FakeConnection(db))
+    return db
+
+
+def test_rows_are_written_in_batches(db):
+    writer = SearchLogWriter(batch_size=4, flush_interval_ms=10000)
+    for subject_id in range(10):
+        assert writer.submit(subject_id=subject_id, candidates_found=1)
+    # Две полные пачки уходят сразу, остаток ждёт таймера или close
+    deadline = time.monotonic() + 5
+    while writer.stats()['written'] < 8 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert db['batches'] == [4, 4]
+
+    writer.close()
+    assert db['batches'] == [4, 4, 2]
+    assert [row[2] for row in db['committed']] == list(range(10))
+    stats = writer.stats()
+    assert (stats['enqueued'], stats['written'], stats['flushes'], stats['queued']) == (10, 10, 3, 0)
+
+
+def test_partial_batch_is_flushed_after_interval(db):
+    writer = SearchLogWriter(batch_size=100, flush_interval_ms=50)
+    writer.submit(subject_id=1, additional_info={'note': 'x'})
+    writer.submit(subject_id=2)
+    writer.flush()
+
+    assert db['batches'] == [2]
+    assert db['committed'][0][-1] == '{"note": "x"}' and db['committed'][1][-1] is None
+    writer.close()
+
+
+def test_bad_row_does_not_lose_batch(db):
+    db['bad'].add(2)
+    writer = SearchLogWriter(batch_size=3, flush_interval_ms=10000)
+    for subject_id in (1, 2, 3):
+        writer.submit(subject_id=subject_id)
+    writer.close()
+
+    # Пачка отклонена целиком, затем строки пишутся по одной
+    assert db['batches'] == [3, 1, 1, 1]
+    assert [row[2] for row in db['committed']] == [1, 3]
+    assert writer.stats()['written'] == 2 and writer.stats()['failed'] == 1
+
+
+def test_full_queue_drops_rows(db):
+    writer = SearchLogWriter(queue_size=2, batch_size=100, flush_interval_ms=10000)
+    # Поток-писатель не запущен: очередь заполняется без разбора
+    writer._ensure_started = lambda: None
+    results = [writer.submit(subject_id=i) for i in range(3)]
+
+    assert results == [True, True, False]
+    assert writer.stats()['dropped'] == 1 and writer.stats()['queued'] == 2
@@ -0,0 +1,119 @@
+"""Реестр сенсоров: одна строка sensors на сенсор, кэш процесса, характеристики сенсора"""
+import threading
+
+import pytest
+
+from utils import db_utils as dbu
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.row = None
+
+    def execute(self, sql, params):
+        self.db['queries'].append(sql.split()[0])
+        if 'INSERT INTO sensors' in sql:
+            key = tuple(params)
+            # ON CONFLICT DO NOTHING: RETURNING пуст, если сенсор уже есть
+            if key in self.db['sensors']:
+                self.row = None
+            else:
+                self.db['sensors'][key] = len(self.db['sensors']) + 1
+                self.row = (self.db['sensors'][key],)
+        elif 'FROM sensors' in sql:
+            self.row = (self.db['sensors'][tuple(params)],)
+        else:
+            self.db['details'].append((sql.split()[2], params))
+
+    def fetchone(self):
+        return self.row
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self):
+        return FakeCursor(self.db)
+
+    def commit(self):
+        self.db['commits'] += 1
+
+    def rollback(self):
+        self.db['rollbacks'] += 1
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = {'sensors': {}, 'details': [], 'queries': [], 'commits': 0, 'rollbacks': 0, 'connections': 0}
+
+    def connect():
+        db['connections'] += 1
+        return FakeConnection(db)
+
+    monkeypatch.setattr(dbu, 'get_db_connection', connect)
+    dbu.clear_sensor_cache()
+    yield db
+    dbu.clear_sensor_cache()
+
+
+def test_sensor_is_inserted_once_and_cached(db):
+    face_id = dbu.get_sensor_id('face')
+    assert dbu.get_sensor_id('face') == face_id
+    assert db['connections'] == 1
+
+    voice_id = dbu.get_sensor_id('voice')
+    other_camera_id = dbu.get_sensor_id('face', sensor_name='Front door camera')
+    assert len({face_id, voice_id, other_camera_id}) == 3
+    assert db['sensors'][('Generic face Sensor', 'camera', 'Generic')] == face_id
+    assert db['connections'] == 3
+
+
+def test_existing_sensor_is_looked_up(db):
+    db['sensors'][('Generic face Sensor', 'camera', 'Generic')] = 42
+
+    assert dbu.get_sensor_id('face') == 42
+    assert db['queries'] == ['INSERT', 'SELECT']
+    assert len(db['sensors']) == 1
+
+    # После сброса кэша id снова читается из БД, новая строка не появляется
+    dbu.clear_sensor_cache()
+    assert dbu.get_sensor_id('face') == 42
+    assert len(db['sensors']) == 1 and db['connections'] == 2
+
+
+def test_details_are_written_with_new_sensor(db):
+    sensor_id = dbu.get_sensor_id('voice', details={'sensitivity': '-42 dB', 'connector_type': 'USB'})
+
+    [(table_name, params)] = db['details']
+    assert table_name == 'microphones'
+    assert params == [sensor_id, '-42 dB', 'USB']
+
+
+def test_unknown_details_roll_back_and_are_not_cached(db):
+    with pytest.raises(ValueError):
+        dbu.get_sensor_id('face', details={'zoom': 10})
+    assert db['rollbacks'] == 1 and db['commits'] == 0
+
+    dbu.get_sensor_id('face')
+    assert db['connections'] == 2
+
+
+def test_concurrent_callers_share_one_row(db):
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(dbu.get_sensor_id('signature')))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(set(results)) == 1 and len(results) == 8
+    assert db['connections'] == 1
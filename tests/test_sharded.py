@@ -0,0 +1,162 @@
+"""Шардированный индекс против одного шарда: совпадение результатов через пул воркеров"""
+import os
+
+import numpy as np
+import pytest
+
+from utils.indexer import IVFIndex, make_index, load_index
+from utils.index_storage import normalize_rows
+from utils.sharded import ShardedIndex, benchmark
+
+N_SHARDS = 3
+
+
+@pytest.fixture(scope='module')
+def gallery():
+    rng = np.random.default_rng(0)
+    vectors = normalize_rows(rng.standard_normal((600, 32)))
+    sample_ids = np.arange(1, 601)
+    subject_ids = (sample_ids + 1) // 2
+    queries = normalize_rows(vectors[:10] + 0.05 * rng.standard_normal((10, 32)))
+    return sample_ids, subject_ids, vectors, queries
+
+
+@pytest.fixture(scope='module')
+def indexes(gallery, tmp_path_factory):
+    sample_ids, subject_ids, vectors, _ = gallery
+    single = make_index({'engine': 'ivf', 'shards': 1})
+    single.fit(sample_ids, subject_ids, vectors)
+
+    path = str(tmp_path_factory.mktemp('sharded'))
+    built = make_index({'engine': 'ivf', 'shards': N_SHARDS})
+    built.fit(sample_ids, subject_ids, vectors)
+    built.save(path)
+    sharded = load_index(path)
+    sharded.workers = N_SHARDS
+    sharded.warm_up()
+    for future in sharded._warm:
+        future.result()
+    yield single, sharded
+    sharded.close()
+
+
+def test_single_query_range_search_uses_warm_pool(indexes, gallery):
+    single, sharded = indexes
+    queries = gallery[3]
+    assert isinstance(sharded, ShardedIndex) and isinstance(single, IVFIndex)
+    assert sharded._use_pool(1)
+    for query in queries:
+        # range_search точен (отсечение кластеров по радиусам), поэтому совпадает с одним шардом
+        expected = single.range_search(query, 0.5)
+        found = sharded.range_search(query, 0.5)
+        assert list(found) == list(expected)
+        for subject_id in expected:
+            assert [s for s, _ in found[subject_id]] == [s for s, _ in expected[subject_id]]
+
+
+def test_search_batch_matches_single_shard(indexes, gallery):
+    single, sharded = indexes
+    queries = gallery[3]
+    n_probe = 1000  # все кластеры — точный поиск в каждом шарде
+    expected_ids, expected_dists = single.search_batch(queries, top_k=5, n_probe=n_probe)
+    for batch in (queries[:1], queries):
+        ids, dists = sharded.search_batch(batch, top_k=5, n_probe=n_probe)
+        np.testing.assert_array_equal(ids, expected_ids[:len(batch)])
+        np.testing.assert_allclose(dists, expected_dists[:len(batch)], atol=1e-5)
+
+
+def test_unsaved_changes_are_searched_in_process(gallery, tmp_path):
+    sample_ids, subject_ids, vectors, queries = gallery
+    built = make_index({'engine': 'ivf', 'shards': N_SHARDS})
+    built.fit(sample_ids, subject_ids, vectors)
+    built.save(str(tmp_path))
+    sharded = load_index(str(tmp_path))
+    sharded.workers = N_SHARDS
+    try:
+        assert sharded._use_pool(8) and not sharded._use_pool(1)
+        sharded.add(10001, 9999, queries[0])
+        # Воркеры не видят изменения, пока оно не записано в дельту
+        assert not sharded._use_pool(8)
+        ids, _ = sharded.search_batch(queries[:8], top_k=1, n_probe=1000)
+        assert ids[0, 0] == 9999
+        sharded.save_delta(str(tmp_path), [('add', 10001, 9999, queries[0], None)])
+        assert sharded._use_pool(8)
+        ids, _ = sharded.search_batch(queries[:8], top_k=1, n_probe=1000)
+        assert ids[0, 0] == 9999
+    finally:
+        sharded.close()
+
+
+def test_benchmark_reports_both_layouts():
+    results = benchmark(n_vectors=2000, dim=16, n_shards=2, n_queries=5)
+    assert set(results) == {1, 2}
+    assert all(r['range_ms'] > 0 and r['batch_ms'] > 0 for r in results.values())
+
+
+def test_small_gallery_gets_fewer_shards(tmp_path):
+    rng = np.random.default_rng(1)
+    vectors = normalize_rows(rng.standard_normal((3, 32)))
+    built = make_index({'engine': 'ivf', 'shards': 8})
+    built.fit([1, 2, 3], [1, 1, 2], vectors)
+
+    assert 1 <= built.n_shards <= 3
+    assert all(len(shard) > 0 for shard in built.shards)
+    assert len(built) == 3
+
+    built.save(str(tmp_path))
+    loaded = load_index(str(tmp_path))
+    try:
+        assert loaded.n_shards == built.n_shards
+        ids, dists = loaded.search_batch(vectors, top_k=1, return_sample_ids=True)
+        assert ids[:, 0].tolist() == [1, 2, 3]
+        np.testing.assert_allclose(dists[:, 0], 0.0, atol=1e-5)
+        # Новые образцы маршрутизируются по тому же числу шардов
+        loaded.add(4, 3, vectors[0])
+        assert 4 in loaded and len(loaded) == 4
+    finally:
+        loaded.close()
+
+
+@pytest.mark.skipif((os.cpu_count() or 1) < 2, reason='ускорение от шардов проверяется только на 2+ ядрах')
+def test_benchmark_shards_speed_up_search():
+    n_shards = 2
+    results = benchmark(n_vectors=40000, dim=64, n_shards=n_shards, n_queries=200)
+    # Хотя бы половина идеального ускорения в n_shards раз
+    assert results[1]['batch_ms'] / results[n_shards]['batch_ms'] >= 0.5 * n_shards
+    assert results[1]['range_ms'] / results[n_shards]['range_ms'] >= 0.5 * n_shards
+
+
+def test_registry_reload_leaves_replaced_index_usable(gallery, tmp_path):
+    from utils.indexer import IndexRegistry
+    from utils.index_storage import make_staging_dir, publish_generation
+
+    sample_ids, subject_ids, vectors, queries = gallery
+    path = str(tmp_path / 'index')
+
+    def publish(index):
+        staging_dir = make_staging_dir(path)
+        index.save(staging_dir)
+        publish_generation(path, staging_dir)
+
+    built = make_index({'engine': 'ivf', 'shards': N_SHARDS})
+    built.fit(sample_ids, subject_ids, vectors)
+    publish(built)
+
+    registry = IndexRegistry()
+    old = registry.get(path)
+    old.workers = N_SHARDS
+    old.warm_up()
+    new = None
+    try:
+        built.add(10001, 9999, queries[0])
+        publish(built)
+        new = registry.get(path)
+        assert new is not old and 10001 in new and 10001 not in old
+        # Поиск, начатый до перезагрузки, продолжается на прежнем пуле и прежнем поколении
+        assert old._pool is not None
+        ids, _ = old.search_batch(queries, top_k=1, n_probe=1000)
+        assert ids[0, 0] != 9999
+    finally:
+        old.close()
+        if new is not None:
+            new.close()
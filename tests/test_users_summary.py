@@ -0,0 +1,104 @@
+"""Список пользователей: страницы по subject_id, счётчики образцов и кэш с TTL"""
+import time
+
+import pytest
+
+from utils import db_utils as dbu
+
+
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.rows = []
+
+    def execute(self, sql, params):
+        after_id, limit = params
+        self.db['queries'].append(params)
+        page = [s for s in self.db['subjects'] if s['subject_id'] > after_id][:limit]
+        self.rows = [{
+            'subject_id': s['subject_id'], 'full_name': s['login'].title(), 'gender': None,
+            'login': s['login'], 'is_active': True,
+            **{f'{t}_count': s.get(t, 0) for t in ('face', 'voice', 'signature')}
+        } for s in page]
+
+    def fetchall(self):
+        return self.rows
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    def __init__(self, db):
+        self.db = db
+
+    def cursor(self, cursor_factory=None):
+        return FakeCursor(self.db)
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def db(monkeypatch):
+    # subject_id с пропусками, как после удалений
+    subjects = [{'subject_id': i * 3, 'login': f'user{i}', 'face': i % 2, 'voice': 2 if i % 3 == 0 else 0}
+                for i in range(1, 8)]
+    db = {'subjects': subjects, 'queries': []}
+    monkeypatch.setattr(dbu, 'get_db_connection', lambda: FakeConnection(db))
+    dbu.clear_users_summary_cache()
+    yield db
+    dbu.clear_users_summary_cache()
+
+
+def test_pages_cover_all_users_in_order(db):
+    seen = []
+    after = None
+    while True:
+        users, after = dbu.get_users_summary(after_id=after, limit=3)
+        seen.extend(users)
+        if after is None:
+            break
+        assert after == users[-1]['subject_id']
+
+    assert [u['subject_id'] for u in seen] == [3, 6, 9, 12, 15, 18, 21]
+    assert db['queries'] == [(0, 3), (9, 3), (18, 3)]
+
+    first = seen[0]
+    assert first['counts'] == {'face': 1, 'voice': 0, 'signature': 0}
+    assert first['has_face'] and not first['has_voice'] and not first['has_signature']
+    assert seen[2]['counts']['voice'] == 2 and seen[2]['has_voice']
+    assert all(not any(key.endswith('_vector') for key in user) for user in seen)
+
+
+def test_exact_multiple_of_page_ends_with_empty_page(db):
+    db['subjects'] = db['subjects'][:6]
+    users, after = dbu.get_users_summary(limit=3)
+    users, after = dbu.get_users_summary(after_id=after, limit=3)
+    assert after == 18
+    users, after = dbu.get_users_summary(after_id=after, limit=3)
+    assert users == [] and after is None
+
+
+def test_cached_page_expires_after_ttl(db, monkeypatch):
+    monkeypatch.setattr(dbu, 'USER_SUMMARY_TTL', 0.1)
+    first = dbu.get_users_summary(limit=3)
+    assert dbu.get_users_summary(limit=3) is first
+    assert len(db['queries']) == 1
+
+    # Другой размер страницы — другой ключ кэша; use_cache=False всегда идёт в БД
+    dbu.get_users_summary(limit=4)
+    dbu.get_users_summary(limit=3, use_cache=False)
+    assert len(db['queries']) == 3
+
+    time.sleep(0.15)
+    db['subjects'][0]['login'] = 'renamed'
+    users, _ = dbu.get_users_summary(limit=3)
+    assert users[0]['login'] == 'renamed' and len(db['queries']) == 4
+
+
+def test_changes_in_this_process_clear_cache(db):
+    dbu.get_users_summary(limit=3)
+    dbu.clear_users_summary_cache()
+    dbu.get_users_summary(limit=3)
+    assert len(db['queries']) == 2
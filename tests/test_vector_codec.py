@@ -0,0 +1,34 @@
+"""Передача векторов в psycopg2: адаптер только для Vector, типкастер — на соединении"""
+import numpy as np
+import psycopg2
+from psycopg2.extensions import adapt, string_types
+
+import utils.db_pool  # noqa: F401 — пул регистрирует типкастер только на своих соединениях
+from utils.vector_codec import Vector, VECTOR_TYPE, VECTOR_DTYPE, cast_vector, decode_vector
+
+
+def test_vector_is_adapted_as_float32_bytea():
+    vector = Vector([1.0, 2.0, 3.0], dim=3)
+    assert len(vector) == 3
+    adapted = adapt(vector)
+    assert isinstance(adapted, type(psycopg2.Binary(b'')))
+    assert bytes(adapted.adapted) == np.array([1, 2, 3], dtype=VECTOR_DTYPE).tobytes()
+    np.testing.assert_array_equal(vector.to_numpy(), [1.0, 2.0, 3.0])
+
+
+def test_plain_ndarray_adaptation_is_untouched():
+    # Без глобального register_adapter массив NumPy psycopg2 не адаптирует
+    try:
+        adapt(np.zeros(3, dtype=np.float32))
+    except psycopg2.ProgrammingError:
+        pass
+    else:
+        raise AssertionError("np.ndarray не должен адаптироваться в BYTEA глобально")
+
+
+def test_vector_typecaster_is_not_global():
+    assert all(string_types.get(oid) is not VECTOR_TYPE for oid in psycopg2.BINARY.values)
+    raw = np.array([0.5, -1.0], dtype=VECTOR_DTYPE).tobytes()
+    escaped = '\\x' + raw.hex()
+    np.testing.assert_array_equal(cast_vector(escaped, None), decode_vector(raw))
+    assert cast_vector(None, None) is None
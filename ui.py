@@ -152,21 +152,20 @@ def show_logs(filter_table=None, filter_user=None):
     - если filter_table задана, показывает только по таблице
     - если filter_user задан (имя пользователя), показывает только по пользователю
     - иначе выводит все логи
+    Показываются последние LOG_PAGE_SIZE записей (одна страница fetch_logs_page).
     """
-    logs = []
-    if filter_table:
-        logs = lu.filter_logs_by_table(filter_table)
-    elif filter_user:
-        logs = lu.filter_logs_by_user(filter_user)
-    else:
-        logs = lu.fetch_all_logs()
+    logs, next_cursor = lu.fetch_logs_page(table_name=filter_table or None,
+                                           user=None if filter_table else (filter_user or None))
 
     if not logs:
         return "Логи не найдены."
     lines = []
     for log in logs:
-        log_id, table_name, operation, old_data, new_data, changed_at, changed_by = log
+        log_id, changed_at, table_name, operation = log[:4]
+        changed_by = log[9]
         lines.append(f"ID: {log_id}; Таблица: {table_name}; Операция: {operation}; Дата: {changed_at}; Пользователь: {changed_by}\n")
+    if next_cursor is not None:
+        lines.append(f"Показаны последние {len(logs)} записей.")
     return "\n".join(lines)
 
 # ------- СОЗДАЁМ Gradio-интерфейс -------
@@ -4,7 +4,7 @@ from tkinter import ttk, filedialog, simpledialog, messagebox
 from utils import db_utils as dbu
 from utils import log_utils as lu
 from utils import face_utils as fu, voice_utils as vu, signature_utils as su
-from utils.indexer import update_index
+from utils.indexer import update_index_for_subject, start_index_listener
 #from utils.config import BIOMETRIC_CONFIG
 from utils.config import THRESHOLD_FACE, THRESHOLD_VOICE, THRESHOLD_SIGNATURE
 
@@ -14,7 +14,7 @@ current_user_login = None
 
 BIOMETRIC_CONFIG = {
     'face': {
-        'index_file': 'face_ivf_index.pkl',
+        'index_file': 'face_ivf_index',
         'samples_table': 'face_samples',
         'vector_column': 'feature_vector',
         'threshold': THRESHOLD_FACE,
@@ -25,7 +25,7 @@ BIOMETRIC_CONFIG = {
         """
     },
     'voice': {
-        'index_file': 'voice_ivf_index.pkl',
+        'index_file': 'voice_ivf_index',
         'samples_table': 'voice_samples',
         'vector_column': 'audio_vector',
         'threshold': THRESHOLD_VOICE,
@@ -36,7 +36,7 @@ BIOMETRIC_CONFIG = {
         """
     },
     'signature': {
-        'index_file': 'signature_ivf_index.pkl',
+        'index_file': 'signature_ivf_index',
         'samples_table': 'signature_samples',
         'vector_column': 'signature_vector',
         'threshold': THRESHOLD_SIGNATURE,
@@ -178,10 +178,11 @@ def register_biometric_ui(biometric_type):
 
     # Пересобираем соответствующий индекс
     config = BIOMETRIC_CONFIG[biometric_type]
-    update_index(
+    update_index_for_subject(
         config['samples_table'],
         config['vector_column'],
-        config['index_file']
+        config['index_file'],
+        current_user_id
     )
 
 def biometric_login_ui(biometric_type):
@@ -275,11 +276,12 @@ def update_biometric_ui(biometric_type):
         show_info(f"{biometric_type.capitalize()} успешно обновлён.")
         # Перестраиваем нужный индекс
         config = BIOMETRIC_CONFIG[biometric_type]
-        update_index(
-        config['samples_table'],
-        config['vector_column'],
-        config['index_file']
-    )
+        update_index_for_subject(
+            config['samples_table'],
+            config['vector_column'],
+            config['index_file'],
+            current_user_id
+        )
     else:
         show_error(f"Ошибка при обновлении {biometric_type}.")
 
@@ -334,10 +336,11 @@ def add_biometric_ui():
 
     show_info(f"{choice.capitalize()} добавлен.")
     config = BIOMETRIC_CONFIG[choice]
-    update_index(
+    update_index_for_subject(
         config['samples_table'],
         config['vector_column'],
-        config['index_file']
+        config['index_file'],
+        current_user_id
     )
 
 def logout_ui():
@@ -349,8 +352,8 @@ def logout_ui():
 
 
 def view_all_users_ui():
-    """Показать всех пользователей и их биометрию."""
-    users = dbu.get_all_users_with_biometrics()
+    """Показать пользователей и их биометрию (постранично, без векторов)."""
+    users, next_after = dbu.get_users_summary()
     if not users:
         show_error("Нет ни одного пользователя.")
         return
@@ -359,21 +362,28 @@ def view_all_users_ui():
     win.title("Все пользователи")
     txt = tk.Text(win, width=80, height=25)
     txt.pack(fill=tk.BOTH, expand=True)
+    page_state = {'after': next_after}
+
+    def _insert_users(users):
+        txt.configure(state=tk.NORMAL)
+        for user in users:
+            txt.insert(tk.END, f"Пользователь: {user['full_name']} (ID: {user['subject_id']})\n")
+            txt.insert(tk.END, f"  Логин: {user['login']}, Пол: {user['gender']}\n")
+            txt.insert(tk.END, "  Биометрия:\n")
+            for biometric_type, count in user['counts'].items():
+                if count:
+                    txt.insert(tk.END, f"    - Тип: {biometric_type}, образцов: {count}\n")
+            txt.insert(tk.END, "-" * 60 + "\n")
+        txt.configure(state=tk.DISABLED)
+
+    def _show_more():
+        if page_state['after'] is None:
+            return
+        more, page_state['after'] = dbu.get_users_summary(after_id=page_state['after'])
+        _insert_users(more)
 
-    for user in users:
-        txt.insert(tk.END, f"Пользователь: {user['full_name']} (ID: {user['subject_id']})\n")
-        txt.insert(tk.END, f"  Логин: {user['login']}, Пол: {user['gender']}\n")
-        txt.insert(tk.END, "  Биометрия:\n")
-        for bio in user['biometrics']:
-            txt.insert(tk.END, f"    - Тип: {bio['sample_type']}, Файл: {bio['file_path']}\n")
-            if bio['sample_type'] == 'face':
-                txt.insert(tk.END, f"       • Вектор лица (128D)\n")
-            elif bio['sample_type'] == 'voice':
-                txt.insert(tk.END, f"       • Вектор голоса (192D)\n")
-            else:
-                txt.insert(tk.END, f"       • Вектор подписи (128D)\n")
-        txt.insert(tk.END, "-" * 60 + "\n")
-    txt.configure(state=tk.DISABLED)
+    ttk.Button(win, text="Ещё", command=_show_more).pack(pady=3)
+    _insert_users(users)
 
 
 def view_audit_logs_ui():
@@ -391,42 +401,53 @@ def view_audit_logs_ui():
     btn_by_user.grid(row=0, column=2, padx=5, pady=5)
     btn_export = ttk.Button(frame, text="Экспорт в CSV", command=lambda: _show_logs("export", txt))
     btn_export.grid(row=0, column=3, padx=5, pady=5)
+    btn_more = ttk.Button(frame, text="Ещё", command=lambda: _show_more(txt))
+    btn_more.grid(row=0, column=4, padx=5, pady=5)
     btn_close = ttk.Button(frame, text="Закрыть", command=win.destroy)
-    btn_close.grid(row=0, column=4, padx=5, pady=5)
+    btn_close.grid(row=0, column=5, padx=5, pady=5)
 
     txt = tk.Text(win, width=100, height=30)
     txt.pack(fill=tk.BOTH, expand=True)
 
+    # Фильтры текущего просмотра и курсор следующей страницы
+    page_state = {'filters': {}, 'after': None}
+
+    def _insert_logs(logs, text_widget):
+        for log in logs:
+            text_widget.insert(tk.END, f"ID: {log[0]}, Таблица: {log[2]}, Операция: {log[3]}, Дата: {log[1]}, Пользователь: {log[9]}\n")
+            text_widget.insert(tk.END, f"Старые: {log[7]}\nНовые: {log[8]}\n" + "-"*60 + "\n")
+
+    def _show_more(text_widget):
+        if page_state['after'] is None:
+            return
+        logs, page_state['after'] = lu.fetch_logs_page(after=page_state['after'], **page_state['filters'])
+        _insert_logs(logs, text_widget)
+
     def _show_logs(mode, text_widget):
         text_widget.delete("1.0", tk.END)
         if mode == "all":
-            logs = lu.fetch_all_logs()
-            for log in logs:
-                text_widget.insert(tk.END, f"ID: {log[0]}, Таблица: {log[1]}, Операция: {log[2]}, Дата: {log[5]}, Пользователь: {log[6]}\n")
-                text_widget.insert(tk.END, f"Старые: {log[3]}\nНовые: {log[4]}\n" + "-"*60 + "\n")
+            filters = {}
 
         elif mode == "by_table":
             tbl = prompt_text("Фильтр по таблице", "Введите имя таблицы:")
             if not tbl:
                 return
-            logs = lu.filter_logs_by_table(tbl)
-            for log in logs:
-                text_widget.insert(tk.END, f"ID: {log[0]}, Таблица: {log[1]}, Операция: {log[2]}, Дата: {log[5]}, Пользователь: {log[6]}\n")
-                text_widget.insert(tk.END, f"Старые: {log[3]}\nНовые: {log[4]}\n" + "-"*60 + "\n")
+            filters = {'table_name': tbl}
 
         elif mode == "by_user":
             usr = prompt_text("Фильтр по пользователю", "Введите логин пользователя:")
             if not usr:
                 return
-            logs = lu.filter_logs_by_user(usr)
-            for log in logs:
-                text_widget.insert(tk.END, f"ID: {log[0]}, Таблица: {log[1]}, Операция: {log[2]}, Дата: {log[5]}, Пользователь: {log[6]}\n")
-                text_widget.insert(tk.END, f"Старые: {log[3]}\nНовые: {log[4]}\n" + "-"*60 + "\n")
+            filters = {'user': usr}
 
         else:  # export
-            all_logs = lu.fetch_all_logs()
-            lu.export_logs_to_csv(all_logs)
+            lu.export_audit_logs("audit_export.csv")
             show_info("Логи экспортированы в CSV.")
+            return
+
+        logs, after = lu.fetch_logs_page(**filters)
+        page_state['filters'], page_state['after'] = filters, after
+        _insert_logs(logs, text_widget)
 
 
 # ----------------------------
@@ -486,4 +507,5 @@ btn_add_bio = ttk.Button(frm, text="Добавить новую биометри
 for w in (btn_change_password, btn_update_face, btn_update_voice, btn_update_sig, btn_add_bio):
     w.pack(fill=tk.X, pady=3)
 
+start_index_listener()
 root.mainloop()
@@ -0,0 +1,280 @@
+"""
+Массовая регистрация субъектов и биометрических образцов.
+
+    python -m utils.bulk_enroll manifest.csv
+    python -m utils.bulk_enroll dataset/bulk --default-password 1234
+
+Манифест — CSV со столбцами login, full_name, gender, password (или password_hash),
+biometric_type, file_path; одна строка — один образец, у субъекта их может быть несколько.
+Каталог читается как <каталог>/<biometric_type>/<login>/<файлы>.
+"""
+import argparse
+import csv
+import hashlib
+import importlib
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from psycopg2.extras import execute_values
+from utils.config import BIOMETRIC_CONFIG
+from utils import db_utils as dbu
+from utils.indexer import update_index
+
+# Сколько записей обрабатывается и вставляется одной транзакцией
+BULK_CHUNK_SIZE = 5000
+
+EXTRACTORS = {
+    'face': ('utils.face_utils', 'extract_face_vector'),
+    'voice': ('utils.voice_utils', 'extract_audio_vector'),
+    'signature': ('utils.signature_utils', 'extract_signature_vector')
+}
+
+FILE_EXTENSIONS = {
+    'face': ('.jpg', '.jpeg', '.png'),
+    'voice': ('.wav', '.ogg', '.mp3'),
+    'signature': ('.jpg', '.jpeg', '.png')
+}
+
+
+def file_hash(file_path):
+    """sha256 содержимого файла — устойчивый sample_hash (повторный импорт не создаёт дублей)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _prepare(record):
+    """
+    Выполняется в процессе-воркере: извлекает вектор и считает хэш файла.
+    Пароли хэшируются позже, по одному разу на новый логин (_hash_passwords).
+    Возвращает (record, vector, sample_hash, error).
+    """
+    try:
+        biometric_type = record['biometric_type']
+        if biometric_type not in EXTRACTORS:
+            return record, None, None, f"неизвестная модальность {biometric_type}"
+        file_path = record['file_path']
+        if not file_path.lower().endswith(FILE_EXTENSIONS[biometric_type]):
+            return record, None, None, "неподдерживаемый формат файла"
+        if not os.path.exists(file_path):
+            return record, None, None, "файл не найден"
+
+        module_name, func_name = EXTRACTORS[biometric_type]
+        vector = getattr(importlib.import_module(module_name), func_name)(file_path)
+        if vector is None or len(vector) == 0:
+            return record, None, None, "не удалось извлечь вектор"
+        vector = dbu.to_vector(vector, biometric_type)
+        return record, vector, file_hash(file_path), None
+    except Exception as e:
+        return record, None, None, str(e)
+
+def read_manifest(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        return [dict(row) for row in csv.DictReader(f)]
+
+def scan_directory(root, default_password=None):
+    """Записи из каталога <root>/<biometric_type>/<login>/<файлы>"""
+    records = []
+    for biometric_type in BIOMETRIC_CONFIG:
+        type_dir = os.path.join(root, biometric_type)
+        if not os.path.isdir(type_dir):
+            continue
+        for login in sorted(os.listdir(type_dir)):
+            login_dir = os.path.join(type_dir, login)
+            if not os.path.isdir(login_dir):
+                continue
+            for name in sorted(os.listdir(login_dir)):
+                records.append({
+                    'login': login,
+                    'full_name': login,
+                    'gender': None,
+                    'password': default_password,
+                    'biometric_type': biometric_type,
+                    'file_path': os.path.join(login_dir, name)
+                })
+    return records
+
+def _hash_passwords(pool, conn, prepared):
+    """
+    Хэши паролей новых логинов пачки: bcrypt выполняется в пуле по одному разу
+    на логин (а не на образец), для уже существующих субъектов — не выполняется.
+    Возвращает ({login: password_hash}, записи без пароля у нового логина).
+    """
+    logins = {}
+    for record, _, _ in prepared:
+        logins.setdefault(record['login'], record)
+    cursor = conn.cursor()
+    cursor.execute("SELECT login FROM subjects WHERE login = ANY(%s)", (list(logins),))
+    existing = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+
+    hashes = {}
+    to_hash = {}
+    for login, record in logins.items():
+        if login in existing:
+            continue
+        if record.get('password_hash'):
+            hashes[login] = record['password_hash']
+        elif record.get('password'):
+            to_hash[login] = record['password']
+    hashes.update(zip(to_hash, pool.map(dbu.hash_password, to_hash.values())))
+
+    rejected = [record for record, _, _ in prepared
+                if record['login'] not in existing and record['login'] not in hashes]
+    return hashes, rejected
+
+def _insert_chunk(conn, prepared, password_hashes):
+    """
+    Вставляет подготовленные записи одной транзакцией: новые субъекты
+    (password_hashes — {login: хэш} из _hash_passwords), образцы
+    и строки векторов — по одному execute_values на таблицу.
+    Возвращает (создано субъектов, вставлено образцов, пропущено дублей).
+    """
+    cursor = conn.cursor()
+
+    subjects = {}
+    for record, _, _ in prepared:
+        subjects.setdefault(record['login'], record)
+    created = []
+    if password_hashes:
+        created = execute_values(cursor, """
+            INSERT INTO subjects (full_name, gender, login, password_hash) VALUES %s
+            ON CONFLICT (login) DO NOTHING
+            RETURNING subject_id
+        """, [(subjects[login].get('full_name') or login, subjects[login].get('gender') or None, login, password_hash)
+              for login, password_hash in password_hashes.items()], page_size=len(password_hashes), fetch=True)
+    cursor.execute("SELECT login, subject_id FROM subjects WHERE login = ANY(%s)", (list(subjects),))
+    subject_ids = dict(cursor.fetchall())
+
+    # Файлы, уже импортированные раньше, и повторы внутри пачки пропускаем
+    cursor.execute("SELECT sample_hash FROM samples WHERE sample_hash = ANY(%s)",
+                   ([sample_hash for _, _, sample_hash in prepared],))
+    seen = {row[0] for row in cursor.fetchall()}
+    rows = []
+    for record, vector, sample_hash in prepared:
+        if sample_hash in seen:
+            continue
+        seen.add(sample_hash)
+        rows.append((record, vector, sample_hash))
+    if not rows:
+        conn.commit()
+        return len(created), 0, len(prepared)
+
+    inserted = execute_values(cursor, """
+        INSERT INTO samples (subject_id, sensor_id, sample_type, sample_hash, file_path) VALUES %s
+        RETURNING sample_hash, sample_id
+    """, [(subject_ids[r['login']], dbu.get_sensor_id(r['biometric_type']), r['biometric_type'], sample_hash, r['file_path'])
+          for r, _, sample_hash in rows], page_size=len(rows), fetch=True)
+    sample_ids = dict(inserted)
+
+    by_type = {}
+    for record, vector, sample_hash in rows:
+        sample_id = sample_ids[sample_hash]
+        by_type.setdefault(record['biometric_type'], []).append((sample_id, record, vector))
+    for biometric_type, items in by_type.items():
+        if biometric_type == 'face':
+            execute_values(cursor, """
+                INSERT INTO face_samples (sample_id, image_format, feature_vector) VALUES %s
+            """, [(sid, os.path.splitext(r['file_path'])[1].lstrip('.').lower(), v) for sid, r, v in items],
+                page_size=len(items))
+        elif biometric_type == 'voice':
+            execute_values(cursor, """
+                INSERT INTO voice_samples (sample_id, voice_text, sampling_rate, audio_format, audio_vector) VALUES %s
+            """, [(sid, '', 16000, os.path.splitext(r['file_path'])[1].lstrip('.').lower(), v) for sid, r, v in items],
+                page_size=len(items))
+        elif biometric_type == 'signature':
+            execute_values(cursor, """
+                INSERT INTO signature_samples (sample_id, signature_image_path, signature_vector) VALUES %s
+            """, [(sid, r['file_path'], v) for sid, r, v in items], page_size=len(items))
+
+    conn.commit()
+    cursor.close()
+    return len(created), len(rows), len(prepared) - len(rows)
+
+def bulk_enroll(records, workers=None, rebuild_indexes=True):
+    """
+    Массовая регистрация. Векторы извлекаются параллельно в пуле процессов,
+    вставка идёт пачками по BULK_CHUNK_SIZE записей в одной транзакции на пачку,
+    индекс каждой затронутой модальности перестраивается один раз в конце —
+    и тогда, когда одна из пачек завершилась ошибкой.
+    Проверка на похожие образцы других пользователей (check_dublicate_biometric)
+    не выполняется: для миграции она слишком дорога.
+    Возвращает сводку: {'subjects_created', 'samples_inserted', 'duplicates', 'failed'}.
+    """
+    start = time.perf_counter()
+    summary = {'subjects_created': 0, 'samples_inserted': 0, 'duplicates': 0, 'failed': []}
+    affected = set()
+
+    # Пачки до ошибки уже закоммичены: без перестройки они не попали бы в поиск
+    try:
+        # spawn: воркеры не наследуют соединения и фоновые потоки родителя
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+            for chunk_start in range(0, len(records), BULK_CHUNK_SIZE):
+                chunk = records[chunk_start:chunk_start + BULK_CHUNK_SIZE]
+                prepared = []
+                for record, vector, sample_hash, error in pool.map(_prepare, chunk, chunksize=16):
+                    if error:
+                        summary['failed'].append((record.get('file_path'), error))
+                    else:
+                        prepared.append((record, vector, sample_hash))
+                if not prepared:
+                    continue
+
+                # Сенсоры регистрируются до открытия транзакции пачки
+                for biometric_type in {record['biometric_type'] for record, _, _ in prepared}:
+                    dbu.get_sensor_id(biometric_type)
+                conn = dbu.get_db_connection()
+                try:
+                    password_hashes, rejected = _hash_passwords(pool, conn, prepared)
+                    if rejected:
+                        summary['failed'].extend((record.get('file_path'), "не задан пароль") for record in rejected)
+                        rejected_logins = {record['login'] for record in rejected}
+                        prepared = [item for item in prepared if item[0]['login'] not in rejected_logins]
+                    created, inserted, duplicates = (_insert_chunk(conn, prepared, password_hashes)
+                                                     if prepared else (0, 0, 0))
+                except Exception:
+                    conn.rollback()
+                    raise
+                finally:
+                    conn.close()
+
+                summary['subjects_created'] += created
+                summary['samples_inserted'] += inserted
+                summary['duplicates'] += duplicates
+                affected.update(record['biometric_type'] for record, _, _ in prepared)
+                done = chunk_start + len(chunk)
+                elapsed = time.perf_counter() - start
+                print(f"Обработано {done}/{len(records)} записей ({done / max(elapsed, 1e-9):.0f} записей/с)")
+    finally:
+        dbu.clear_users_summary_cache()
+        if rebuild_indexes:
+            for biometric_type in sorted(affected):
+                config = BIOMETRIC_CONFIG[biometric_type]
+                update_index(config['samples_table'], config['vector_column'], config['index_file'])
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Массовая регистрация биометрии")
+    parser.add_argument('source', help="CSV-манифест или каталог <biometric_type>/<login>/<файлы>")
+    parser.add_argument('--default-password', help="пароль для записей без пароля (для каталога)")
+    parser.add_argument('--workers', type=int, default=None, help="число процессов извлечения")
+    parser.add_argument('--no-index', action='store_true', help="не перестраивать индексы")
+    args = parser.parse_args()
+
+    if os.path.isdir(args.source):
+        records = scan_directory(args.source, args.default_password)
+    else:
+        records = read_manifest(args.source)
+        if args.default_password:
+            for record in records:
+                record['password'] = record.get('password') or args.default_password
+    print(f"Записей к импорту: {len(records)}")
+
+    summary = bulk_enroll(records, workers=args.workers, rebuild_indexes=not args.no_index)
+    print(f"Создано субъектов: {summary['subjects_created']}, образцов: {summary['samples_inserted']}, "
+          f"дублей пропущено: {summary['duplicates']}, ошибок: {len(summary['failed'])}")
+    for file_path, error in summary['failed'][:20]:
+        print(f"  {file_path}: {error}")
@@ -5,16 +5,49 @@ DB_CONFIG = {
     "host": "localhost"
 }
 
+# Пул соединений (utils/db_pool.py): timeout — ожидание свободного соединения,
+# health_check_idle — после скольких секунд простоя соединение проверяется SELECT 1
+DB_POOL_CONFIG = {
+    "minconn": 1,
+    "maxconn": 10,
+    "timeout": 30.0,
+    "health_check_idle": 60.0
+}
+
+# Фоновая запись search_logs (utils/search_log_writer.py): пачка пишется,
+# когда набралось batch_size строк или прошло flush_interval_ms
+SEARCH_LOG_CONFIG = {
+    "queue_size": 10000,
+    "batch_size": 500,
+    "flush_interval_ms": 200.0
+}
+
+# Партиции журналов (sql/06_log_partitioning.sql): сколько месяцев создавать наперёд
+# и сколько полных месяцев хранить
+LOG_RETENTION_CONFIG = {
+    "months_ahead": 3,
+    "keep_months": {
+        "audit_logs": 12,
+        "search_logs": 6
+    }
+}
+
 THRESHOLD_FACE = 0.06 # -> 0, при "Схожесть" -> inf
 THRESHOLD_VOICE = 0.25 # -> 0, при "Схожесть" -> inf
 THRESHOLD_SIGNATURE = 0.1 # -> 0, при "Схожесть" -> inf
 
 BIOMETRIC_CONFIG = {
     'face': {
-        'index_file': 'face_ivf_index.pkl',
+        'index_file': 'face_ivf_index',
         'samples_table': 'face_samples',
         'vector_column': 'feature_vector',
+        'dim': 128,  # float32 в BYTEA: 4 * dim байт
         'threshold': THRESHOLD_FACE,
+        'engine': 'ivf',  # 'ivf' | 'hnsw'
+        'compression': None,  # None | 'sq8' | 'pq' (только для ivf)
+        'target_recall': 0.95,  # для подбора n_probe
+        'hnsw_params': {'M': 16, 'ef_construction': 100, 'ef_search': 50},
+        'shards': 1,  # >1 — шардированный индекс с поиском в пуле процессов
         #'save_function': save_face_vector,
         'update_query': """
             UPDATE {table} SET {vector_column} = %s 
@@ -22,10 +55,16 @@ BIOMETRIC_CONFIG = {
         """
     },
     'voice': {
-        'index_file': 'voice_ivf_index.pkl',
+        'index_file': 'voice_ivf_index',
         'samples_table': 'voice_samples',
         'vector_column': 'audio_vector',
+        'dim': 192,  # float32 в BYTEA: 4 * dim байт
         'threshold': THRESHOLD_VOICE,
+        'engine': 'ivf',  # 'ivf' | 'hnsw'
+        'compression': None,  # None | 'sq8' | 'pq' (только для ivf)
+        'target_recall': 0.95,  # для подбора n_probe
+        'hnsw_params': {'M': 16, 'ef_construction': 100, 'ef_search': 50},
+        'shards': 1,  # >1 — шардированный индекс с поиском в пуле процессов
         #'save_function': save_voice_vector,
         'update_query': """
             UPDATE {table} SET {vector_column} = %s 
@@ -33,10 +72,16 @@ BIOMETRIC_CONFIG = {
         """
     },
     'signature': {
-        'index_file': 'signature_ivf_index.pkl',
+        'index_file': 'signature_ivf_index',
         'samples_table': 'signature_samples',
         'vector_column': 'signature_vector',
+        'dim': 256,  # float32 в BYTEA: 4 * dim байт
         'threshold': THRESHOLD_SIGNATURE,
+        'engine': 'ivf',  # 'ivf' | 'hnsw'
+        'compression': None,  # None | 'sq8' | 'pq' (только для ivf)
+        'target_recall': 0.95,  # для подбора n_probe
+        'hnsw_params': {'M': 16, 'ef_construction': 100, 'ef_search': 50},
+        'shards': 1,  # >1 — шардированный индекс с поиском в пуле процессов
         #'save_function': save_signature_vector,
         'update_query': """
             UPDATE {table} SET {vector_column} = %s 
@@ -0,0 +1,214 @@
+import atexit
+import os
+import threading
+import time
+import weakref
+import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import PoolError
+from contextlib import contextmanager
+from utils.config import DB_CONFIG, DB_POOL_CONFIG
+from utils.vector_codec import register_vector_type
+
+
+class PoolTimeout(PoolError):
+    """Свободное соединение не появилось за timeout секунд"""
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """
+    Соединение из пула: close() не рвёт TCP-сессию, а возвращает соединение в пул,
+    поэтому существующий код вида conn = get_db_connection() ... conn.close()
+    работает без изменений.
+    """
+    def close(self):
+        pool = getattr(self, '_pool', None)
+        if pool is None:
+            return super().close()
+        pool.putconn(self)
+
+    def disconnect(self):
+        self._pool = None
+        super().close()
+
+
+class ConnectionPool:
+    """
+    Потокобезопасный пул соединений с ожиданием свободного слота.
+    Не больше maxconn соединений выдано одновременно; если все заняты,
+    getconn ждёт до timeout секунд. Соединение, простоявшее в пуле дольше
+    health_check_idle секунд, перед выдачей проверяется запросом SELECT 1.
+    """
+    def __init__(self, minconn: int = 1, maxconn: int = 10, timeout: float = 30.0,
+                 health_check_idle: float = 60.0, **connect_kwargs):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.health_check_idle = health_check_idle
+        self.connect_kwargs = connect_kwargs
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = []
+        self._checked_out = {}
+
+        self.checkouts = 0
+        self.created = 0
+        self.discarded = 0
+        self.leaked = 0
+        self.exhausted = 0
+        self.timeouts = 0
+        self.wait_time_ms = 0.0
+        self.max_wait_ms = 0.0
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        conn = psycopg2.connect(connection_factory=PooledConnection, **self.connect_kwargs)
+        # bytea -> float32-вектор только на соединениях пула, без глобальной регистрации
+        register_vector_type(conn)
+        conn._pool = self
+        self.created += 1
+        return conn
+
+    def _healthy(self, conn, last_used: float):
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.health_check_idle:
+            return True
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.close()
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _discard(self, conn):
+        self.discarded += 1
+        try:
+            conn.disconnect()
+        except psycopg2.Error:
+            pass
+
+    def _on_collected(self, key):
+        # Соединение выдали и потеряли, не вернув: освобождаем его слот
+        with self._lock:
+            if self._checked_out.pop(key, None) is None:
+                return
+            self.leaked += 1
+        self._slots.release()
+
+    def getconn(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            self.exhausted += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                self.timeouts += 1
+                raise PoolTimeout(f"Нет свободного соединения в пуле ({self.maxconn}) за {self.timeout} с")
+        waited_ms = (time.perf_counter() - start) * 1000
+        try:
+            while True:
+                with self._lock:
+                    item = self._idle.pop() if self._idle else None
+                if item is None:
+                    conn = self._connect()
+                    break
+                conn, last_used = item
+                if self._healthy(conn, last_used):
+                    break
+                self._discard(conn)
+        except Exception:
+            self._slots.release()
+            raise
+
+        key = id(conn)
+        with self._lock:
+            self._checked_out[key] = weakref.ref(conn, lambda ref, key=key: self._on_collected(key))
+            self.checkouts += 1
+            self.wait_time_ms += waited_ms
+            self.max_wait_ms = max(self.max_wait_ms, waited_ms)
+        return conn
+
+    def putconn(self, conn):
+        with self._lock:
+            if self._checked_out.pop(id(conn), None) is None:
+                # Повторный close() того же соединения
+                return
+        try:
+            if conn.closed:
+                self.discarded += 1
+                return
+            if conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            # Сбрасываем то, что вызывающий код мог поменять через set_session/autocommit
+            conn.set_session(isolation_level='DEFAULT', readonly='DEFAULT',
+                             deferrable='DEFAULT', autocommit=False)
+            with self._lock:
+                self._idle.append((conn, time.monotonic()))
+        except psycopg2.Error:
+            self._discard(conn)
+        finally:
+            self._slots.release()
+
+    def closeall(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'maxconn': self.maxconn,
+                'idle': len(self._idle),
+                'in_use': len(self._checked_out),
+                'checkouts': self.checkouts,
+                'created': self.created,
+                'discarded': self.discarded,
+                'leaked': self.leaked,
+                'exhausted': self.exhausted,
+                'timeouts': self.timeouts,
+                'total_wait_ms': self.wait_time_ms,
+                'max_wait_ms': self.max_wait_ms,
+                'avg_wait_ms': self.wait_time_ms / self.checkouts if self.checkouts else 0.0
+            }
+
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """Пул текущего процесса (создаётся лениво; после fork/spawn — свой)"""
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ConnectionPool(**DB_POOL_CONFIG, **DB_CONFIG)
+            _pool_pid = os.getpid()
+        return _pool
+
+def get_connection():
+    """Соединение из пула; conn.close() возвращает его обратно"""
+    return get_pool().getconn()
+
+@contextmanager
+def connection():
+    """
+    with connection() as conn: ... — соединение возвращается в пул при выходе,
+    при исключении незавершённая транзакция откатывается.
+    """
+    conn = get_connection()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def get_pool_stats():
+    return get_pool().stats() if _pool is not None else {}
+
+@atexit.register
+def _close_pool():
+    if _pool is not None and _pool_pid == os.getpid():
+        _pool.closeall()
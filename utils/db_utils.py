@@ -1,13 +1,28 @@
 import psycopg2
-from utils.config import DB_CONFIG
+from utils.db_pool import get_connection
 from psycopg2.extras import RealDictCursor
 import bcrypt
 import numpy as np
-from utils.indexer import load_index_and_search
+from utils.indexer import get_index, request_missing_index
 from utils.config import BIOMETRIC_CONFIG
+from utils.vector_codec import Vector, decode_vector
+from utils.search_log_writer import search_log_writer
 import os
 import time
 import json
+import threading
+
+def to_vector(vector, biometric_type):
+    """
+    Параметр запроса для столбца-вектора модальности (float32 BYTEA)
+    с проверкой размерности. Из БД bytea возвращается float32-массивом:
+    типкастер регистрируется на соединениях пула (utils.db_pool).
+    """
+    dim = BIOMETRIC_CONFIG[biometric_type]['dim']
+    array = np.asarray(vector, dtype=np.float32)
+    if array.shape != (dim,):
+        raise ValueError(f"Неверная размерность вектора {biometric_type}: {array.shape} вместо ({dim},)")
+    return Vector(array)
 
 def hash_password(plain_password: str):
     hashed = bcrypt.hashpw(plain_password.encode(), bcrypt.gensalt())
@@ -17,41 +32,103 @@ def verify_password(plain_password: str, hashed_password: str):
     return bcrypt.checkpw(plain_password.encode(), hashed_password.encode())
 
 def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+    return get_connection()
+
+# Реестр сенсоров: тип сенсора модальности и таблица его характеристик
+SENSOR_TYPES = {
+    'face': 'camera',
+    'voice': 'microphone',
+    'signature': 'signature_pad'
+}
+
+SENSOR_DETAIL_TABLES = {
+    'camera': ('cameras', ('resolution', 'fps', 'color_depth', 'interface')),
+    'microphone': ('microphones', ('sensitivity', 'frequency_response', 'diaphragm_size', 'connector_type')),
+    'signature_pad': ('signature_pads', ('active_area', 'pressure_levels', 'sampling_rate', 'interface'))
+}
+
+_sensor_cache = {}
+_sensor_lock = threading.Lock()
+
+def get_sensor_id(biometric_type, sensor_name=None, manufacturer='Generic', details=None):
+    """
+    sensor_id сенсора (sensor_name, тип модальности, manufacturer). Строка в sensors
+    создаётся один раз (upsert по уникальному индексу, см. sql/04_sensor_registry.sql)
+    в отдельной транзакции, дальше id берётся из кэша процесса.
+    details — характеристики для cameras/microphones/signature_pads, пишутся при создании.
+    """
+    sensor_type = SENSOR_TYPES[biometric_type]
+    sensor_name = sensor_name or f'Generic {biometric_type} Sensor'
+    key = (sensor_name, sensor_type, manufacturer)
+    sensor_id = _sensor_cache.get(key)
+    if sensor_id is not None:
+        return sensor_id
+
+    with _sensor_lock:
+        if key in _sensor_cache:
+            return _sensor_cache[key]
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO sensors (sensor_name, sensor_type, manufacturer)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (sensor_name, sensor_type, manufacturer) DO NOTHING
+                RETURNING sensor_id
+            """, key)
+            row = cursor.fetchone()
+            if row is None:
+                cursor.execute("""
+                    SELECT sensor_id FROM sensors
+                    WHERE sensor_name = %s AND sensor_type = %s AND manufacturer = %s
+                """, key)
+                row = cursor.fetchone()
+            sensor_id = row[0]
+
+            if details:
+                table_name, columns = SENSOR_DETAIL_TABLES[sensor_type]
+                unknown = set(details) - set(columns)
+                if unknown:
+                    raise ValueError(f"Неизвестные характеристики сенсора {sensor_type}: {sorted(unknown)}")
+                names = list(details)
+                cursor.execute(f"""
+                    INSERT INTO {table_name} (sensor_id, {', '.join(names)})
+                    VALUES (%s, {', '.join(['%s'] * len(names))})
+                    ON CONFLICT (sensor_id) DO NOTHING
+                """, [sensor_id] + [details[name] for name in names])
+
+            conn.commit()
+            cursor.close()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        _sensor_cache[key] = sensor_id
+        return sensor_id
+
+def clear_sensor_cache():
+    """Сбросить кэш реестра (например, после удаления сенсоров)"""
+    with _sensor_lock:
+        _sensor_cache.clear()
 
 def log_search(subject_id=None, sensor_id=None, sample_id=None, 
               search_type='face', query_vector_type='face',
               candidates_found=0, search_time_ms=0.0,
               threshold_used=0.5, additional_info=None):
     """
-    Логирует операцию поиска в таблице search_logs
+    Логирует операцию поиска в таблице search_logs.
+    Запись ставится в очередь фонового search_log_writer и пишется пачкой,
+    так что время распознавания не включает обращение к БД.
+    Возвращает False, если очередь переполнена и запись отброшена.
     """
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO search_logs (
-                subject_id, sensor_id, sample_id,
-                search_type, query_vector_type,
-                candidates_found, search_time_ms,
-                threshold_used, additional_info
-            ) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
-        """, (
-            subject_id, sensor_id, sample_id,
-            search_type, query_vector_type,
-            candidates_found, search_time_ms,
-            threshold_used, json.dumps(additional_info) if additional_info else None
-        ))
-        
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True
-        
-    except Exception as e:
-        print(f"Ошибка при записи лога поиска: {e}")
-        return False
+    return search_log_writer.submit(
+        subject_id=subject_id, sensor_id=sensor_id, sample_id=sample_id,
+        search_type=search_type, query_vector_type=query_vector_type,
+        candidates_found=candidates_found, search_time_ms=search_time_ms,
+        threshold_used=threshold_used, additional_info=additional_info
+    )
 
 def check_available_biometrics(subject_id):
     ALL_TYPES = {'face', 'voice', 'signature'}
@@ -78,6 +155,44 @@ def check_available_biometrics(subject_id):
         print(f"Ошибка при проверке доступных биометрических образцов: {e}")
         return []
 
+def fetch_active_logins(subject_ids):
+    """Логины субъектов, у которых есть активные образцы: {subject_id: login}"""
+    subject_ids = sorted({int(sid) for sid in subject_ids})
+    if not subject_ids:
+        return {}
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    placeholders = ','.join(['%s'] * len(subject_ids))
+    
+    cursor.execute(f"""
+        SELECT DISTINCT subj.subject_id, subj.login
+        FROM subjects subj
+        JOIN samples s ON subj.subject_id = s.subject_id
+        WHERE subj.subject_id IN ({placeholders}) AND s.status = 'active'
+    """, subject_ids)
+    
+    login_map = {int(sid): login for sid, login in cursor.fetchall()}
+    conn.close()
+    return login_map
+
+def resolve_logins(index, subject_ids):
+    """
+    Логины найденных субъектов. Индекс содержит только активные образцы и хранит
+    логины сам, поэтому к БД обращаемся лишь за субъектами без логина в индексе
+    (например, индекс построен старой версией).
+    """
+    login_map = {}
+    missing = []
+    for subject_id in subject_ids:
+        login = index.logins.get(int(subject_id))
+        if login is None:
+            missing.append(subject_id)
+        else:
+            login_map[int(subject_id)] = login
+    if missing:
+        login_map.update(fetch_active_logins(missing))
+    return login_map
+
 def recognize_biometric(vector, biometric_type):
     start_time = time.time()
     
@@ -94,18 +209,22 @@ def recognize_biometric(vector, biometric_type):
 
     config = BIOMETRIC_CONFIG[biometric_type]
     
-    if not os.path.exists(config['index_file']):
+    # Индекса нет — его сборка ставится в фон, до публикации поиск пуст
+    if request_missing_index(biometric_type):
         log_search(
             search_type=biometric_type,
             query_vector_type=biometric_type,
             candidates_found=0,
             search_time_ms=0,
             threshold_used=0,
-            additional_info={"error": "Индексный файл не найден"}
+            additional_info={"error": "Индекс ещё не построен, сборка запущена"}
         )
         return []
 
-    results = load_index_and_search(config['index_file'], np.array(vector))
+    # Все образцы ближе порога, сгруппированные по субъектам (лучший образец первым)
+    index = get_index(config['index_file'])
+    matches = index.range_search(np.array(vector), config['threshold'])
+    results = [(subject_id, samples[0][1]) for subject_id, samples in matches.items()]
     search_time_ms = (time.time() - start_time) * 1000
     if not results:
         log_search(
@@ -118,24 +237,11 @@ def recognize_biometric(vector, biometric_type):
         )
         return []
 
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    subject_ids = [str(sid) for sid, _ in results]
-    placeholders = ','.join(['%s'] * len(subject_ids))
-    
-    cursor.execute(f"""
-        SELECT DISTINCT subj.subject_id, subj.login
-        FROM subjects subj
-        JOIN samples s ON subj.subject_id = s.subject_id
-        WHERE subj.subject_id IN ({placeholders}) AND s.status = 'active'
-    """, subject_ids)
-    
-    login_map = {int(sid): login for sid, login in cursor.fetchall()}
-    conn.close()
+    login_map = resolve_logins(index, [sid for sid, _ in results])
     
     final_results = []
     for subject_id, distance in results:
-        if distance < config['threshold'] and subject_id in login_map:
+        if subject_id in login_map:
             final_results.append((
                 subject_id,
                 login_map[subject_id],
@@ -149,7 +255,7 @@ def recognize_biometric(vector, biometric_type):
         search_time_ms=search_time_ms,
         threshold_used=config['threshold'],
         additional_info={
-            "raw_results": len(results),
+            "raw_results": sum(len(samples) for samples in matches.values()),
             "threshold": config['threshold'],
             "vector_shape": str(np.array(vector).shape)
         }
@@ -157,6 +263,58 @@ def recognize_biometric(vector, biometric_type):
     
     return final_results
 
+def recognize_biometric_batch(vectors, biometric_type):
+    """
+    Пакетная идентификация: один проход по индексу для всех векторов,
+    логины берутся из самого индекса. Возвращает список результатов
+    в формате recognize_biometric для каждого вектора.
+    """
+    start_time = time.time()
+    config = BIOMETRIC_CONFIG[biometric_type]
+    if len(vectors) == 0:
+        return []
+
+    if request_missing_index(biometric_type):
+        log_search(
+            search_type=biometric_type,
+            query_vector_type=biometric_type,
+            candidates_found=0,
+            search_time_ms=0,
+            threshold_used=0,
+            additional_info={"error": "Индекс ещё не построен, сборка запущена", "batch_size": len(vectors)}
+        )
+        return [[] for _ in vectors]
+
+    index = get_index(config['index_file'])
+    ids, dists = index.search_batch(np.array(vectors, dtype=np.float32))
+    search_time_ms = (time.time() - start_time) * 1000
+
+    hit_mask = (ids >= 0) & (dists < config['threshold'])
+    login_map = resolve_logins(index, ids[hit_mask].tolist())
+
+    final_results = []
+    for row_ids, row_dists, row_mask in zip(ids, dists, hit_mask):
+        matches = []
+        for subject_id, distance in zip(row_ids[row_mask].tolist(), row_dists[row_mask].tolist()):
+            if subject_id in login_map:
+                matches.append((subject_id, login_map[subject_id], float(distance)))
+        final_results.append(matches)
+
+    log_search(
+        search_type=biometric_type,
+        query_vector_type=biometric_type,
+        candidates_found=sum(len(matches) for matches in final_results),
+        search_time_ms=search_time_ms,
+        threshold_used=config['threshold'],
+        additional_info={
+            "batch_size": len(vectors),
+            "threshold": config['threshold'],
+            "vector_shape": str(np.array(vectors).shape)
+        }
+    )
+
+    return final_results
+
 def check_dublicate_biometric(subject_id, vector, biometric_type):
     print('Проверяем наличие похожих образцов')
     matches = recognize_biometric(vector, biometric_type)
@@ -172,6 +330,7 @@ def update_biometric_vector(subject_id, vector, file_path, biometric_type):
             raise Exception("Похожий биометрический образец уже зарегистрирован другим пользователем")
 
         config = BIOMETRIC_CONFIG[biometric_type]
+        sensor_id = get_sensor_id(biometric_type)
         conn = get_db_connection()
         cursor = conn.cursor()
 
@@ -183,12 +342,6 @@ def update_biometric_vector(subject_id, vector, file_path, biometric_type):
               AND status != 'inactive'
         """, (subject_id, biometric_type))
 
-        cursor.execute("""
-            INSERT INTO sensors (sensor_name, sensor_type, manufacturer)
-            VALUES (%s, %s, %s) RETURNING sensor_id
-        """, (f'Generic {biometric_type} Sensor', 'camera', 'Generic'))
-        sensor_id = cursor.fetchone()[0]
-
         cursor.execute("""
             INSERT INTO samples (subject_id, sensor_id, sample_type, sample_hash, file_path)
             VALUES (%s, %s, %s, %s, %s) RETURNING sample_id
@@ -199,9 +352,10 @@ def update_biometric_vector(subject_id, vector, file_path, biometric_type):
             INSERT INTO {config['samples_table']} (sample_id, {config['vector_column']})
             VALUES (%s, %s)
         """
-        cursor.execute(insert_query, (sample_id, str(vector)))
+        cursor.execute(insert_query, (sample_id, to_vector(vector, biometric_type)))
 
         conn.commit()
+        clear_users_summary_cache()
         cursor.close()
         conn.close()
         return True
@@ -247,16 +401,10 @@ def add_biometric_sample(subject_id, file_path, vector, biometric_type):
         if check_dublicate_biometric(subject_id, vector, biometric_type):
             raise Exception("Похожий биометрический образец уже зарегистрирован другим пользователем")
         config = BIOMETRIC_CONFIG[biometric_type]
+        sensor_id = get_sensor_id(biometric_type)
         conn = get_db_connection()
         cursor = conn.cursor()
-        
-        cursor.execute("""
-            INSERT INTO sensors (sensor_name, sensor_type, manufacturer)
-            VALUES (%s, %s, %s) RETURNING sensor_id
-        """, (f'Generic {biometric_type} Sensor', 'camera', 'Generic'))
-        sensor_id = cursor.fetchone()[0]
-        
-        
+
         cursor.execute("""
             INSERT INTO samples (subject_id, sensor_id, sample_type, sample_hash, file_path)
             VALUES (%s, %s, %s, %s, %s) RETURNING sample_id
@@ -264,6 +412,7 @@ def add_biometric_sample(subject_id, file_path, vector, biometric_type):
         sample_id = cursor.fetchone()[0]
         
         conn.commit()
+        clear_users_summary_cache()
         cursor.close()
         conn.close()
         return sample_id
@@ -276,6 +425,7 @@ def register_user(full_name, gender, login, password, file_path, biometric_type,
         if check_dublicate_biometric(None, vector, biometric_type):
             raise Exception("Похожий биометрический образец уже зарегистрирован другим пользователем")
         config = BIOMETRIC_CONFIG[biometric_type]
+        sensor_id = get_sensor_id(biometric_type)
         conn = get_db_connection()
         cursor = conn.cursor()
 
@@ -286,13 +436,6 @@ def register_user(full_name, gender, login, password, file_path, biometric_type,
         """, (full_name, gender, login, hash_password(password)))
         subject_id = cursor.fetchone()[0]
 
-        # Добавляем сенсор
-        cursor.execute("""
-            INSERT INTO sensors (sensor_name, sensor_type, manufacturer)
-            VALUES (%s, %s, %s) RETURNING sensor_id
-        """, (f'Generic {biometric_type} Sensor', 'camera', 'Generic'))
-        sensor_id = cursor.fetchone()[0]
-
         # Добавляем образец
         cursor.execute("""
             INSERT INTO samples (subject_id, sensor_id, sample_type, sample_hash, file_path)
@@ -301,6 +444,7 @@ def register_user(full_name, gender, login, password, file_path, biometric_type,
         sample_id = cursor.fetchone()[0]
 
         conn.commit()
+        clear_users_summary_cache()
         cursor.close()
         conn.close()
 
@@ -338,7 +482,7 @@ def save_face_vector(sample_id, vector):
         cursor.execute("""
             INSERT INTO face_samples (sample_id, image_width, image_height, image_format, feature_vector)
             VALUES (%s, %s, %s, %s, %s)
-        """, (sample_id, 640, 480, 'jpg', str(vector)))
+        """, (sample_id, 640, 480, 'jpg', to_vector(vector, 'face')))
 
         conn.commit()
         cursor.close()
@@ -364,7 +508,7 @@ def save_signature_vector(sample_id, vector, stroke_speed=None):
             INSERT INTO signature_samples (
                 sample_id, signature_image_path, stroke_speed, signature_vector
             ) VALUES (%s, %s, %s, %s)
-        """, (sample_id, '', stroke_speed, str(vector)))
+        """, (sample_id, '', stroke_speed, to_vector(vector, 'signature')))
 
         conn.commit()
         cursor.close()
@@ -387,7 +531,7 @@ def save_voice_vector(sample_id, vector, sampling_rate=16000, audio_format='wav'
             INSERT INTO voice_samples (
                 sample_id, voice_text, sampling_rate, audio_format, audio_vector
             ) VALUES (%s, %s, %s, %s, %s)
-        """, (sample_id, '', sampling_rate, audio_format, str(vector)))
+        """, (sample_id, '', sampling_rate, audio_format, to_vector(vector, 'voice')))
 
         conn.commit()
         cursor.close()
@@ -398,14 +542,26 @@ def save_voice_vector(sample_id, vector, sampling_rate=16000, audio_format='wav'
         print("Ошибка при сохранении вектора голоса:", e)
         return False
 
-def get_all_users_with_biometrics():
+def get_all_users_with_biometrics(include_vectors=False):
+    """
+    Все пользователи со списком активных образцов. Векторы загружаются только
+    при include_vectors=True; для списка пользователей — get_users_summary.
+    """
     try:
         # Подключение к базе данных с использованием RealDictCursor для именованных полей
-        conn = psycopg2.connect(**DB_CONFIG, cursor_factory=RealDictCursor)
-        cur = conn.cursor()
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=RealDictCursor)
         
+        vector_columns = """
+                fs.feature_vector AS face_vector,
+                vs.audio_vector AS voice_vector,
+                ss.signature_vector""" if include_vectors else """
+                NULL AS face_vector,
+                NULL AS voice_vector,
+                NULL AS signature_vector"""
+
         # SQL-запрос для получения всех данных о пользователях и их биометрии
-        query = """
+        query = f"""
             SELECT 
                 s.subject_id,
                 s.full_name,
@@ -418,14 +574,11 @@ def get_all_users_with_biometrics():
                 fs.image_width,
                 fs.image_height,
                 fs.image_format,
-                fs.feature_vector AS face_vector,
                 vs.voice_text,
                 vs.sampling_rate,
                 vs.audio_format,
-                vs.audio_vector AS voice_vector,
                 ss.signature_image_path,
-                ss.stroke_speed,
-                ss.signature_vector
+                ss.stroke_speed,{vector_columns}
             FROM subjects s
             LEFT JOIN samples samp ON s.subject_id = samp.subject_id AND samp.status = 'active'
             LEFT JOIN face_samples fs ON samp.sample_id = fs.sample_id
@@ -495,4 +648,98 @@ def get_all_users_with_biometrics():
     
     except Exception as e:
         print(f"Ошибка при получении данных: {e}")
-        return None
\ No newline at end of file
+        return None
+
+# Список пользователей: страница по subject_id и короткий кэш в памяти процесса
+USER_PAGE_SIZE = 50
+USER_SUMMARY_TTL = 5.0
+
+_users_summary_cache = {}
+_users_summary_lock = threading.Lock()
+
+def get_users_summary(after_id=None, limit=USER_PAGE_SIZE, use_cache=True):
+    """
+    Страница пользователей без векторов: данные субъекта, число активных образцов
+    по модальностям ('counts') и флаги has_face/has_voice/has_signature.
+    after_id — subject_id последнего пользователя предыдущей страницы.
+    Возвращает (users, next_after_id); next_after_id = None на последней странице.
+    Результат кэшируется на USER_SUMMARY_TTL секунд; регистрация и изменение
+    биометрии в этом процессе сбрасывают кэш.
+    """
+    key = (after_id, limit)
+    if use_cache:
+        cached = _users_summary_cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    # Сначала страница субъектов по первичному ключу, затем подсчёт только её образцов
+    cursor.execute("""
+        SELECT s.subject_id, s.full_name, s.gender, s.login, s.is_active,
+               count(samp.sample_id) FILTER (WHERE samp.sample_type = 'face') AS face_count,
+               count(samp.sample_id) FILTER (WHERE samp.sample_type = 'voice') AS voice_count,
+               count(samp.sample_id) FILTER (WHERE samp.sample_type = 'signature') AS signature_count
+        FROM (
+            SELECT subject_id, full_name, gender, login, is_active
+            FROM subjects
+            WHERE subject_id > %s
+            ORDER BY subject_id
+            LIMIT %s
+        ) s
+        LEFT JOIN samples samp ON samp.subject_id = s.subject_id AND samp.status = 'active'
+        GROUP BY s.subject_id, s.full_name, s.gender, s.login, s.is_active
+        ORDER BY s.subject_id
+    """, (after_id if after_id is not None else 0, limit))
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    users = []
+    for row in rows:
+        counts = {biometric_type: row.pop(f'{biometric_type}_count') for biometric_type in BIOMETRIC_CONFIG}
+        row['counts'] = counts
+        for biometric_type, count in counts.items():
+            row[f'has_{biometric_type}'] = count > 0
+        users.append(dict(row))
+    result = (users, users[-1]['subject_id'] if len(users) == limit else None)
+
+    if use_cache:
+        now = time.monotonic()
+        with _users_summary_lock:
+            for stale in [k for k, (expires, _) in _users_summary_cache.items() if expires <= now]:
+                del _users_summary_cache[stale]
+            _users_summary_cache[key] = (now + USER_SUMMARY_TTL, result)
+    return result
+
+def clear_users_summary_cache():
+    with _users_summary_lock:
+        _users_summary_cache.clear()
+
+def get_subject_biometrics(subject_id, include_vectors=False):
+    """Активные образцы одного пользователя; векторы — только при include_vectors=True"""
+    if include_vectors:
+        query = """
+            SELECT samp.sample_id, samp.sample_type, samp.file_path, samp.recorded_at,
+                   fs.feature_vector, vs.audio_vector, ss.signature_vector
+            FROM samples samp
+            LEFT JOIN face_samples fs ON samp.sample_id = fs.sample_id
+            LEFT JOIN voice_samples vs ON samp.sample_id = vs.sample_id
+            LEFT JOIN signature_samples ss ON samp.sample_id = ss.sample_id
+            WHERE samp.subject_id = %s AND samp.status = 'active'
+            ORDER BY samp.sample_id
+        """
+    else:
+        query = """
+            SELECT sample_id, sample_type, file_path, recorded_at
+            FROM samples
+            WHERE subject_id = %s AND status = 'active'
+            ORDER BY sample_id
+        """
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(query, (subject_id,))
+    rows = [dict(row) for row in cursor.fetchall()]
+    cursor.close()
+    conn.close()
+    return rows
\ No newline at end of file
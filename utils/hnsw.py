@@ -0,0 +1,410 @@
+import heapq
+import math
+import os
+from typing import List
+import numpy as np
+from utils.index_storage import (
+    INDEX_FORMAT_VERSION, MANIFEST_FILE, normalize_rows, group_by_subject,
+    write_logins, read_logins, synchronized, LockedIndex,
+    read_manifest, write_array, write_json, load_array, append_delta, apply_delta, clear_delta
+)
+
+# Доля удалённых (помеченных) узлов, после которой граф стоит перестроить
+REBUILD_DELETED_RATIO = 0.2
+REBUILD_MIN_DELETED = 50
+
+
+class HNSWIndex(LockedIndex):
+    """
+    HNSW-граф (Hierarchical Navigable Small World) по косинусному расстоянию
+    на чистом NumPy. Интерфейс совпадает с IVFIndex: fit/add/remove/search/
+    search_batch/save/load, поэтому движок выбирается ключом 'engine' в BIOMETRIC_CONFIG.
+
+    Векторы L2-нормализованы, расстояние — 1 - x·q. Нулевой слой хранится
+    матрицей соседей (n, 2M) с заполнением -1, верхние слои — словарями.
+    Удаление помечает узел, он продолжает участвовать в навигации,
+    но не попадает в результаты. Публичные методы выполняются под self.lock.
+    """
+    def __init__(self, M: int = 16, ef_construction: int = 100, ef_search: int = 50,
+                 top_k: int = 5, seed: int = 0):
+        self.M = M
+        self.M0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.top_k = top_k
+        self.seed = seed
+        self.level_mult = 1.0 / math.log(M)
+        self._init_lock()
+        self._reset()
+
+    def _reset(self):
+        self.rng = np.random.default_rng(self.seed)
+        self.count = 0
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.sample_ids = np.zeros(0, dtype=np.int64)
+        self.subject_ids = np.zeros(0, dtype=np.int64)
+        self.levels = np.zeros(0, dtype=np.int8)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.layer0 = np.zeros((0, self.M0), dtype=np.int32)
+        self.upper_layers = []
+        self.entry_point = -1
+        self.max_level = -1
+        self._positions = {}
+        self._writable = True
+        self.logins = {}
+
+        self.n_trained = 0
+        self.n_added = 0
+        self.n_removed = 0
+        self.recall = None
+
+    def __len__(self):
+        return self.count - int(self.deleted[:self.count].sum())
+
+    def __contains__(self, sample_id):
+        return sample_id in self.positions
+
+    @property
+    def positions(self):
+        """sample_id -> номер узла (только живые узлы); строится лениво"""
+        if self._positions is None:
+            live = np.flatnonzero(~self.deleted[:self.count])
+            self._positions = dict(zip(self.sample_ids[live].tolist(), live.tolist()))
+        return self._positions
+
+    @property
+    def dim(self):
+        return self.vectors.shape[1] if self.count else None
+
+    # ---------- хранение ----------
+
+    def _make_writable(self):
+        """После load() массивы открыты только на чтение через mmap — копируем при первом изменении"""
+        if self._writable:
+            return
+        self.vectors = np.array(self.vectors)
+        self.sample_ids = np.array(self.sample_ids)
+        self.subject_ids = np.array(self.subject_ids)
+        self.levels = np.array(self.levels)
+        self.deleted = np.array(self.deleted)
+        self.layer0 = np.array(self.layer0)
+        self._writable = True
+
+    def _reserve(self, capacity: int, dim: int):
+        self._make_writable()
+        if capacity <= len(self.sample_ids):
+            return
+        capacity = max(capacity, 2 * len(self.sample_ids))
+        grow = capacity - len(self.sample_ids)
+        if self.count == 0 and self.vectors.shape[1] != dim:
+            self.vectors = np.zeros((0, dim), dtype=np.float32)
+        self.vectors = np.concatenate([self.vectors, np.zeros((grow, dim), dtype=np.float32)])
+        self.sample_ids = np.concatenate([self.sample_ids, np.zeros(grow, dtype=np.int64)])
+        self.subject_ids = np.concatenate([self.subject_ids, np.zeros(grow, dtype=np.int64)])
+        self.levels = np.concatenate([self.levels, np.zeros(grow, dtype=np.int8)])
+        self.deleted = np.concatenate([self.deleted, np.zeros(grow, dtype=bool)])
+        self.layer0 = np.concatenate([self.layer0, np.full((grow, self.M0), -1, dtype=np.int32)])
+
+    # ---------- граф ----------
+
+    def _random_level(self):
+        return int(-math.log(1.0 - self.rng.random()) * self.level_mult)
+
+    def _neighbors(self, node: int, level: int):
+        if level == 0:
+            row = self.layer0[node]
+            return row[row >= 0].tolist()
+        return self.upper_layers[level - 1].get(node, [])
+
+    def _set_neighbors(self, node: int, level: int, neighbors: List[int]):
+        if level == 0:
+            self.layer0[node] = -1
+            self.layer0[node, :len(neighbors)] = neighbors
+        else:
+            self.upper_layers[level - 1][node] = list(neighbors)
+
+    def _search_layer(self, query: np.ndarray, entry_points, ef: int, level: int):
+        """Жадный поиск по слою; entry_points и результат — списки (расстояние, узел) по возрастанию"""
+        visited = {node for _, node in entry_points}
+        candidates = list(entry_points)
+        heapq.heapify(candidates)
+        results = [(-dist, node) for dist, node in entry_points]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            dist, node = heapq.heappop(candidates)
+            if len(results) >= ef and dist > -results[0][0]:
+                break
+            neighbors = [n for n in self._neighbors(node, level) if n not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            dists = 1.0 - self.vectors[neighbors] @ query
+            for neighbor_dist, neighbor in zip(dists.tolist(), neighbors):
+                if len(results) < ef or neighbor_dist < -results[0][0]:
+                    heapq.heappush(candidates, (neighbor_dist, neighbor))
+                    heapq.heappush(results, (-neighbor_dist, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted((-neg_dist, node) for neg_dist, node in results)
+
+    def _connect(self, node: int, new_node: int, level: int, max_conn: int):
+        links = self._neighbors(node, level)
+        if len(links) < max_conn:
+            links.append(new_node)
+        else:
+            links = links + [new_node]
+            dists = 1.0 - self.vectors[links] @ self.vectors[node]
+            links = [links[i] for i in np.argsort(dists)[:max_conn]]
+        self._set_neighbors(node, level, links)
+
+    def _descend(self, query: np.ndarray, target_level: int):
+        """Спуск от точки входа до target_level с ef=1"""
+        entry = [(float(1.0 - self.vectors[self.entry_point] @ query), self.entry_point)]
+        for level in range(self.max_level, target_level, -1):
+            entry = self._search_layer(query, entry, 1, level)[:1]
+        return entry
+
+    def _insert(self, node: int):
+        query = self.vectors[node]
+        level = self._random_level()
+        self.levels[node] = min(level, np.iinfo(np.int8).max)
+        while len(self.upper_layers) < level:
+            self.upper_layers.append({})
+        for upper in range(1, level + 1):
+            self.upper_layers[upper - 1].setdefault(node, [])
+
+        if self.entry_point < 0:
+            self.entry_point = node
+            self.max_level = level
+            return
+
+        entry = self._descend(query, level)
+        for current in range(min(level, self.max_level), -1, -1):
+            found = self._search_layer(query, entry, self.ef_construction, current)
+            max_conn = self.M0 if current == 0 else self.M
+            neighbors = [n for _, n in found if n != node][:max_conn]
+            self._set_neighbors(node, current, neighbors)
+            for neighbor in neighbors:
+                self._connect(neighbor, node, current, max_conn)
+            entry = found
+
+        if level > self.max_level:
+            self.entry_point = node
+            self.max_level = level
+
+    # ---------- публичный интерфейс ----------
+
+    @synchronized
+    def fit(self, sample_ids: List[int], subject_ids: List[int], vectors: np.ndarray, logins: dict = None):
+        if len(sample_ids) == 0:
+            raise ValueError("No vectors provided for training.")
+        vectors = normalize_rows(vectors)
+
+        self._reset()
+        self.logins = dict(logins or {})
+        self._reserve(len(sample_ids), vectors.shape[1])
+        for sample_id, subject_id, vector in zip(sample_ids, subject_ids, vectors):
+            self._append(int(sample_id), int(subject_id), vector)
+        self.n_trained = self.count
+
+    def _append(self, sample_id: int, subject_id: int, vector: np.ndarray):
+        self._reserve(self.count + 1, len(vector))
+        node = self.count
+        self.vectors[node] = vector
+        self.sample_ids[node] = sample_id
+        self.subject_ids[node] = subject_id
+        self.deleted[node] = False
+        self.count += 1
+        self.positions[sample_id] = node
+        self._insert(node)
+
+    @synchronized
+    def add(self, sample_id: int, subject_id: int, vector: np.ndarray, login: str = None):
+        """Вставка одного образца в граф без перестройки"""
+        if sample_id in self.positions:
+            self.remove(sample_id)
+        vector = normalize_rows(np.asarray(vector).reshape(1, -1))[0]
+        self._append(int(sample_id), int(subject_id), vector)
+        if login is not None:
+            self.logins[int(subject_id)] = login
+        self.n_added += 1
+
+    @synchronized
+    def remove(self, sample_id: int):
+        """Помечает образец удалённым; возвращает False, если его не было"""
+        node = self.positions.pop(sample_id, None)
+        if node is None:
+            return False
+        self._make_writable()
+        self.deleted[node] = True
+        self.n_removed += 1
+        return True
+
+    def needs_retrain(self):
+        """Граф перестраивается, когда помеченных удалёнными узлов становится слишком много"""
+        n_deleted = int(self.deleted[:self.count].sum())
+        return n_deleted >= REBUILD_MIN_DELETED and n_deleted > REBUILD_DELETED_RATIO * self.count
+
+    @synchronized
+    def all_vectors(self):
+        live = np.flatnonzero(~self.deleted[:self.count])
+        return self.sample_ids[live], self.vectors[live]
+
+    @synchronized
+    def search(self, query_vector: np.ndarray):
+        ids, dists = self.search_batch(np.asarray(query_vector).reshape(1, -1))
+        return [(int(sid), float(d)) for sid, d in zip(ids[0], dists[0]) if sid >= 0]
+
+    def _search_nodes(self, query: np.ndarray, k: int):
+        """k ближайших живых узлов: список (расстояние, узел) по возрастанию"""
+        entry = self._descend(query, 0)
+        found = self._search_layer(query, entry, max(self.ef_search, k), 0)
+        return [(d, n) for d, n in found if not self.deleted[n]][:k]
+
+    def _search_subjects(self, query: np.ndarray, k: int):
+        """
+        k ближайших уникальных субъектов: список (расстояние, узел).
+        Ширина поиска удваивается, пока образцы одного субъекта вытесняют остальных.
+        """
+        width = k
+        while True:
+            found = self._search_nodes(query, width)
+            seen = set()
+            unique = []
+            for dist, node in found:
+                subject_id = int(self.subject_ids[node])
+                if subject_id not in seen:
+                    seen.add(subject_id)
+                    unique.append((dist, node))
+            if len(unique) >= k or len(found) < width:
+                return unique[:k]
+            width *= 2
+
+    @synchronized
+    def search_batch(self, query_vectors: np.ndarray, top_k: int = None, n_probe: int = None,
+                     return_sample_ids: bool = False, unique_subjects: bool = True):
+        """
+        Поиск для матрицы запросов (m, d); формат результата как у IVFIndex.search_batch.
+        n_probe не используется — ширину поиска задаёт ef_search.
+        """
+        unique_subjects = unique_subjects and not return_sample_ids
+        top_k = top_k or self.top_k
+        queries = normalize_rows(np.asarray(query_vectors).reshape(len(query_vectors), -1))
+        result_ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        result_dists = np.full((len(queries), top_k), np.inf, dtype=np.float32)
+        if self.entry_point < 0:
+            return result_ids, result_dists
+
+        id_array = self.sample_ids if return_sample_ids else self.subject_ids
+        for qi, query in enumerate(queries):
+            found = self._search_subjects(query, top_k) if unique_subjects else self._search_nodes(query, top_k)
+            for rank, (dist, node) in enumerate(found):
+                result_ids[qi, rank] = id_array[node]
+                result_dists[qi, rank] = dist
+        return result_ids, result_dists
+
+    @synchronized
+    def range_search(self, query_vector: np.ndarray, max_distance: float):
+        """
+        Все образцы ближе max_distance, сгруппированные по субъектам (как IVFIndex.range_search).
+        Граф не даёт границ отсечения, поэтому ширина поиска удваивается,
+        пока самый дальний найденный узел ещё укладывается в порог.
+        """
+        if self.entry_point < 0:
+            return {}
+        query = normalize_rows(np.asarray(query_vector).reshape(1, -1))[0]
+        k = self.top_k
+        while True:
+            found = self._search_nodes(query, k)
+            if len(found) < k or found[-1][0] >= max_distance or k >= len(self):
+                break
+            k *= 2
+        nodes = np.array([n for d, n in found if d < max_distance], dtype=np.int64)
+        if len(nodes) == 0:
+            return {}
+        dists = np.array([d for d, n in found if d < max_distance], dtype=np.float32)
+        return group_by_subject(self.sample_ids[nodes], self.subject_ids[nodes], dists)
+
+    @synchronized
+    def save(self, index_path: str):
+        os.makedirs(index_path, exist_ok=True)
+        n = self.count
+        write_array(index_path, 'vectors.npy', self.vectors[:n])
+        write_array(index_path, 'sample_ids.npy', self.sample_ids[:n])
+        write_array(index_path, 'subject_ids.npy', self.subject_ids[:n])
+        write_array(index_path, 'levels.npy', self.levels[:n])
+        write_array(index_path, 'deleted.npy', self.deleted[:n])
+        write_array(index_path, 'layer0.npy', self.layer0[:n])
+        write_logins(index_path, self.logins)
+        for level, layer in enumerate(self.upper_layers, start=1):
+            nodes = np.array(sorted(layer), dtype=np.int32)
+            links = np.full((len(nodes), self.M), -1, dtype=np.int32)
+            for row, node in enumerate(nodes):
+                neighbors = layer[node]
+                links[row, :len(neighbors)] = neighbors
+            write_array(index_path, f'layer{level}_nodes.npy', nodes)
+            write_array(index_path, f'layer{level}_links.npy', links)
+        write_json(index_path, MANIFEST_FILE, {
+            'format': 'hnsw',
+            'version': INDEX_FORMAT_VERSION,
+            'M': self.M,
+            'ef_construction': self.ef_construction,
+            'ef_search': self.ef_search,
+            'top_k': self.top_k,
+            'seed': self.seed,
+            'dim': self.dim,
+            'count': n,
+            'entry_point': int(self.entry_point),
+            'max_level': int(self.max_level),
+            'n_layers': len(self.upper_layers),
+            'n_trained': self.n_trained,
+            'n_added': self.n_added,
+            'n_removed': self.n_removed,
+            'recall': self.recall
+        })
+        clear_delta(index_path)
+
+    def save_delta(self, index_path: str, ops):
+        append_delta(index_path, ops)
+
+    def apply_delta(self, index_path: str):
+        apply_delta(self, index_path)
+
+    @classmethod
+    def load(cls, index_path: str, mmap: bool = True):
+        """Массивы нулевого слоя и векторы открываются через mmap, верхние слои читаются в словари"""
+        manifest = read_manifest(index_path)
+        if manifest.get('format') != 'hnsw' or manifest.get('version') != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемый формат индекса: {manifest.get('format')} v{manifest.get('version')}")
+
+        obj = cls(M=manifest['M'], ef_construction=manifest['ef_construction'],
+                  ef_search=manifest['ef_search'], top_k=manifest['top_k'], seed=manifest['seed'])
+        obj.count = manifest['count']
+        obj.vectors = load_array(index_path, 'vectors.npy', mmap)
+        obj.sample_ids = load_array(index_path, 'sample_ids.npy', mmap)
+        obj.subject_ids = load_array(index_path, 'subject_ids.npy', mmap)
+        obj.logins = read_logins(index_path)
+        obj.levels = load_array(index_path, 'levels.npy', mmap)
+        obj.deleted = load_array(index_path, 'deleted.npy', mmap)
+        obj.layer0 = load_array(index_path, 'layer0.npy', mmap)
+        obj._writable = not mmap
+        obj.upper_layers = []
+        for level in range(1, manifest['n_layers'] + 1):
+            nodes = load_array(index_path, f'layer{level}_nodes.npy', mmap=False)
+            links = load_array(index_path, f'layer{level}_links.npy', mmap=False)
+            obj.upper_layers.append({
+                int(node): [int(n) for n in row if n >= 0]
+                for node, row in zip(nodes, links)
+            })
+        obj.entry_point = manifest['entry_point']
+        obj.max_level = manifest['max_level']
+        obj._positions = None
+        obj.n_trained = manifest['n_trained']
+        obj.n_added = manifest['n_added']
+        obj.n_removed = manifest['n_removed']
+        obj.recall = manifest.get('recall')
+        obj.apply_delta(index_path)
+        return obj
@@ -0,0 +1,233 @@
+import functools
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import numpy as np
+
+# Формат каталога индекса: массивы .npy + manifest.json (+ delta.jsonl)
+INDEX_FORMAT_VERSION = 1
+MANIFEST_FILE = 'manifest.json'
+DELTA_FILE = 'delta.jsonl'
+LOGINS_FILE = 'logins.json'
+
+# Поколения: index_path/gen-000001, ... и файл CURRENT с именем активного поколения
+CURRENT_FILE = 'CURRENT'
+GENERATION_PATTERN = re.compile(r'^gen-(\d+)$')
+KEEP_GENERATIONS = 2
+
+def synchronized(method):
+    """
+    Выполняет метод индекса под его self.lock (RLock): поток слушателя
+    и инкрементальные обновления меняют индекс, пока другие потоки по нему ищут
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class LockedIndex:
+    """Общая часть движков: self.lock, который не попадает в pickle и пересоздаётся при распаковке"""
+    def _init_lock(self):
+        self.lock = threading.RLock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('lock', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_lock()
+
+def normalize_rows(vectors: np.ndarray):
+    """L2-нормализация строк в float32 (нулевые векторы остаются нулевыми)"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(vectors / norms, dtype=np.float32)
+
+def top_k_smallest(dists: np.ndarray, k: int):
+    """Индексы k наименьших расстояний в порядке возрастания"""
+    if k >= len(dists):
+        return np.argsort(dists)
+    part = np.argpartition(dists, k)[:k]
+    return part[np.argsort(dists[part])]
+
+def group_by_subject(sample_ids: np.ndarray, subject_ids: np.ndarray, dists: np.ndarray):
+    """
+    Группирует найденные образцы по субъектам:
+    {subject_id: [(sample_id, distance), ...]}, субъекты и образцы по возрастанию расстояния.
+    """
+    groups = {}
+    for i in np.argsort(dists, kind='stable'):
+        groups.setdefault(int(subject_ids[i]), []).append((int(sample_ids[i]), float(dists[i])))
+    return groups
+
+def unique_by_subject(ids: np.ndarray, dists: np.ndarray, k: int):
+    """Оставляет по одному (ближайшему) результату на субъекта; возвращает позиции top-k"""
+    order = np.argsort(dists, kind='stable')
+    _, first = np.unique(ids[order], return_index=True)
+    return order[np.sort(first)][:k]
+
+def write_logins(index_path: str, logins: dict):
+    write_json(index_path, LOGINS_FILE, {str(sid): login for sid, login in logins.items()})
+
+def read_logins(index_path: str):
+    path = os.path.join(index_path, LOGINS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return {int(sid): login for sid, login in json.load(f).items()}
+
+def manifest_path(index_path: str):
+    return os.path.join(index_path, MANIFEST_FILE)
+
+def delta_path(index_path: str):
+    return os.path.join(index_path, DELTA_FILE)
+
+def current_generation(index_path: str):
+    """Имя активного поколения из CURRENT или None, если индекс ещё не публиковался"""
+    try:
+        with open(os.path.join(index_path, CURRENT_FILE), encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def resolve_index_dir(index_path: str):
+    """
+    Каталог с файлами активного поколения. Каталоги старого формата
+    (manifest.json прямо в index_path) читаются как есть.
+    """
+    generation = current_generation(index_path)
+    if generation is None:
+        return index_path
+    return os.path.join(index_path, generation)
+
+def index_exists(index_path: str):
+    return os.path.exists(manifest_path(resolve_index_dir(index_path)))
+
+def list_generations(index_path: str):
+    """Номера опубликованных поколений по возрастанию"""
+    if not os.path.isdir(index_path):
+        return []
+    numbers = []
+    for name in os.listdir(index_path):
+        match = GENERATION_PATTERN.match(name)
+        if match:
+            numbers.append(int(match.group(1)))
+    return sorted(numbers)
+
+def make_staging_dir(index_path: str):
+    """Временный каталог для сборки нового поколения рядом с опубликованными"""
+    os.makedirs(index_path, exist_ok=True)
+    return tempfile.mkdtemp(prefix='.staging-', dir=index_path)
+
+def publish_generation(index_path: str, staging_dir: str):
+    """
+    Переименовывает собранный каталог в gen-NNNNNN и атомарно переключает CURRENT.
+    Читатели, открывшие предыдущее поколение, продолжают работать с ним до
+    следующего обращения к реестру. Возвращает номер нового поколения.
+    """
+    while True:
+        existing = list_generations(index_path)
+        number = (existing[-1] if existing else 0) + 1
+        try:
+            os.rename(staging_dir, os.path.join(index_path, f'gen-{number:06d}'))
+            break
+        except OSError:
+            # Номер занял параллельный процесс — берём следующий
+            if not os.path.exists(os.path.join(index_path, f'gen-{number:06d}')):
+                raise
+
+    tmp_path = os.path.join(index_path, CURRENT_FILE + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(f'gen-{number:06d}\n')
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(index_path, CURRENT_FILE))
+    prune_generations(index_path)
+    return number
+
+def prune_generations(index_path: str, keep: int = KEEP_GENERATIONS):
+    """Удаляет старые поколения, оставляя keep последних (включая активное)"""
+    current = current_generation(index_path)
+    for number in list_generations(index_path)[:-keep]:
+        name = f'gen-{number:06d}'
+        if name != current:
+            # На Windows файлы, открытые через mmap, удалить нельзя — уберём в следующий раз
+            shutil.rmtree(os.path.join(index_path, name), ignore_errors=True)
+
+def remove_legacy_pickle(index_path: str):
+    """
+    Удаляет файл индекса старого формата (index_path + '.pkl'): после публикации
+    первого поколения он не читается. Возвращает путь удалённого файла или None.
+    """
+    legacy_path = index_path.rstrip('/\\') + '.pkl'
+    if not os.path.isfile(legacy_path):
+        return None
+    os.remove(legacy_path)
+    return legacy_path
+
+def read_manifest(index_path: str):
+    with open(manifest_path(index_path), encoding='utf-8') as f:
+        return json.load(f)
+
+def write_array(index_path: str, name: str, array: np.ndarray):
+    """Пишет .npy во временный файл и атомарно подменяет: открытые mmap читателей не ломаются"""
+    tmp_path = os.path.join(index_path, name + '.tmp')
+    with open(tmp_path, 'wb') as f:
+        np.save(f, np.ascontiguousarray(array))
+    os.replace(tmp_path, os.path.join(index_path, name))
+
+def write_json(index_path: str, name: str, data: dict):
+    tmp_path = os.path.join(index_path, name + '.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, os.path.join(index_path, name))
+
+def load_array(index_path: str, name: str, mmap: bool = True):
+    return np.load(os.path.join(index_path, name), mmap_mode='r' if mmap else None)
+
+def append_delta(index_path: str, ops):
+    """
+    Дописывает инкрементальные изменения в delta.jsonl внутри каталога индекса.
+    ops: список ('add', sample_id, subject_id, vector[, login]) / ('remove', sample_id)
+    """
+    with open(delta_path(index_path), 'a', encoding='utf-8') as f:
+        for op in ops:
+            if op[0] == 'add':
+                record = {'op': 'add', 'sample_id': int(op[1]), 'subject_id': int(op[2]),
+                          'vector': np.asarray(op[3], dtype=np.float32).tolist(),
+                          'login': op[4] if len(op) > 4 else None}
+            else:
+                record = {'op': 'remove', 'sample_id': int(op[1])}
+            f.write(json.dumps(record) + '\n')
+
+def delta_size(index_path: str):
+    path = delta_path(index_path)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def apply_delta(index, index_path: str, offset: int = 0):
+    """Применяет к загруженному индексу изменения из delta.jsonl, начиная с байта offset"""
+    path = delta_path(index_path)
+    if not os.path.exists(path):
+        return
+    with open(path, encoding='utf-8') as f:
+        f.seek(offset)
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if record['op'] == 'add':
+                index.add(record['sample_id'], record['subject_id'],
+                          np.array(record['vector'], dtype=np.float32), record.get('login'))
+            elif record['op'] == 'remove':
+                index.remove(record['sample_id'])
+
+def clear_delta(index_path: str):
+    if os.path.exists(delta_path(index_path)):
+        os.remove(delta_path(index_path))
@@ -1,154 +1,1241 @@
-import pickle
+import atexit
+import copy
+import functools
+import json
+import os
+import select
+import shutil
+import threading
+import time
+import zlib
 from typing import List
 import numpy as np
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from scipy.spatial.distance import cdist
-from sklearn.cluster import KMeans
-from utils.config import DB_CONFIG
+from sklearn.cluster import MiniBatchKMeans
+from utils.quantizers import make_codec, CODECS
+from utils.hnsw import HNSWIndex
+from utils.sharded import ShardedIndex
+from utils.vector_codec import VECTOR_DTYPE, decode_vector, decode_matrix
+from utils.index_storage import (
+    INDEX_FORMAT_VERSION, MANIFEST_FILE, normalize_rows, top_k_smallest, group_by_subject,
+    unique_by_subject, write_logins, read_logins, synchronized, LockedIndex,
+    manifest_path, delta_path, index_exists, read_manifest, write_array, write_json,
+    load_array, append_delta, apply_delta, clear_delta, delta_size,
+    resolve_index_dir, make_staging_dir, publish_generation, remove_legacy_pickle
+)
+from utils.config import DB_CONFIG, BIOMETRIC_CONFIG
+from utils.db_pool import get_connection
 
-# IVF index parameters
-N_CLUSTERS = 1
+# IVF index parameters (N_CLUSTERS = None — подбирается по размеру галереи)
+N_CLUSTERS = None
 N_PROBE = 5
 TOP_K = 5
 
+# Автоподбор и обучение IVF
+MAX_CLUSTERS = 4096
+MIN_POINTS_PER_CLUSTER = 39
+TRAIN_POINTS_PER_CLUSTER = 256
+ASSIGN_CHUNK_SIZE = 65536
+TARGET_RECALL = 0.95
+TUNING_QUERIES = 200
+
+# HNSW parameters (по умолчанию; переопределяются ключом 'hnsw_params' в BIOMETRIC_CONFIG)
+HNSW_M = 16
+HNSW_EF_CONSTRUCTION = 100
+HNSW_EF_SEARCH = 50
+
+# Политика полного переобучения после инкрементальных изменений
+RETRAIN_MIN_CHANGES = 50
+RETRAIN_CHANGE_RATIO = 0.2
+RETRAIN_DRIFT_RATIO = 1.5
+
+# Во сколько раз больше кандидатов, чем top_k, перепроверяется точно при сжатии
+RERANK_FACTOR = 4
+
+# Запросы на перестройку, пришедшие в пределах этого окна, выполняются одной сборкой
+REBUILD_COALESCE_SECONDS = 2.0
+
+# Размер порции серверного курсора при загрузке векторов
+FETCH_CHUNK_SIZE = 10000
+
+# Канал уведомлений об изменениях образцов (sql/02_index_notify.sql)
+NOTIFY_CHANNEL = 'biometric_index'
+LISTEN_POLL_SECONDS = 1.0
+LISTEN_MAX_BACKOFF_SECONDS = 30.0
+
+# Сериализует дописывание дельты и публикацию нового поколения внутри процесса
+_publish_lock = threading.Lock()
+
 def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+    return get_connection()
 
 def fetch_vectors(table_name: str, vector_column: str):
+    """
+    Потоково читает активные векторы модальности.
+    Строки идут через именованный (серверный) курсор порциями по FETCH_CHUNK_SIZE
+    и сразу складываются в заранее выделенную float32-матрицу, так что пиковая
+    память — сама матрица плюс одна порция. Векторы лежат в BYTEA (float32),
+    порция декодируется одним np.frombuffer. Количество строк и сами строки
+    читаются в одном снимке (REPEATABLE READ).
+    """
+    start = time.perf_counter()
     conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-
-    cursor.execute(f"""
-        SELECT samples.subject_id, {table_name}.{vector_column}
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    query_from = f"""
         FROM {table_name}
         JOIN samples ON {table_name}.sample_id = samples.sample_id
+        JOIN subjects ON samples.subject_id = subjects.subject_id
         WHERE samples.status = 'active' AND {table_name}.{vector_column} IS NOT NULL
-    """)
-    rows = cursor.fetchall()
-    cursor.close()
-    conn.close()
+    """
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT count(*), max(octet_length({table_name}.{vector_column})) {query_from}")
+        total, max_bytes = cursor.fetchone()
+        cursor.close()
+        if not total:
+            return [], [], np.zeros((0, 0), dtype=np.float32), {}
+
+        dim = max_bytes // VECTOR_DTYPE.itemsize
+        sample_ids = np.empty(total, dtype=np.int64)
+        subject_ids = np.empty(total, dtype=np.int64)
+        vectors = np.empty((total, dim), dtype=np.float32)
+        logins = {}
 
-    subject_ids = []
-    vectors = []
-    for row in rows:
-        sid = row['subject_id']
-        vec_list = row[vector_column]
-        arr = np.array(vec_list, dtype=np.float32)
-        subject_ids.append(sid)
-        vectors.append(arr)
+        cursor = conn.cursor(name=f'fetch_{table_name}')
+        cursor.itersize = FETCH_CHUNK_SIZE
+        cursor.execute(f"""
+            SELECT samples.sample_id, samples.subject_id, subjects.login, {table_name}.{vector_column}
+            {query_from}
+        """)
+        filled = 0
+        while True:
+            rows = cursor.fetchmany(FETCH_CHUNK_SIZE)
+            if not rows:
+                break
+            end = filled + len(rows)
+            sample_ids[filled:end] = [row[0] for row in rows]
+            subject_ids[filled:end] = [row[1] for row in rows]
+            vectors[filled:end] = decode_matrix([row[3] for row in rows], dim)
+            for row in rows:
+                logins[row[1]] = row[2]
+            filled = end
+        cursor.close()
+    finally:
+        conn.close()
 
-    if not vectors:
-        return [], np.zeros((0, 0), dtype=np.float32)
+    elapsed = time.perf_counter() - start
+    print(f"Загружено {filled} векторов {table_name}.{vector_column} за {elapsed:.2f} с "
+          f"({filled / max(elapsed, 1e-9):.0f} строк/с)")
+    return sample_ids[:filled], subject_ids[:filled], vectors[:filled], logins
 
-    vectors_np = np.stack(vectors, axis=0)
-    return subject_ids, vectors_np
+class IVFIndex(LockedIndex):
+    """
+    IVF-индекс по косинусному расстоянию.
+    Каждый инвертированный список хранится как непрерывная матрица
+    L2-нормализованных float32-векторов и параллельные массивы sample_id/subject_id,
+    поэтому расстояние до всех кандидатов списка — одно матрично-векторное
+    произведение: 1 - X @ q.
 
+    Внутри списка образцы упорядочены по subject_id, поэтому минимальное
+    расстояние до каждого субъекта считается одним np.minimum.reduceat,
+    и поиск сразу возвращает уникальных субъектов. Индекс также хранит
+    логины субъектов (logins), чтобы распознавание обходилось без запроса к БД.
 
-class IVFIndex:
-    def __init__(self, n_clusters: int = 100, n_probe: int = 5, top_k: int = 5):
+    При compression='sq8' или 'pq' списки хранят компактные коды и номера строк
+    (list_rows) в общей матрице полных векторов rerank_vectors: сканирование идёт
+    по кодам, а лучшие RERANK_FACTOR * top_k кандидатов перепроверяются точно.
+    После save()/load() rerank_vectors — mmap файла vectors.npy, так что в памяти
+    процесса остаются только коды, а полные векторы — лишь добавленные после
+    сохранения (_added_vectors).
+
+    add/remove/search/search_batch/range_search выполняются под self.lock;
+    составные операции «проверить и изменить» вызывающий код держит под ним же.
+    """
+    def __init__(self, n_clusters: int = None, n_probe: int = 5, top_k: int = 5,
+                 compression: str = None, codec_params: dict = None):
         self.n_clusters = n_clusters
         self.n_probe = n_probe
         self.top_k = top_k
+        self.compression = compression
+        self.codec_params = codec_params or {}
+        self._init_lock()
+
+        self.centroids = None
+        # Угловой радиус кластера: максимальный угол между центроидом и элементом списка
+        self.radii = None
+        self.codec = None
+        self.list_vectors = []
+        self.list_codes = []
+        self.list_rows = []
+        self.rerank_vectors = None
+        self._added_vectors = None
+        self.list_sample_ids = []
+        self.list_subject_ids = []
+        self._assignments = {}
+        # subject_id -> login
+        self.logins = {}
+
+        # Статистика для политики переобучения
+        self.n_trained = 0
+        self.train_mean_dist = 0.0
+        self.n_added = 0
+        self.n_removed = 0
+        self.added_dist_sum = 0.0
+
+        # Параметры обучения и измеренный recall@top_k относительно точного перебора
+        self.train_size = 0
+        self.recall = None
+        # Насколько сжатие снижает recall@top_k по сравнению с полными векторами
+        self.codec_recall_loss = None
 
-        self.kmeans = None
-        self.inverted_lists = {}
-        self.sample_ids = None
-        self.vectors = None
+    def __len__(self):
+        return sum(len(ids) for ids in self.list_sample_ids)
 
-    def fit(self, ids: List[int], vectors: np.ndarray):
-        if len(ids) == 0:
+    def __contains__(self, sample_id):
+        return sample_id in self.assignments
+
+    @property
+    def assignments(self):
+        """sample_id -> номер кластера; строится лениво, чтобы не замедлять загрузку"""
+        if self._assignments is None:
+            self._assignments = {
+                int(sample_id): cluster_id
+                for cluster_id, ids in enumerate(self.list_sample_ids)
+                for sample_id in ids
+            }
+        return self._assignments
+
+    @property
+    def dim(self):
+        return None if self.centroids is None else self.centroids.shape[1]
+
+    @synchronized
+    def fit(self, sample_ids: List[int], subject_ids: List[int], vectors: np.ndarray, logins: dict = None):
+        if len(sample_ids) == 0:
             raise ValueError("No vectors provided for training.")
 
-        self.sample_ids = ids
-        self.vectors = vectors
+        self.logins = dict(logins or {})
+        vectors = normalize_rows(vectors)
+        sample_ids = np.asarray(sample_ids, dtype=np.int64)
+        subject_ids = np.asarray(subject_ids, dtype=np.int64)
+
+        if self.n_clusters is None:
+            self.n_clusters = choose_n_clusters(len(vectors))
+        self.n_clusters = min(self.n_clusters, len(vectors))
+        self.centroids = self._train_centroids(vectors)
+        labels = self._assign(vectors)
 
-        self.kmeans = KMeans(n_clusters=self.n_clusters, random_state=0)
-        self.kmeans.fit(vectors)
-        labels = self.kmeans.labels_
+        codes = None
+        if self.compression:
+            self.codec = make_codec(self.compression, **self.codec_params)
+            self.codec.train(vectors)
+            codes = self.codec.encode(vectors)
+
+        self.list_vectors = []
+        self.list_codes = []
+        self.list_rows = []
+        self.list_sample_ids = []
+        self.list_subject_ids = []
+        order = []
+        for cluster_id in range(self.n_clusters):
+            members = np.flatnonzero(labels == cluster_id)
+            members = members[np.argsort(subject_ids[members], kind='stable')]
+            if codes is None:
+                self.list_vectors.append(np.ascontiguousarray(vectors[members]))
+            else:
+                self.list_codes.append(codes[members])
+                self.list_rows.append(np.arange(len(order), len(order) + len(members), dtype=np.int64))
+                order.extend(members.tolist())
+            self.list_sample_ids.append(sample_ids[members])
+            self.list_subject_ids.append(subject_ids[members])
+        if codes is not None:
+            # Одна матрица в порядке списков; после save() она заменяется mmap файла
+            self.rerank_vectors = vectors[np.asarray(order, dtype=np.int64)]
+            self._added_vectors = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        self._assignments = dict(zip(sample_ids.tolist(), labels.tolist()))
+
+        train_dists = 1.0 - np.einsum('ij,ij->i', vectors, self.centroids[labels])
+        angles = np.arccos(np.clip(1.0 - train_dists, -1.0, 1.0))
+        self.radii = np.zeros(self.n_clusters, dtype=np.float32)
+        np.maximum.at(self.radii, labels, angles.astype(np.float32))
+        self.n_trained = len(sample_ids)
+        self.train_mean_dist = float(train_dists.mean())
+        self.n_added = 0
+        self.n_removed = 0
+        self.added_dist_sum = 0.0
+
+    def _train_centroids(self, vectors: np.ndarray):
+        """
+        MiniBatchKMeans на случайной подвыборке (TRAIN_POINTS_PER_CLUSTER точек на кластер),
+        чтобы время обучения не зависело от размера галереи.
+        """
+        if self.n_clusters == 1:
+            self.train_size = len(vectors)
+            return normalize_rows(vectors.mean(axis=0, keepdims=True))
+
+        train_size = min(len(vectors), self.n_clusters * TRAIN_POINTS_PER_CLUSTER)
+        rng = np.random.default_rng(0)
+        train = vectors[rng.choice(len(vectors), train_size, replace=False)]
+        kmeans = MiniBatchKMeans(n_clusters=self.n_clusters, batch_size=min(4096, train_size),
+                                 n_init=3, random_state=0)
+        kmeans.fit(train)
+        self.train_size = train_size
+        return normalize_rows(kmeans.cluster_centers_)
+
+    def _assign(self, vectors: np.ndarray):
+        """Номер ближайшего центроида для каждого вектора, порциями по ASSIGN_CHUNK_SIZE"""
+        labels = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), ASSIGN_CHUNK_SIZE):
+            chunk = vectors[start:start + ASSIGN_CHUNK_SIZE]
+            labels[start:start + len(chunk)] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return labels
+
+    @synchronized
+    def add(self, sample_id: int, subject_id: int, vector: np.ndarray, login: str = None):
+        """Добавляет образец в ближайший существующий кластер без переобучения"""
+        if self.centroids is None:
+            raise ValueError("Index not trained. Call fit() first.")
+        if sample_id in self.assignments:
+            self.remove(sample_id)
 
-        self.inverted_lists = {i: [] for i in range(self.n_clusters)}
-        for idx, label in enumerate(labels):
-            sid = ids[idx]
-            vec = vectors[idx]
-            self.inverted_lists[label].append((sid, vec))
+        vector = normalize_rows(np.asarray(vector).reshape(1, -1))
+        centroid_dists = 1.0 - self.centroids @ vector[0]
+        cluster_id = int(np.argmin(centroid_dists))
 
+        # Вставка с сохранением порядка по subject_id
+        pos = int(np.searchsorted(self.list_subject_ids[cluster_id], subject_id, side='right'))
+        if self.codec is None:
+            self.list_vectors[cluster_id] = np.insert(self.list_vectors[cluster_id], pos, vector[0], axis=0)
+        else:
+            # Полный вектор — в конец _added_vectors, список хранит только номер строки
+            row = len(self.rerank_vectors) + len(self._added_vectors)
+            self._added_vectors = np.concatenate([self._added_vectors, vector])
+            self.list_rows[cluster_id] = np.insert(self.list_rows[cluster_id], pos, row)
+            self.list_codes[cluster_id] = np.insert(self.list_codes[cluster_id], pos,
+                                                    self.codec.encode(vector)[0], axis=0)
+        self.list_sample_ids[cluster_id] = np.insert(self.list_sample_ids[cluster_id], pos, sample_id)
+        self.list_subject_ids[cluster_id] = np.insert(self.list_subject_ids[cluster_id], pos, subject_id)
+        self.assignments[sample_id] = cluster_id
+        if login is not None:
+            self.logins[int(subject_id)] = login
+        # Радиус только растёт: после удалений он остаётся верхней оценкой
+        angle = float(np.arccos(np.clip(1.0 - centroid_dists[cluster_id], -1.0, 1.0)))
+        self.radii[cluster_id] = max(self.radii[cluster_id], angle)
+        self.n_added += 1
+        self.added_dist_sum += float(centroid_dists[cluster_id])
+
+    @synchronized
+    def remove(self, sample_id: int):
+        """Удаляет образец из индекса; возвращает False, если его там не было"""
+        cluster_id = self.assignments.pop(sample_id, None)
+        if cluster_id is None:
+            return False
+        keep = self.list_sample_ids[cluster_id] != sample_id
+        if self.codec is None:
+            self.list_vectors[cluster_id] = self.list_vectors[cluster_id][keep]
+        else:
+            # Строка в rerank_vectors освобождается при следующем сохранении
+            self.list_rows[cluster_id] = self.list_rows[cluster_id][keep]
+            self.list_codes[cluster_id] = self.list_codes[cluster_id][keep]
+        self.list_sample_ids[cluster_id] = self.list_sample_ids[cluster_id][keep]
+        self.list_subject_ids[cluster_id] = self.list_subject_ids[cluster_id][keep]
+        self.n_removed += 1
+        return True
+
+    def needs_retrain(self):
+        """
+        Полное переобучение нужно, если после обучения накопилось слишком много
+        изменений или новые образцы заметно дальше от центроидов, чем обучающие.
+        """
+        changes = self.n_added + self.n_removed
+        if changes > max(RETRAIN_MIN_CHANGES, RETRAIN_CHANGE_RATIO * self.n_trained):
+            return True
+        if self.n_added >= RETRAIN_MIN_CHANGES and self.train_mean_dist > 0:
+            added_mean_dist = self.added_dist_sum / self.n_added
+            if added_mean_dist > RETRAIN_DRIFT_RATIO * self.train_mean_dist:
+                return True
+        return False
+
+    def _full_vectors(self, cluster_id: int, positions: np.ndarray = None):
+        """
+        Полные векторы списка или его позиций positions (массив любой формы).
+        У сжатого индекса они читаются по номерам строк из rerank_vectors
+        (с mmap — только нужные страницы) и _added_vectors.
+        """
+        if self.codec is None:
+            vectors = self.list_vectors[cluster_id]
+            return vectors if positions is None else vectors[positions]
+        rows = self.list_rows[cluster_id]
+        if positions is not None:
+            rows = rows[positions]
+        n_base = len(self.rerank_vectors)
+        if len(self._added_vectors) == 0:
+            return self.rerank_vectors[rows]
+        result = np.empty(rows.shape + (self.dim,), dtype=np.float32)
+        base = rows < n_base
+        result[base] = self.rerank_vectors[rows[base]]
+        result[~base] = self._added_vectors[rows[~base] - n_base]
+        return result
+
+    @synchronized
+    def all_vectors(self):
+        return (np.concatenate(self.list_sample_ids),
+                np.concatenate([self._full_vectors(c) for c in range(len(self.list_sample_ids))]))
+
+    @synchronized
+    def range_search(self, query_vector: np.ndarray, max_distance: float):
+        """
+        Все образцы с косинусным расстоянием меньше max_distance, сгруппированные по субъектам.
+        Кластер пропускается, если по неравенству треугольника для углов
+        angle(q, c) - radius(c) > arccos(1 - max_distance): в нём не может быть попаданий.
+        """
+        if self.centroids is None:
+            raise ValueError("Index not trained. Call fit() first.")
+        q = normalize_rows(np.asarray(query_vector).reshape(1, -1))[0]
+        max_angle = np.arccos(np.clip(1.0 - max_distance, -1.0, 1.0))
+        centroid_angles = np.arccos(np.clip(self.centroids @ q, -1.0, 1.0))
+        candidate_clusters = np.flatnonzero(centroid_angles - self.radii <= max_angle)
+
+        hit_samples = []
+        hit_subjects = []
+        hit_dists = []
+        for cluster_id in candidate_clusters:
+            if len(self.list_sample_ids[cluster_id]) == 0:
+                continue
+            dists = 1.0 - self._full_vectors(cluster_id) @ q
+            hits = np.flatnonzero(dists < max_distance)
+            if len(hits) == 0:
+                continue
+            hit_samples.append(self.list_sample_ids[cluster_id][hits])
+            hit_subjects.append(self.list_subject_ids[cluster_id][hits])
+            hit_dists.append(dists[hits])
+
+        if not hit_dists:
+            return {}
+        return group_by_subject(np.concatenate(hit_samples), np.concatenate(hit_subjects),
+                                np.concatenate(hit_dists))
+
+    @synchronized
     def search(self, query_vector: np.ndarray):
-        if self.kmeans is None:
+        ids, dists = self.search_batch(np.asarray(query_vector).reshape(1, -1))
+        return [(int(sid), float(d)) for sid, d in zip(ids[0], dists[0]) if sid >= 0]
+
+    def _scan_list(self, cluster_id: int, queries: np.ndarray, k: int, unique_subjects: bool = False):
+        """
+        k ближайших элементов списка для каждого запроса.
+        Возвращает локальные позиции в списке и расстояния, обе формы (nq, k).
+        При unique_subjects расстояния сворачиваются до минимума по субъекту,
+        а позиция указывает на первый образец субъекта в списке
+        (для сжатого индекса — на его образец, ближайший по кодам).
+        """
+        n = len(self.list_sample_ids[cluster_id])
+        if self.codec is None:
+            dists = 1.0 - queries @ self.list_vectors[cluster_id].T
+            if unique_subjects:
+                subject_ids = self.list_subject_ids[cluster_id]
+                starts = np.flatnonzero(np.r_[True, subject_ids[1:] != subject_ids[:-1]])
+                dists = np.minimum.reduceat(dists, starts, axis=1)
+                if k < len(starts):
+                    nearest = np.argpartition(dists, k - 1, axis=1)[:, :k]
+                    return starts[nearest], np.take_along_axis(dists, nearest, axis=1)
+                return np.tile(starts, (len(queries), 1)), dists
+        else:
+            # Приближённый проход по кодам, затем точная перепроверка лучших кандидатов
+            approx = 1.0 - self.codec.dot(self.list_codes[cluster_id], queries)
+            subject_best = None
+            if unique_subjects:
+                # Кандидат от субъекта — его образец с наименьшим приближённым расстоянием,
+                # чтобы перепроверяемые места не занимали образцы одного субъекта
+                subject_ids = self.list_subject_ids[cluster_id]
+                starts = np.flatnonzero(np.r_[True, subject_ids[1:] != subject_ids[:-1]])
+                best = np.minimum.reduceat(approx, starts, axis=1)
+                owner = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, n]))
+                positions = np.where(approx == best[:, owner], np.arange(n), n)
+                subject_best = np.minimum.reduceat(positions, starts, axis=1)
+                approx = best
+            n_pool = approx.shape[1]
+            n_rerank = min(k * RERANK_FACTOR, n_pool)
+            if n_rerank < n_pool:
+                candidates = np.argpartition(approx, n_rerank - 1, axis=1)[:, :n_rerank]
+            else:
+                candidates = np.tile(np.arange(n_pool), (len(queries), 1))
+            if subject_best is not None:
+                candidates = np.take_along_axis(subject_best, candidates, axis=1)
+            exact = 1.0 - np.einsum('qkd,qd->qk', self._full_vectors(cluster_id, candidates), queries)
+            if k < n_rerank:
+                nearest = np.argpartition(exact, k - 1, axis=1)[:, :k]
+                return (np.take_along_axis(candidates, nearest, axis=1),
+                        np.take_along_axis(exact, nearest, axis=1))
+            return candidates, exact
+
+        if k < n:
+            nearest = np.argpartition(dists, k - 1, axis=1)[:, :k]
+            return nearest, np.take_along_axis(dists, nearest, axis=1)
+        return np.tile(np.arange(n), (len(queries), 1)), dists
+
+    @synchronized
+    def search_batch(self, query_vectors: np.ndarray, top_k: int = None, n_probe: int = None,
+                     return_sample_ids: bool = False, unique_subjects: bool = True):
+        """
+        Поиск для матрицы запросов (m, d).
+        Запросы группируются по просматриваемым кластерам: на каждый кластер
+        выполняется одно матричное произведение со всеми запросами, которые его выбрали.
+        Возвращает массивы subject_id и расстояний формы (m, top_k), по одному
+        (ближайшему) результату на субъекта; с return_sample_ids — sample_id без группировки.
+        Недостающие позиции заполнены -1 и inf.
+        """
+        unique_subjects = unique_subjects and not return_sample_ids
+        if self.centroids is None:
             raise ValueError("Index not trained. Call fit() first.")
-        print('vector:', query_vector)
-        print('vector dimensions:', query_vector.shape)
-        q = query_vector.reshape(1, -1)
-        print('index dimensions:', self.kmeans.cluster_centers_.shape)
-        centroid_dists = cdist(q, self.kmeans.cluster_centers_, metric='cosine')[0]
-        closest_clusters = np.argsort(centroid_dists)[:self.n_probe]
-
-        candidates = []
-        for cluster_id in closest_clusters:
-            candidates.extend(self.inverted_lists.get(cluster_id, []))
-
-        if not candidates:
-            return []
-
-        cands_vecs = np.array([vec for (_, vec) in candidates])
-        cands_ids = [sid for (sid, _) in candidates]
-        dists = cdist(q, cands_vecs, metric='cosine')[0]
-
-        nearest_idx = np.argsort(dists)[:self.top_k]
-        results = [(cands_ids[i], float(dists[i])) for i in nearest_idx]
-        #print(results)
-        return results
-
-    def save(self, filepath: str):
-        with open(filepath, 'wb') as f:
-            pickle.dump({
-                'n_clusters': self.n_clusters,
-                'n_probe': self.n_probe,
-                'top_k': self.top_k,
-                'kmeans': self.kmeans,
-                'inverted_lists': self.inverted_lists,
-                'sample_ids': self.sample_ids,
-                'vectors': self.vectors
-            }, f)
+        top_k = top_k or self.top_k
+        n_probe = min(n_probe or self.n_probe, len(self.centroids))
+
+        queries = normalize_rows(np.asarray(query_vectors).reshape(len(query_vectors), -1))
+        m = len(queries)
+        centroid_dists = 1.0 - queries @ self.centroids.T
+        if n_probe < len(self.centroids):
+            probes = np.argpartition(centroid_dists, n_probe - 1, axis=1)[:, :n_probe]
+        else:
+            probes = np.tile(np.arange(len(self.centroids)), (m, 1))
+
+        cand_ids = [[] for _ in range(m)]
+        cand_dists = [[] for _ in range(m)]
+        id_lists = self.list_sample_ids if return_sample_ids else self.list_subject_ids
+        for cluster_id in np.unique(probes):
+            if len(self.list_sample_ids[cluster_id]) == 0:
+                continue
+            query_idx = np.flatnonzero((probes == cluster_id).any(axis=1))
+            nearest, dists = self._scan_list(cluster_id, queries[query_idx], top_k, unique_subjects)
+            ids = id_lists[cluster_id][nearest]
+            for row, qi in enumerate(query_idx):
+                cand_ids[qi].append(ids[row])
+                cand_dists[qi].append(dists[row])
+
+        result_ids = np.full((m, top_k), -1, dtype=np.int64)
+        result_dists = np.full((m, top_k), np.inf, dtype=np.float32)
+        for qi in range(m):
+            if not cand_ids[qi]:
+                continue
+            ids = np.concatenate(cand_ids[qi])
+            dists = np.concatenate(cand_dists[qi])
+            if unique_subjects:
+                # Субъект может встретиться в нескольких кластерах — оставляем минимум
+                nearest = unique_by_subject(ids, dists, top_k)
+            else:
+                nearest = top_k_smallest(dists, top_k)
+            result_ids[qi, :len(nearest)] = ids[nearest]
+            result_dists[qi, :len(nearest)] = dists[nearest]
+        return result_ids, result_dists
+
+    @synchronized
+    def save(self, index_path: str):
+        """
+        Сохраняет индекс в каталог: centroids.npy, vectors.npy (все списки подряд),
+        offsets.npy, sample_ids.npy, subject_ids.npy и manifest.json.
+        Манифест пишется последним, поэтому частично записанный каталог не читается.
+        """
+        os.makedirs(index_path, exist_ok=True)
+        sizes = [len(ids) for ids in self.list_sample_ids]
+        offsets = np.zeros(len(sizes) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(sizes)
+        vectors = (np.concatenate([self._full_vectors(c) for c in range(len(sizes))]) if sizes
+                   else np.zeros((0, self.dim or 0), dtype=np.float32))
+
+        write_array(index_path, 'centroids.npy', self.centroids)
+        write_array(index_path, 'radii.npy', self.radii)
+        write_array(index_path, 'vectors.npy', vectors)
+        write_array(index_path, 'offsets.npy', offsets)
+        write_array(index_path, 'sample_ids.npy', np.concatenate(self.list_sample_ids))
+        write_array(index_path, 'subject_ids.npy', np.concatenate(self.list_subject_ids))
+        write_logins(index_path, self.logins)
+        if self.codec is not None:
+            write_array(index_path, 'codes.npy', np.concatenate(self.list_codes))
+            for name, array in self.codec.to_arrays().items():
+                write_array(index_path, name + '.npy', array)
+        write_json(index_path, MANIFEST_FILE, {
+            'format': 'ivf',
+            'version': INDEX_FORMAT_VERSION,
+            'n_clusters': self.n_clusters,
+            'n_probe': self.n_probe,
+            'top_k': self.top_k,
+            'compression': self.compression,
+            'codec_params': self.codec.params() if self.codec is not None else {},
+            'dim': self.dim,
+            'count': int(offsets[-1]),
+            'n_trained': self.n_trained,
+            'train_mean_dist': self.train_mean_dist,
+            'n_added': self.n_added,
+            'n_removed': self.n_removed,
+            'added_dist_sum': self.added_dist_sum,
+            'train_size': self.train_size,
+            'recall': self.recall,
+            'codec_recall_loss': self.codec_recall_loss
+        })
+        # Полный снимок уже содержит все изменения
+        clear_delta(index_path)
+        if self.codec is not None:
+            # Полные векторы больше не держим в памяти: перепроверка читает их из файла
+            self._map_rerank_vectors(load_array(index_path, 'vectors.npy', mmap=True), offsets)
+
+    def _map_rerank_vectors(self, vectors: np.ndarray, offsets: np.ndarray):
+        self.rerank_vectors = vectors
+        self._added_vectors = np.zeros((0, vectors.shape[1]), dtype=np.float32)
+        self.list_rows = [np.arange(lo, hi, dtype=np.int64) for lo, hi in zip(offsets[:-1], offsets[1:])]
+
+    def save_delta(self, index_path: str, ops):
+        append_delta(index_path, ops)
+
+    def apply_delta(self, index_path: str):
+        apply_delta(self, index_path)
 
     @classmethod
-    def load(cls, filepath: str):
-        with open(filepath, 'rb') as f:
-            data = pickle.load(f)
-        obj = cls(n_clusters=data['n_clusters'], n_probe=data['n_probe'], top_k=data['top_k'])
-        obj.kmeans = data['kmeans']
-        obj.inverted_lists = data['inverted_lists']
-        obj.sample_ids = data['sample_ids']
-        obj.vectors = data['vectors']
+    def load(cls, index_path: str, mmap: bool = True):
+        """
+        Открывает каталог индекса. Массивы отображаются в память (mmap_mode='r'),
+        так что холодный старт не читает векторы целиком, а несколько процессов
+        делят одни и те же страницы page cache. Списки — срезы общего массива;
+        при add/remove изменённый список копируется в память процесса.
+        """
+        manifest = read_manifest(index_path)
+        if manifest.get('format') != 'ivf' or manifest.get('version') != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемый формат индекса: {manifest.get('format')} v{manifest.get('version')}")
+
+        obj = cls(n_clusters=manifest['n_clusters'], n_probe=manifest['n_probe'], top_k=manifest['top_k'],
+                  compression=manifest['compression'], codec_params=manifest['codec_params'])
+        obj.centroids = load_array(index_path, 'centroids.npy', mmap=False)
+        obj.radii = np.array(load_array(index_path, 'radii.npy', mmap=False))
+        vectors = load_array(index_path, 'vectors.npy', mmap)
+        offsets = load_array(index_path, 'offsets.npy', mmap=False)
+        sample_ids = load_array(index_path, 'sample_ids.npy', mmap)
+        subject_ids = load_array(index_path, 'subject_ids.npy', mmap)
+
+        bounds = list(zip(offsets[:-1], offsets[1:]))
+        obj.list_sample_ids = [sample_ids[lo:hi] for lo, hi in bounds]
+        obj.list_subject_ids = [subject_ids[lo:hi] for lo, hi in bounds]
+        obj.logins = read_logins(index_path)
+        if obj.compression:
+            codec_cls = CODECS[obj.compression]
+            arrays = {name: load_array(index_path, name + '.npy', mmap=False)
+                      for name in codec_cls.array_names}
+            obj.codec = codec_cls.from_arrays(arrays, obj.codec_params)
+            # Коды держим в памяти процесса: по ним идёт основной проход
+            codes = load_array(index_path, 'codes.npy', mmap=False)
+            obj.list_codes = [codes[lo:hi] for lo, hi in bounds]
+            obj._map_rerank_vectors(vectors, offsets)
+        else:
+            obj.list_vectors = [vectors[lo:hi] for lo, hi in bounds]
+        obj._assignments = None
+
+        obj.n_trained = manifest['n_trained']
+        obj.train_mean_dist = manifest['train_mean_dist']
+        obj.n_added = manifest['n_added']
+        obj.n_removed = manifest['n_removed']
+        obj.added_dist_sum = manifest['added_dist_sum']
+        obj.train_size = manifest.get('train_size', 0)
+        obj.recall = manifest.get('recall')
+        obj.codec_recall_loss = manifest.get('codec_recall_loss')
+        obj.apply_delta(index_path)
         return obj
 
+
+def index_config(index_path: str):
+    """Запись BIOMETRIC_CONFIG, которой принадлежит индекс (или пустой словарь)"""
+    for config in BIOMETRIC_CONFIG.values():
+        if os.path.abspath(config['index_file']) == os.path.abspath(index_path):
+            return config
+    return {}
+
+def choose_n_clusters(n_vectors: int):
+    """~sqrt(N) кластеров, но не меньше MIN_POINTS_PER_CLUSTER точек на кластер"""
+    n_clusters = int(round(np.sqrt(n_vectors)))
+    n_clusters = min(n_clusters, n_vectors // MIN_POINTS_PER_CLUSTER, MAX_CLUSTERS)
+    return max(1, n_clusters)
+
+def exact_neighbors(index, queries: np.ndarray, top_k: int):
+    """Точные top_k sample_id перебором по всем векторам индекса"""
+    sample_ids, vectors = index.all_vectors()
+    queries = normalize_rows(queries)
+    return [set(sample_ids[top_k_smallest(1.0 - vectors @ q, top_k)].tolist()) for q in queries]
+
+def measure_recall(index, queries: np.ndarray, top_k: int = None, n_probe: int = None, exact=None):
+    """
+    recall@top_k поиска по индексу относительно точного перебора всех векторов.
+    Сравниваются sample_id, так что несколько образцов одного субъекта не смешиваются.
+    """
+    top_k = top_k or index.top_k
+    if exact is None:
+        exact = exact_neighbors(index, queries, top_k)
+
+    found, _ = index.search_batch(queries, top_k=top_k, n_probe=n_probe, return_sample_ids=True)
+    hits = sum(len(expected & set(row.tolist())) for expected, row in zip(exact, found))
+    total = sum(len(expected) for expected in exact)
+    return hits / total if total else 1.0
+
+def measure_codec_recall_loss(index, queries: np.ndarray, exact=None):
+    """
+    Потеря recall@top_k от сжатия: те же списки при том же n_probe сканируются
+    по полным векторам, оба варианта измеряются measure_recall.
+    Результат сохраняется в index.codec_recall_loss.
+    """
+    if exact is None:
+        exact = exact_neighbors(index, queries, index.top_k)
+    plain = copy.copy(index)
+    plain.codec = None
+    plain.list_vectors = [index._full_vectors(c) for c in range(len(index.list_sample_ids))]
+    index.codec_recall_loss = measure_recall(plain, queries, exact=exact) - measure_recall(index, queries, exact=exact)
+    return index.codec_recall_loss
+
+def tune_n_probe(index, queries: np.ndarray, target_recall: float = TARGET_RECALL):
+    """
+    Подбирает минимальный n_probe (1, 2, 4, ...), при котором recall@top_k
+    на контрольных запросах не ниже target_recall, и сохраняет его в индексе.
+    """
+    exact = exact_neighbors(index, queries, index.top_k)
+    n_probe = 1
+    while True:
+        recall = measure_recall(index, queries, n_probe=n_probe, exact=exact)
+        if recall >= target_recall or n_probe >= index.n_clusters:
+            break
+        n_probe = min(n_probe * 2, index.n_clusters)
+    index.n_probe = n_probe
+    index.recall = recall
+    return n_probe, recall
+
+ENGINES = {
+    'ivf': IVFIndex,
+    'hnsw': HNSWIndex,
+    'sharded': ShardedIndex
+}
+
+def make_index(config: dict):
+    """
+    Создаёт пустой индекс движка, указанного в записи BIOMETRIC_CONFIG.
+    При 'shards' > 1 галерея делится на шарды того же движка.
+    """
+    n_shards = config.get('shards') or 1
+    if n_shards > 1:
+        return ShardedIndex(n_shards, shard_factory=functools.partial(make_index, {**config, 'shards': 1}),
+                            top_k=TOP_K)
+    engine = config.get('engine', 'ivf')
+    if engine == 'ivf':
+        return IVFIndex(n_clusters=N_CLUSTERS, n_probe=N_PROBE, top_k=TOP_K,
+                        compression=config.get('compression'))
+    if engine == 'hnsw':
+        params = {'M': HNSW_M, 'ef_construction': HNSW_EF_CONSTRUCTION, 'ef_search': HNSW_EF_SEARCH}
+        params.update(config.get('hnsw_params') or {})
+        return HNSWIndex(top_k=TOP_K, **params)
+    raise ValueError(f"Неизвестный движок индекса: {engine}")
+
+def load_index(index_path: str, mmap: bool = True):
+    """Загружает активное поколение индекса любого движка по полю 'format' в манифесте"""
+    index_dir = resolve_index_dir(index_path)
+    engine = read_manifest(index_dir).get('format')
+    if engine not in ENGINES:
+        raise ValueError(f"Неизвестный формат индекса: {engine}")
+    return ENGINES[engine].load(index_dir, mmap=mmap)
+
 def update_index(table_name, vector_column, index_path):
+    """
+    Полная перестройка индекса. Новое поколение собирается во временном
+    каталоге и публикуется атомарной сменой CURRENT; до этого момента
+    читатели работают с предыдущим поколением.
+    """
     print(f"Обновление индекса для {table_name}.{vector_column}...")
-    ids, vectors = fetch_vectors(table_name, vector_column)
-    index = IVFIndex(n_clusters=N_CLUSTERS, n_probe=N_PROBE, top_k=TOP_K)
-    index.fit(ids, vectors)
-    index.save(index_path)
-    print("Индекс успешно обновлен")
+    config = index_config(index_path)
+    # Изменения, дописанные в дельту активного поколения во время сборки, переносятся в новое
+    base_dir = resolve_index_dir(index_path)
+    base_offset = delta_size(base_dir)
+    sample_ids, subject_ids, vectors, logins = fetch_vectors(table_name, vector_column)
+    index = make_index(config)
+    index.fit(sample_ids, subject_ids, vectors, logins)
+
+    rng = np.random.default_rng(0)
+    queries = vectors[rng.choice(len(vectors), min(len(vectors), TUNING_QUERIES), replace=False)]
+    if isinstance(index, IVFIndex):
+        n_probe, recall = tune_n_probe(index, queries, config.get('target_recall', TARGET_RECALL))
+        print(f"IVF: {index.n_clusters} кластеров (обучение на {index.train_size} векторах), "
+              f"n_probe = {n_probe}, recall@{index.top_k} = {recall:.3f}")
+        if index.codec is not None:
+            loss = measure_codec_recall_loss(index, queries)
+            print(f"Сжатие {index.compression}: потеря recall@{index.top_k} = {loss:.3f} "
+                  f"относительно полных векторов")
+    elif isinstance(index, ShardedIndex):
+        for shard in index.shards:
+            if isinstance(shard, IVFIndex):
+                tune_n_probe(shard, queries, config.get('target_recall', TARGET_RECALL))
+                if shard.codec is not None:
+                    measure_codec_recall_loss(shard, queries)
+        index.recall = measure_recall(index, queries)
+        print(f"{index.n_shards} шардов ({config.get('engine', 'ivf').upper()}): "
+              f"recall@{index.top_k} = {index.recall:.3f}")
+        losses = [shard.codec_recall_loss for shard in index.shards
+                  if getattr(shard, 'codec_recall_loss', None) is not None]
+        if losses:
+            print(f"Сжатие {config.get('compression')}: потеря recall@{index.top_k} по шардам "
+                  f"до {max(losses):.3f} относительно полных векторов")
+    else:
+        index.recall = measure_recall(index, queries)
+        print(f"{config.get('engine', 'ivf').upper()}: recall@{index.top_k} = {index.recall:.3f}")
+
+    with _publish_lock:
+        if index_exists(index_path) and resolve_index_dir(index_path) == base_dir:
+            apply_delta(index, base_dir, base_offset)
+        staging_dir = make_staging_dir(index_path)
+        try:
+            index.save(staging_dir)
+            generation = publish_generation(index_path, staging_dir)
+        except Exception:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            raise
+    print(f"Индекс успешно обновлен (поколение {generation})")
+    legacy_path = remove_legacy_pickle(index_path)
+    if legacy_path:
+        print(f"Удалён файл индекса старого формата {legacy_path}")
+
+def update_index_for_subject(table_name, vector_column, index_path, subject_id):
+    """
+    Инкрементально синхронизирует индекс с образцами одного субъекта:
+    активные образцы добавляются, деактивированные удаляются.
+    Если индекса ещё нет или перестройки требует политика переобучения,
+    сборка ставится в очередь фонового index_rebuilder (образцы субъекта
+    попадут в неё из БД), а поиск до публикации нового поколения идёт по текущему.
+    """
+    if not index_exists(index_path):
+        print("Индекса ещё нет, сборка запланирована в фоне")
+        index_rebuilder.request(table_name, vector_column, index_path)
+        return
+
+    conn = get_db_connection()
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    cursor.execute(f"""
+        SELECT samples.sample_id, samples.status, subjects.login, {table_name}.{vector_column}
+        FROM {table_name}
+        JOIN samples ON {table_name}.sample_id = samples.sample_id
+        JOIN subjects ON samples.subject_id = subjects.subject_id
+        WHERE samples.subject_id = %s
+    """, (subject_id,))
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+
+    index = get_index(index_path)
+    ops = []
+    # Проверка и изменение — под замком индекса: слушатель меняет тот же объект
+    with index.lock:
+        for row in rows:
+            sample_id = row['sample_id']
+            vec_data = row[vector_column]
+            if row['status'] == 'active' and vec_data is not None:
+                if sample_id not in index:
+                    vector = decode_vector(vec_data)
+                    index.add(sample_id, subject_id, vector, row['login'])
+                    ops.append(('add', sample_id, subject_id, vector, row['login']))
+            elif index.remove(sample_id):
+                ops.append(('remove', sample_id))
+
+        if ops:
+            with _publish_lock:
+                index.save_delta(resolve_index_dir(index_path), ops)
+    if ops:
+        index_registry.refresh(index_path)
+    print(f"Индекс обновлен инкрементально ({len(ops)} изменений)")
+
+    if index.needs_retrain():
+        print("Индекс сильно изменился, полное переобучение запланировано в фоне")
+        index_rebuilder.request(table_name, vector_column, index_path)
+
+
+class IndexRebuilder:
+    """
+    Фоновый поток полной перестройки индексов. Запросы к одному индексу,
+    пришедшие за REBUILD_COALESCE_SECONDS или во время идущей сборки,
+    сливаются в одну перестройку.
+    """
+    def __init__(self, coalesce_seconds: float = REBUILD_COALESCE_SECONDS):
+        self.coalesce_seconds = coalesce_seconds
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._busy = False
+        self._thread = None
+        self.requested = 0
+        self.rebuilds = 0
+        self.failed = 0
+
+    def request(self, table_name, vector_column, index_path):
+        with self._cond:
+            self.requested += 1
+            self._pending[os.path.abspath(index_path)] = (table_name, vector_column, index_path)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='index-rebuilder', daemon=True)
+                self._thread.start()
+            self._cond.notify_all()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._busy = False
+                    self._cond.notify_all()
+                    self._cond.wait()
+                self._busy = True
+            # Даём накопиться соседним запросам
+            time.sleep(self.coalesce_seconds)
+            with self._cond:
+                jobs = list(self._pending.values())
+                self._pending.clear()
+            for table_name, vector_column, index_path in jobs:
+                try:
+                    update_index(table_name, vector_column, index_path)
+                    self.rebuilds += 1
+                except Exception as e:
+                    self.failed += 1
+                    print(f"Ошибка фоновой перестройки индекса {index_path}: {e}")
+
+    def wait(self):
+        """Блокирует до завершения всех запрошенных перестроек"""
+        with self._cond:
+            while self._pending or self._busy:
+                self._cond.wait()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'requested': self.requested,
+                'rebuilds': self.rebuilds,
+                'failed': self.failed,
+                'pending': len(self._pending),
+                'busy': self._busy
+            }
+
+
+class IndexRegistry:
+    """
+    Процессный кэш загруженных индексов: один индекс (IVF или HNSW) на каталог.
+    Индекс перечитывается с диска только если сменилось поколение или изменились
+    mtime/размер манифеста или дельты и их контрольная сумма.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.reloads = 0
+        self.load_time_ms = 0.0
+
+    @staticmethod
+    def _file_signature(index_dir: str):
+        signature = [index_dir]
+        for path in (manifest_path(index_dir), delta_path(index_dir)):
+            if os.path.exists(path):
+                st = os.stat(path)
+                signature.append((st.st_mtime_ns, st.st_size))
+            else:
+                signature.append(None)
+        return tuple(signature)
+
+    @staticmethod
+    def _file_checksum(index_dir: str):
+        checksum = zlib.crc32(index_dir.encode('utf-8'))
+        for path in (manifest_path(index_dir), delta_path(index_dir)):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    checksum = zlib.crc32(chunk, checksum)
+        return checksum
+
+    def get(self, index_path: str):
+        key = os.path.abspath(index_path)
+        index_dir = resolve_index_dir(index_path)
+        signature = self._file_signature(index_dir)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['signature'] == signature:
+                self.hits += 1
+                return entry['index']
+
+            checksum = self._file_checksum(index_dir)
+            if entry is not None and entry['checksum'] == checksum:
+                # Файл перезаписан тем же содержимым — перечитывать незачем
+                entry['signature'] = signature
+                self.hits += 1
+                return entry['index']
+
+            self.misses += 1
+            if entry is not None:
+                self.reloads += 1
+            print(f"Загрузка индекса из {index_dir}...")
+            start = time.perf_counter()
+            index = load_index(index_dir)
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            self.load_time_ms += elapsed_ms
+            print(f"Индекс загружен за {elapsed_ms:.1f} мс")
+
+            # Прежний индекс не закрывается: другой поток может ещё искать по нему.
+            # Его пул процессов завершится, когда на индекс не останется ссылок
+            if hasattr(index, 'warm_up'):
+                index.warm_up()
+
+            self._entries[key] = {
+                'index': index,
+                'signature': signature,
+                'checksum': checksum,
+                'load_time_ms': elapsed_ms,
+                'loaded_at': time.time()
+            }
+            return index
+
+    def resident(self, index_path: str):
+        """Уже загруженный индекс или None — без обращения к диску"""
+        with self._lock:
+            entry = self._entries.get(os.path.abspath(index_path))
+            return entry['index'] if entry is not None else None
+
+    def preload(self, biometric_types=None):
+        """Загружает индексы всех (или указанных) модальностей из BIOMETRIC_CONFIG"""
+        for biometric_type, config in BIOMETRIC_CONFIG.items():
+            if biometric_types and biometric_type not in biometric_types:
+                continue
+            if index_exists(config['index_file']):
+                self.get(config['index_file'])
+
+    def refresh(self, index_path: str):
+        """
+        Запоминает текущее состояние файлов индекса после того, как этот процесс
+        сам изменил загруженный индекс и дописал дельту, чтобы не перечитывать его.
+        Если за это время опубликовано новое поколение, запись сбрасывается.
+        """
+        key = os.path.abspath(index_path)
+        index_dir = resolve_index_dir(index_path)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if entry['signature'][0] != index_dir:
+                del self._entries[key]
+                return
+            entry['signature'] = self._file_signature(index_dir)
+            entry['checksum'] = self._file_checksum(index_dir)
+
+    def invalidate(self, index_path: str = None):
+        with self._lock:
+            if index_path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(index_path), None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'reloads': self.reloads,
+                'total_load_time_ms': self.load_time_ms,
+                'indexes': {
+                    path: {
+                        'generation': os.path.basename(entry['signature'][0]),
+                        'load_time_ms': entry['load_time_ms'],
+                        'loaded_at': entry['loaded_at']
+                    }
+                    for path, entry in self._entries.items()
+                }
+            }
+
+
+class IndexChangeListener:
+    """
+    Поток, слушающий NOTIFY_CHANNEL и применяющий изменения образцов к индексам,
+    уже загруженным в index_registry: новые образцы (в том числе вставленные
+    другим процессом или SQL напрямую) добавляются, изменённые векторы
+    и образцы со сменой статуса или субъекта перечитываются, удалённые
+    и переведённые в 'inactive' — убираются. Вставка, которую этот процесс
+    уже применил через update_index_for_subject, повторно не применяется,
+    так что в дельту она пишется один раз. Все изменения идут под index.lock.
+    Уведомления, пришедшие вместе, обрабатываются пачкой — один запрос
+    за векторами на модальность. С persist=True изменения дописываются
+    и в дельту на диске (такой слушатель нужен один на систему).
+    """
+    def __init__(self, persist: bool = False, poll_seconds: float = LISTEN_POLL_SECONDS):
+        self.persist = persist
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread = None
+        self.events = 0
+        self.applied = 0
+        self.last_apply_ms = 0.0
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='index-listener', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        backoff = self.poll_seconds
+        while not self._stop.is_set():
+            conn = None
+            try:
+                # Отдельное соединение вне пула: LISTEN привязан к сессии
+                conn = psycopg2.connect(**DB_CONFIG)
+                conn.autocommit = True
+                conn.cursor().execute(f"LISTEN {NOTIFY_CHANNEL}")
+                backoff = self.poll_seconds
+                while not self._stop.is_set():
+                    if not select.select([conn], [], [], self.poll_seconds)[0]:
+                        continue
+                    conn.poll()
+                    events = []
+                    while conn.notifies:
+                        events.append(json.loads(conn.notifies.pop(0).payload))
+                    if events:
+                        self.apply_events(conn, events)
+            except psycopg2.Error as e:
+                print(f"Ошибка слушателя изменений индекса: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, LISTEN_MAX_BACKOFF_SECONDS)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def apply_events(self, conn, events):
+        start = time.perf_counter()
+        self.events += len(events)
+        by_modality = {}
+        for event in events:
+            # Для образца важно только последнее событие пачки
+            by_modality.setdefault(event['modality'], {})[int(event['sample_id'])] = event
+
+        for modality, latest in by_modality.items():
+            config = BIOMETRIC_CONFIG.get(modality)
+            if config is None:
+                continue
+            index = index_registry.resident(config['index_file'])
+            if index is None:
+                continue
+
+            removed = [sample_id for sample_id, event in latest.items()
+                       if event['op'] == 'delete' or event.get('status') == 'inactive']
+            ops = []
+            with index.lock:
+                # Смена статуса перечитывается всегда: у образца мог смениться subject_id
+                to_fetch = [sample_id for sample_id, event in latest.items()
+                            if sample_id not in removed and
+                            not (event['op'] == 'insert' and sample_id in index)]
+                for sample_id in removed:
+                    if index.remove(sample_id):
+                        ops.append(('remove', sample_id))
+                if to_fetch:
+                    ops.extend(self._sync_samples(conn, config, index, to_fetch))
+
+                if ops and self.persist:
+                    with _publish_lock:
+                        index.save_delta(resolve_index_dir(config['index_file']), ops)
+
+            if ops:
+                self.applied += len(ops)
+                if self.persist:
+                    index_registry.refresh(config['index_file'])
+        self.last_apply_ms = (time.perf_counter() - start) * 1000
+
+    @staticmethod
+    def _sync_samples(conn, config, index, sample_ids):
+        table_name = config['samples_table']
+        vector_column = config['vector_column']
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(f"""
+            SELECT samples.sample_id, samples.subject_id, samples.status, subjects.login,
+                   {table_name}.{vector_column}
+            FROM {table_name}
+            JOIN samples ON {table_name}.sample_id = samples.sample_id
+            JOIN subjects ON samples.subject_id = subjects.subject_id
+            WHERE samples.sample_id = ANY(%s)
+        """, (list(sample_ids),))
+        rows = cursor.fetchall()
+        cursor.close()
+
+        ops = []
+        found = set()
+        for row in rows:
+            sample_id = row['sample_id']
+            found.add(sample_id)
+            vec_data = row[vector_column]
+            if row['status'] == 'active' and vec_data is not None:
+                vector = decode_vector(vec_data)
+                index.add(sample_id, row['subject_id'], vector, row['login'])
+                ops.append(('add', sample_id, row['subject_id'], vector, row['login']))
+            elif index.remove(sample_id):
+                ops.append(('remove', sample_id))
+        # Строки, удалённые до того, как мы их прочитали
+        for sample_id in set(sample_ids) - found:
+            if index.remove(sample_id):
+                ops.append(('remove', sample_id))
+        return ops
+
+    def stats(self):
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'events': self.events,
+            'applied': self.applied,
+            'last_apply_ms': self.last_apply_ms
+        }
+
+
+index_registry = IndexRegistry()
+index_rebuilder = IndexRebuilder()
+index_listener = IndexChangeListener()
+# Не теряем запланированные перестройки при завершении процесса
+atexit.register(index_rebuilder.wait)
+
+def get_index(index_path: str):
+    return index_registry.get(index_path)
+
+def request_missing_index(biometric_type: str):
+    """
+    Если индекса модальности ещё нет (новая база или остался только .pkl
+    старого формата), ставит его сборку в очередь index_rebuilder.
+    Возвращает True, если сборка запрошена.
+    """
+    config = BIOMETRIC_CONFIG[biometric_type]
+    if index_exists(config['index_file']):
+        return False
+    index_rebuilder.request(config['samples_table'], config['vector_column'], config['index_file'])
+    return True
+
+def get_index_stats():
+    stats = index_registry.stats()
+    stats['rebuilder'] = index_rebuilder.stats()
+    stats['listener'] = index_listener.stats()
+    return stats
+
+def start_index_listener(persist: bool = False):
+    """Запускает фоновое применение уведомлений об изменениях образцов к загруженным индексам"""
+    index_listener.persist = persist
+    index_listener.start()
+    return index_listener
 
 def load_index_and_search(index_path: str, query_vector: np.ndarray):
-    print(f"Загрузка индекса из {index_path}...")
-    index = IVFIndex.load(index_path)
-    print("Индекс загружен")
+    index = get_index(index_path)
     return index.search(query_vector)
 
 
 if __name__ == "__main__":
-    face_index_file = "face_ivf_index.pkl"
+    face_index_file = "face_ivf_index"
     update_index(table_name="face_samples", vector_column="feature_vector", index_path=face_index_file)
 
     """Example usage for other modalities:
     
     # Voice modality
-    voice_index_file = "voice_ivf_index.pkl"
+    voice_index_file = "voice_ivf_index"
     update_index("voice_samples", "audio_vector", voice_index_file)
 
     # Signature modality
-    signature_index_file = "signature_ivf_index.pkl"
+    signature_index_file = "signature_ivf_index"
     update_index("signature_samples", "signature_vector", signature_index_file)
 
     # Search example (assuming we have a query vector)
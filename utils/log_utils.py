@@ -1,58 +1,267 @@
+import argparse
 import psycopg2
-from utils.config import DB_CONFIG
+from utils.db_pool import get_connection
+from utils.config import LOG_RETENTION_CONFIG
 import json
-from datetime import datetime
+from datetime import datetime, timedelta
 
 def get_db_connection():
-    return psycopg2.connect(**DB_CONFIG)
+    return get_connection()
+
+# Размер страницы журналов по умолчанию
+LOG_PAGE_SIZE = 100
+
+# Порядок полей строки аудит-лога, на который рассчитаны main.py, ui.py и ui_tk.py
+# (в самой таблице subject_id/sensor_id/sample_id идут раньше table_name)
+AUDIT_LOG_COLUMNS = (
+    'log_id', 'timestamp', 'table_name', 'operation', 'subject_id',
+    'sensor_id', 'sample_id', 'old_data', 'new_data', 'changed_by'
+)
+
+def _fetch_page(table, id_column, conditions, params, after, limit, columns='*'):
+    """
+    Страница журнала от новых записей к старым с продолжением по ключу
+    (timestamp, id): следующая страница читается по индексу с места, где
+    закончилась предыдущая, без OFFSET и без сортировки всей таблицы.
+    columns должны начинаться с id и timestamp — из них берётся курсор.
+    """
+    conditions = list(conditions)
+    params = list(params)
+    if after is not None:
+        conditions.append(f"(timestamp, {id_column}) < (%s, %s)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
 
-def fetch_all_logs():
-    """Получить все логи"""
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM audit_logs ORDER BY timestamp DESC")
-    logs = cursor.fetchall()
+    cursor.execute(f"""
+        SELECT {columns} FROM {table}
+        {where}
+        ORDER BY timestamp DESC, {id_column} DESC
+        LIMIT %s
+    """, params + [limit])
+    rows = cursor.fetchall()
+    cursor.close()
     conn.close()
-    return logs
+
+    # Курсор следующей страницы — (timestamp, id) последней строки
+    next_cursor = (rows[-1][1], rows[-1][0]) if len(rows) == limit else None
+    return rows, next_cursor
+
+def _date_conditions(start_date, end_date):
+    conditions, params = [], []
+    if start_date:
+        conditions.append("timestamp >= %s")
+        params.append(start_date)
+    if end_date:
+        conditions.append("timestamp <= %s")
+        params.append(end_date)
+    return conditions, params
+
+def _audit_conditions(table_name, user, start_date, end_date):
+    conditions, params = _date_conditions(start_date, end_date)
+    if table_name:
+        conditions.append("table_name = %s")
+        params.append(table_name)
+    if user:
+        conditions.append("changed_by = %s")
+        params.append(user)
+    return conditions, params
+
+def fetch_logs_page(table_name=None, user=None, start_date=None, end_date=None,
+                    after=None, limit=LOG_PAGE_SIZE):
+    """
+    Страница аудит-логов. after — курсор из предыдущего вызова.
+    Строки — кортежи полей в порядке AUDIT_LOG_COLUMNS.
+    Возвращает (logs, next_cursor); next_cursor = None на последней странице.
+    """
+    conditions, params = _audit_conditions(table_name, user, start_date, end_date)
+    return _fetch_page('audit_logs', 'log_id', conditions, params, after, limit,
+                       columns=', '.join(AUDIT_LOG_COLUMNS))
+
+def fetch_search_logs_page(search_type=None, subject_id=None, start_date=None, end_date=None,
+                           after=None, limit=LOG_PAGE_SIZE):
+    """Страница логов поиска, аналогично fetch_logs_page"""
+    conditions, params = _date_conditions(start_date, end_date)
+    if search_type:
+        conditions.append("search_type = %s")
+        params.append(search_type)
+    if subject_id is not None:
+        conditions.append("subject_id = %s")
+        params.append(subject_id)
+    return _fetch_page('search_logs', 'search_id', conditions, params, after, limit)
+
+def iter_logs(page_size=LOG_PAGE_SIZE, **filters):
+    """Все аудит-логи по фильтрам fetch_logs_page, постранично"""
+    after = None
+    while True:
+        logs, after = fetch_logs_page(after=after, limit=page_size, **filters)
+        yield from logs
+        if after is None:
+            return
+
+def fetch_all_logs():
+    """Все логи — генератор: страницы читаются по мере обхода, в память целиком не попадают"""
+    return iter_logs(page_size=1000)
 
 def filter_logs_by_date(start_date: str, end_date: str):
-    """Фильтр по дате (YYYY-MM-DD)"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT * FROM audit_logs
-        WHERE timestamp BETWEEN %s AND %s
-        ORDER BY timestamp DESC
-    """, (start_date, end_date))
-    logs = cursor.fetchall()
-    conn.close()
-    return logs
+    """Фильтр по дате (YYYY-MM-DD); генератор, как fetch_all_logs"""
+    return iter_logs(page_size=1000, start_date=start_date, end_date=end_date)
 
 def filter_logs_by_table(table_name: str):
-    """Фильтр по таблице"""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT * FROM audit_logs
-        WHERE table_name = %s
-        ORDER BY timestamp DESC
-    """, (table_name,))
-    logs = cursor.fetchall()
-    conn.close()
-    return logs
+    """Фильтр по таблице; генератор, как fetch_all_logs"""
+    return iter_logs(page_size=1000, table_name=table_name)
 
 def filter_logs_by_user(user: str):
-    """Фильтр по пользователю"""
+    """Фильтр по пользователю; генератор, как fetch_all_logs"""
+    return iter_logs(page_size=1000, user=user)
+
+def maintain_log_partitions():
+    """
+    Создаёт партиции журналов на LOG_RETENTION_CONFIG['months_ahead'] месяцев вперёд
+    и удаляет месячные партиции старше срока хранения.
+    Возвращает {таблица: (создано, удалено)}.
+    """
+    result = {}
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT * FROM audit_logs
-        WHERE changed_by = %s
-        ORDER BY timestamp DESC
-    """, (user,))
-    logs = cursor.fetchall()
+    for table, keep_months in LOG_RETENTION_CONFIG['keep_months'].items():
+        cursor.execute("SELECT ensure_log_partitions(%s, CURRENT_DATE, %s)",
+                       (table, LOG_RETENTION_CONFIG['months_ahead']))
+        created = cursor.fetchone()[0]
+        cursor.execute("SELECT drop_old_log_partitions(%s, %s)", (table, keep_months))
+        dropped = cursor.fetchone()[0]
+        result[table] = (created, dropped)
+    conn.commit()
+    cursor.close()
     conn.close()
-    return logs
+    return result
+
+# Экспорт: строк на страницу (одна короткая транзакция на страницу) и столбцы выгрузки
+EXPORT_PAGE_SIZE = 50000
+EXPORT_COLUMNS = (
+    'log_id', 'timestamp', 'table_name', 'operation', 'subject_id',
+    'sensor_id', 'sample_id', 'changed_by', 'old_data', 'new_data'
+)
+EXPORT_FORMATS = ('csv', 'parquet', 'arrow')
+
+def _export_pages(conditions, params, page_size):
+    """
+    Делит выборку на страницы по ключу (timestamp, log_id) и отдаёт для каждой
+    (conditions, params). Ключи страницы читаются тем же keyset-запросом,
+    что и в _fetch_page (index-only, без OFFSET), его курсор — нижняя граница
+    страницы; сама страница читается отдельным запросом — ни одна
+    транзакция не живёт дольше одной страницы.
+    """
+    after = None
+    while True:
+        keys, next_cursor = _fetch_page('audit_logs', 'log_id', conditions, params, after, page_size,
+                                        columns='log_id, timestamp')
+        if not keys:
+            return
+        page_conditions, page_params = list(conditions), list(params)
+        if after is not None:
+            page_conditions.append("(timestamp, log_id) < (%s, %s)")
+            page_params.extend(after)
+        if next_cursor is not None:
+            page_conditions.append("(timestamp, log_id) >= (%s, %s)")
+            page_params.extend(next_cursor)
+        yield page_conditions, page_params
+        if next_cursor is None:
+            return
+        after = next_cursor
+
+def _page_query(conditions, columns):
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"""
+        SELECT {', '.join(columns)} FROM audit_logs
+        {where}
+        ORDER BY timestamp DESC, log_id DESC
+    """
+
+def _export_csv(filename, pages):
+    # COPY отдаёт готовый CSV (JSONB — как текст), Python только пишет поток в файл
+    exported = 0
+    with open(filename, 'w', newline='', encoding='utf-8') as f:
+        f.write(','.join(EXPORT_COLUMNS) + '\n')
+        for conditions, params in pages:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            query = cursor.mogrify(_page_query(conditions, EXPORT_COLUMNS), params).decode()
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv)", f)
+            exported += max(cursor.rowcount, 0)
+            conn.commit()
+            cursor.close()
+            conn.close()
+    return exported
+
+def _require_pyarrow():
+    # pyarrow нужен только для Parquet/Arrow и объявлен в requirements.txt как необязательный
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Для экспорта в Parquet/Arrow установите pyarrow: pip install pyarrow") from None
+
+def _export_columnar(filename, pages, file_format):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = pa.schema([
+        ('log_id', pa.int64()), ('timestamp', pa.timestamp('us')),
+        ('table_name', pa.string()), ('operation', pa.string()),
+        ('subject_id', pa.int32()), ('sensor_id', pa.int32()), ('sample_id', pa.int32()),
+        ('changed_by', pa.string()), ('old_data', pa.string()), ('new_data', pa.string())
+    ])
+    # JSONB приходит текстом, без разбора и повторной сериализации в Python
+    columns = EXPORT_COLUMNS[:-2] + ('old_data::text', 'new_data::text')
+
+    if file_format == 'parquet':
+        writer = pq.ParquetWriter(filename, schema)
+    else:
+        writer = pa.ipc.new_file(filename, schema)
+    exported = 0
+    try:
+        for conditions, params in pages:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute(_page_query(conditions, columns), params)
+            rows = cursor.fetchall()
+            cursor.close()
+            conn.close()
+            if not rows:
+                continue
+            writer.write_table(pa.table([pa.array(values, type=field.type)
+                                         for values, field in zip(zip(*rows), schema)], schema=schema))
+            exported += len(rows)
+    finally:
+        writer.close()
+    return exported
+
+def export_audit_logs(filename, file_format='csv', table_name=None, user=None,
+                      start_date=None, end_date=None, page_size=EXPORT_PAGE_SIZE):
+    """
+    Потоковый экспорт аудит-логов в CSV, Parquet или Arrow IPC.
+    Фильтры — как у fetch_logs_page. Память ограничена одной страницей,
+    каждая страница читается в своей короткой транзакции.
+    Возвращает число выгруженных строк.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Неизвестный формат {file_format}, доступны: {', '.join(EXPORT_FORMATS)}")
+    if file_format != 'csv':
+        # До создания файла: без pyarrow не остаётся пустого или обрезанного экспорта
+        _require_pyarrow()
+    conditions, params = _audit_conditions(table_name, user, start_date, end_date)
+    pages = _export_pages(conditions, params, page_size)
+
+    start = datetime.now()
+    if file_format == 'csv':
+        exported = _export_csv(filename, pages)
+    else:
+        exported = _export_columnar(filename, pages, file_format)
+    elapsed = (datetime.now() - start).total_seconds()
+    print(f"Логи экспортированы в {filename}: {exported} строк за {elapsed:.1f} с")
+    return exported
 
 def export_logs_to_csv(logs, filename="audit_export.csv"):
     """Экспорт логов в CSV"""
@@ -72,30 +281,170 @@ def export_logs_to_csv(logs, filename="audit_export.csv"):
             ])
     print(f"Логи экспортированы в {filename}")
 
-def analyze_user_activity():
-    """Анализ активности пользователей"""
+def _bucket_conditions(start_date, end_date):
+    # Сводки почасовые: час попадает в окно, если начался в его пределах
+    conditions, params = [], []
+    if start_date:
+        conditions.append("bucket >= date_trunc('hour', %s::timestamp)")
+        params.append(start_date)
+    if end_date:
+        conditions.append("bucket <= %s")
+        params.append(end_date)
+    return f"WHERE {' AND '.join(conditions)}" if conditions else "", params
+
+def analyze_user_activity(start_date=None, end_date=None):
+    """Анализ активности пользователей (по почасовой сводке audit_rollup_hourly)"""
+    where, params = _bucket_conditions(start_date, end_date)
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT changed_by, COUNT(*) as changes_count
-        FROM audit_logs
+    cursor.execute(f"""
+        SELECT changed_by, SUM(changes) as changes_count
+        FROM audit_rollup_hourly
+        {where}
         GROUP BY changed_by
         ORDER BY changes_count DESC
-    """)
+    """, params)
     result = cursor.fetchall()
     conn.close()
     return result
 
-def analyze_table_changes():
-    """Анализ изменений по таблицам"""
+def analyze_table_changes(start_date=None, end_date=None):
+    """Анализ изменений по таблицам (по почасовой сводке audit_rollup_hourly)"""
+    where, params = _bucket_conditions(start_date, end_date)
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT table_name, COUNT(*) as changes_count
-        FROM audit_logs
+    cursor.execute(f"""
+        SELECT table_name, SUM(changes) as changes_count
+        FROM audit_rollup_hourly
+        {where}
         GROUP BY table_name
         ORDER BY changes_count DESC
-    """)
+    """, params)
     result = cursor.fetchall()
     conn.close()
-    return result
\ No newline at end of file
+    return result
+
+def analyze_search_activity(start_date=None, end_date=None):
+    """
+    Поиски по модальностям из search_rollup_hourly и search_latency_hourly:
+    {search_type: {'searches', 'hits', 'hit_rate', 'avg_candidates', 'avg_time_ms',
+    'max_time_ms', 'latency_histogram': [(верхняя граница мс, число поисков), ...]}}
+    """
+    where, params = _bucket_conditions(start_date, end_date)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        SELECT search_type, SUM(searches), SUM(hits), SUM(candidates_total),
+               SUM(time_total_ms), MAX(time_max_ms)
+        FROM search_rollup_hourly
+        {where}
+        GROUP BY search_type
+        ORDER BY search_type
+    """, params)
+    result = {}
+    for search_type, searches, hits, candidates, time_total, time_max in cursor.fetchall():
+        result[search_type] = {
+            'searches': int(searches),
+            'hits': int(hits),
+            'hit_rate': hits / searches if searches else 0.0,
+            'avg_candidates': candidates / searches if searches else 0.0,
+            'avg_time_ms': time_total / searches if searches else 0.0,
+            'max_time_ms': time_max,
+            'latency_histogram': []
+        }
+    cursor.execute(f"""
+        SELECT search_type, le_ms, SUM(searches)
+        FROM search_latency_hourly
+        {where}
+        GROUP BY search_type, le_ms
+        ORDER BY search_type, le_ms
+    """, params)
+    for search_type, le_ms, searches in cursor.fetchall():
+        if search_type in result:
+            result[search_type]['latency_histogram'].append((le_ms, int(searches)))
+    conn.close()
+    return result
+
+def analyze_search_latency(start_date=None, end_date=None, search_type=None):
+    """
+    Задержки поиска по модальностям за окно [start_date, end_date] (по умолчанию —
+    последние сутки), считаются в SQL по search_logs: p50/p95/p99 (percentile_cont),
+    среднее и максимум времени, поисков в минуту (средне и пик), доля поисков
+    с найденными кандидатами. Окно ограничивает чтение партициями и индексом по timestamp.
+    Возвращает {search_type: {...}}.
+    """
+    end = datetime.fromisoformat(end_date) if isinstance(end_date, str) else (end_date or datetime.now())
+    start = datetime.fromisoformat(start_date) if isinstance(start_date, str) else (start_date or end - timedelta(days=1))
+    conditions = ["timestamp >= %s", "timestamp <= %s"]
+    params = [start, end]
+    if search_type:
+        conditions.append("search_type = %s")
+        params.append(search_type)
+    where = ' AND '.join(conditions)
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        WITH window_logs AS (
+            SELECT search_type, timestamp, search_time_ms, candidates_found, threshold_used
+            FROM search_logs
+            WHERE {where}
+        ),
+        per_minute AS (
+            SELECT search_type, count(*) AS searches
+            FROM window_logs
+            GROUP BY search_type, date_trunc('minute', timestamp)
+        )
+        SELECT w.search_type,
+               count(*),
+               percentile_cont(ARRAY[0.5, 0.95, 0.99]) WITHIN GROUP (ORDER BY w.search_time_ms),
+               avg(w.search_time_ms),
+               max(w.search_time_ms),
+               count(*) FILTER (WHERE w.candidates_found > 0),
+               avg(w.threshold_used),
+               count(*) / GREATEST(EXTRACT(EPOCH FROM (%s::timestamp - %s::timestamp)) / 60, 1),
+               (SELECT max(m.searches) FROM per_minute m WHERE m.search_type = w.search_type)
+        FROM window_logs w
+        GROUP BY w.search_type
+        ORDER BY w.search_type
+    """, params + [end, start])
+    result = {}
+    for row in cursor.fetchall():
+        (modality, searches, percentiles, avg_ms, max_ms, hits,
+         avg_threshold, per_minute, peak_per_minute) = row
+        result[modality] = {
+            'searches': searches,
+            'p50_ms': percentiles[0],
+            'p95_ms': percentiles[1],
+            'p99_ms': percentiles[2],
+            'avg_ms': float(avg_ms),
+            'max_ms': max_ms,
+            'hits': hits,
+            'hit_rate': hits / searches,
+            'avg_threshold': float(avg_threshold),
+            'per_minute': float(per_minute),
+            'peak_per_minute': peak_per_minute
+        }
+    cursor.close()
+    conn.close()
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Обслуживание и экспорт журналов")
+    parser.add_argument('--maintain', action='store_true',
+                        help="создать партиции наперёд и удалить устаревшие")
+    parser.add_argument('--export', metavar='FILE', help="выгрузить аудит-логи в файл")
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default='csv')
+    parser.add_argument('--table', help="только изменения этой таблицы")
+    parser.add_argument('--user', help="только изменения этого пользователя")
+    parser.add_argument('--from', dest='start_date', help="начальная дата (YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end_date', help="конечная дата (YYYY-MM-DD)")
+    args = parser.parse_args()
+    if args.maintain:
+        for table, (created, dropped) in maintain_log_partitions().items():
+            print(f"{table}: создано партиций {created}, удалено {dropped}")
+    if args.export:
+        export_audit_logs(args.export, args.format, table_name=args.table, user=args.user,
+                          start_date=args.start_date, end_date=args.end_date)
+    if not (args.maintain or args.export):
+        parser.print_help()
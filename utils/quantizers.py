@@ -0,0 +1,140 @@
+import numpy as np
+from sklearn.cluster import KMeans
+
+# Максимальный размер обучающей выборки для кодбуков PQ
+PQ_TRAIN_SIZE = 10000
+
+
+class ScalarQuantizer:
+    """
+    Поразмерное скалярное квантование в 8 бит: x ≈ vmin + scale * code.
+    Скалярное произведение считается без декодирования:
+    q·x ≈ q·vmin + (q * scale)·code.
+    """
+    name = 'sq8'
+    array_names = ('sq_vmin', 'sq_scale')
+
+    def __init__(self):
+        self.vmin = None
+        self.scale = None
+
+    def train(self, vectors: np.ndarray):
+        self.vmin = vectors.min(axis=0).astype(np.float32)
+        vmax = vectors.max(axis=0).astype(np.float32)
+        self.scale = (vmax - self.vmin) / 255.0
+        self.scale[self.scale == 0] = 1.0
+
+    def encode(self, vectors: np.ndarray):
+        codes = np.rint((vectors - self.vmin) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def decode(self, codes: np.ndarray):
+        return self.vmin + codes.astype(np.float32) * self.scale
+
+    def code_size(self, dim: int):
+        return dim
+
+    def dot(self, codes: np.ndarray, queries: np.ndarray):
+        """Приближённые скалярные произведения (nq, n) запросов с закодированными векторами"""
+        return (queries * self.scale) @ codes.astype(np.float32).T + (queries @ self.vmin)[:, None]
+
+    def to_arrays(self):
+        return {'sq_vmin': self.vmin, 'sq_scale': self.scale}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        obj = cls()
+        obj.vmin = arrays['sq_vmin']
+        obj.scale = arrays['sq_scale']
+        return obj
+
+    def params(self):
+        return {}
+
+
+class ProductQuantizer:
+    """
+    Product quantization: вектор делится на m подвекторов, каждый кодируется
+    номером ближайшего из 256 центроидов своего подпространства (1 байт).
+    Поиск — асимметричный: для запроса строится таблица q_j·C_j[k],
+    а приближённое скалярное произведение — сумма m значений из таблицы.
+    """
+    name = 'pq'
+    array_names = ('pq_codebooks',)
+
+    def __init__(self, m: int = None, ksub: int = 256):
+        self.m = m
+        self.ksub = ksub
+        self.codebooks = None
+
+    def _split(self, vectors: np.ndarray):
+        return vectors.reshape(len(vectors), self.m, -1)
+
+    def train(self, vectors: np.ndarray):
+        dim = vectors.shape[1]
+        if self.m is None:
+            # По умолчанию 8 измерений на подпространство: 128D -> 16 байт на вектор
+            self.m = max(1, dim // 8)
+        if dim % self.m != 0:
+            raise ValueError(f"Размерность {dim} не делится на число подпространств {self.m}")
+
+        if len(vectors) > PQ_TRAIN_SIZE:
+            rng = np.random.default_rng(0)
+            vectors = vectors[rng.choice(len(vectors), PQ_TRAIN_SIZE, replace=False)]
+        ksub = min(self.ksub, len(vectors))
+        subvectors = self._split(vectors)
+        self.codebooks = np.zeros((self.m, ksub, dim // self.m), dtype=np.float32)
+        for j in range(self.m):
+            kmeans = KMeans(n_clusters=ksub, n_init=1, max_iter=25, random_state=0)
+            kmeans.fit(subvectors[:, j, :])
+            self.codebooks[j] = kmeans.cluster_centers_
+        self.ksub = ksub
+
+    def encode(self, vectors: np.ndarray):
+        subvectors = self._split(np.asarray(vectors, dtype=np.float32))
+        codes = np.zeros((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            sub = subvectors[:, j, :]
+            book = self.codebooks[j]
+            dists = (sub ** 2).sum(axis=1)[:, None] - 2 * sub @ book.T + (book ** 2).sum(axis=1)[None, :]
+            codes[:, j] = np.argmin(dists, axis=1)
+        return codes
+
+    def decode(self, codes: np.ndarray):
+        parts = [self.codebooks[j][codes[:, j]] for j in range(self.m)]
+        return np.concatenate(parts, axis=1)
+
+    def code_size(self, dim: int):
+        return self.m
+
+    def dot(self, codes: np.ndarray, queries: np.ndarray):
+        """Приближённые скалярные произведения (nq, n) через таблицы расстояний"""
+        query_parts = queries.reshape(len(queries), self.m, -1)
+        tables = np.einsum('qjd,jkd->qjk', query_parts, self.codebooks)
+        result = np.zeros((len(queries), len(codes)), dtype=np.float32)
+        for j in range(self.m):
+            result += tables[:, j, :][:, codes[:, j]]
+        return result
+
+    def to_arrays(self):
+        return {'pq_codebooks': self.codebooks}
+
+    @classmethod
+    def from_arrays(cls, arrays, params):
+        obj = cls(m=params['m'], ksub=params['ksub'])
+        obj.codebooks = arrays['pq_codebooks']
+        return obj
+
+    def params(self):
+        return {'m': self.m, 'ksub': self.ksub}
+
+
+CODECS = {
+    ScalarQuantizer.name: ScalarQuantizer,
+    ProductQuantizer.name: ProductQuantizer
+}
+
+def make_codec(compression: str, **kwargs):
+    if compression not in CODECS:
+        raise ValueError(f"Неизвестный режим сжатия: {compression}")
+    return CODECS[compression](**kwargs)
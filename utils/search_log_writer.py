@@ -0,0 +1,166 @@
+import atexit
+import json
+import queue
+import threading
+import time
+from datetime import datetime
+import psycopg2
+from psycopg2.extras import execute_values
+from utils.config import SEARCH_LOG_CONFIG
+from utils.db_pool import get_connection
+
+SEARCH_LOG_COLUMNS = (
+    'timestamp', 'searched_at', 'subject_id', 'sensor_id', 'sample_id',
+    'search_type', 'query_vector_type', 'candidates_found', 'search_time_ms',
+    'threshold_used', 'additional_info'
+)
+INSERT_SEARCH_LOGS = f"INSERT INTO search_logs ({', '.join(SEARCH_LOG_COLUMNS)}) VALUES %s"
+
+_STOP = object()
+
+
+class SearchLogWriter:
+    """
+    Фоновая запись search_logs. log_search только кладёт строку в ограниченную
+    очередь; поток-писатель вставляет накопленное одним execute_values, как только
+    набралось batch_size строк или прошло flush_interval_ms с первой строки пачки.
+    При переполнении очереди строка отбрасывается и учитывается в dropped.
+    """
+    def __init__(self, queue_size: int = 10000, batch_size: int = 500, flush_interval_ms: float = 200.0):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000.0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.flushes = 0
+        self.flush_time_ms = 0.0
+
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._thread_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='search-log-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, subject_id=None, sensor_id=None, sample_id=None,
+               search_type='face', query_vector_type='face',
+               candidates_found=0, search_time_ms=0.0,
+               threshold_used=0.5, additional_info=None):
+        """Ставит запись в очередь; False, если очередь переполнена и запись отброшена"""
+        self._ensure_started()
+        now = datetime.now()
+        row = (
+            now, now, subject_id, sensor_id, sample_id,
+            search_type, query_vector_type,
+            candidates_found, search_time_ms,
+            threshold_used, json.dumps(additional_info) if additional_info else None
+        )
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    def _run(self):
+        batch = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            stop = item is _STOP
+            if item is not None and not stop:
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if batch and (stop or len(batch) >= self.batch_size or time.monotonic() >= deadline):
+                self._write(batch)
+                for _ in batch:
+                    self._queue.task_done()
+                batch = []
+                deadline = None
+            if stop:
+                self._queue.task_done()
+                return
+
+    def _write(self, rows):
+        start = time.perf_counter()
+        conn = None
+        try:
+            conn = get_connection()
+            cursor = conn.cursor()
+            execute_values(cursor, INSERT_SEARCH_LOGS, rows, page_size=len(rows))
+            conn.commit()
+            cursor.close()
+            self.written += len(rows)
+        except psycopg2.Error as e:
+            # Одна плохая строка (например, удалённый subject_id) не должна терять всю пачку
+            print(f"Ошибка пакетной записи логов поиска: {e}")
+            if conn is not None and not conn.closed:
+                conn.rollback()
+                self._write_rows(conn, rows)
+            else:
+                self.failed += len(rows)
+        except Exception as e:
+            print(f"Ошибка пакетной записи логов поиска: {e}")
+            self.failed += len(rows)
+        finally:
+            if conn is not None:
+                conn.close()
+            self.flushes += 1
+            self.flush_time_ms += (time.perf_counter() - start) * 1000
+
+    def _write_rows(self, conn, rows):
+        cursor = conn.cursor()
+        for row in rows:
+            try:
+                execute_values(cursor, INSERT_SEARCH_LOGS, [row])
+                conn.commit()
+                self.written += 1
+            except psycopg2.Error:
+                conn.rollback()
+                self.failed += 1
+        cursor.close()
+
+    def flush(self):
+        """Блокирует, пока всё поставленное в очередь не будет записано"""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
+
+    def close(self, timeout: float = 5.0):
+        """Дописывает очередь и останавливает поток"""
+        if self._thread is None or not self._thread.is_alive():
+            return
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def stats(self):
+        return {
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'queued': self._queue.qsize(),
+            'flushes': self.flushes,
+            'avg_flush_ms': self.flush_time_ms / self.flushes if self.flushes else 0.0
+        }
+
+
+search_log_writer = SearchLogWriter(**SEARCH_LOG_CONFIG)
+# Регистрируется после пула соединений, поэтому при выходе выполняется раньше его закрытия
+atexit.register(search_log_writer.close)
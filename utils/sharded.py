@@ -0,0 +1,407 @@
+import argparse
+import atexit
+import os
+import time
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from typing import List
+import numpy as np
+from utils.index_storage import (
+    INDEX_FORMAT_VERSION, MANIFEST_FILE, normalize_rows, top_k_smallest, unique_by_subject,
+    read_manifest, write_json, append_delta, apply_delta, clear_delta, delta_size,
+    synchronized, LockedIndex
+)
+
+# Пока пул не прогрет (воркеры не загрузили шарды), в него отправляются
+# только пакеты от POOL_MIN_QUERIES запросов, остальные ищутся в своём процессе
+POOL_MIN_QUERIES = 8
+
+
+def shard_of(sample_ids, n_shards: int):
+    """Номер шарда по хэшу sample_id (мультипликативный хэш Кнута, устойчив к последовательным id)"""
+    sample_ids = np.asarray(sample_ids, dtype=np.uint64)
+    return ((sample_ids * np.uint64(2654435761)) % np.uint64(2 ** 32) % np.uint64(n_shards)).astype(np.int64)
+
+def shard_dir(index_dir: str, shard_no: int):
+    return os.path.join(index_dir, f'shard-{shard_no:02d}')
+
+
+class _ShardDelta:
+    """Пропускает в индекс шарда только записи дельты, которые ему принадлежат"""
+    def __init__(self, index, shard_no: int, n_shards: int):
+        self.index = index
+        self.shard_no = shard_no
+        self.n_shards = n_shards
+
+    def add(self, sample_id, subject_id, vector, login=None):
+        if shard_of([sample_id], self.n_shards)[0] == self.shard_no:
+            self.index.add(sample_id, subject_id, vector, login)
+
+    def remove(self, sample_id):
+        if shard_of([sample_id], self.n_shards)[0] == self.shard_no:
+            self.index.remove(sample_id)
+
+
+# Кэш воркера: каталог шарда -> {'index', 'offset'} (offset — прочитанная часть общей дельты)
+_worker_shards = {}
+
+def _worker_shard(index_dir: str, shard_no: int, n_shards: int):
+    """
+    Индекс шарда в процессе-воркере. Шард загружается один раз через mmap
+    (страницы page cache общие для всех воркеров), дальше дочитываются
+    только новые записи дельты активного поколения.
+    """
+    from utils.indexer import load_index
+
+    path = shard_dir(index_dir, shard_no)
+    entry = _worker_shards.get(path)
+    if entry is None:
+        # Шарды предыдущих поколений этого индекса больше не нужны
+        root = os.path.dirname(index_dir)
+        for stale in [p for p in _worker_shards if os.path.dirname(os.path.dirname(p)) == root]:
+            del _worker_shards[stale]
+        entry = {'index': load_index(path), 'offset': 0}
+        _worker_shards[path] = entry
+
+    size = delta_size(index_dir)
+    if size > entry['offset']:
+        apply_delta(_ShardDelta(entry['index'], shard_no, n_shards), index_dir, entry['offset'])
+        entry['offset'] = size
+    return entry['index']
+
+def _load_shard(index_dir: str, shard_no: int, n_shards: int):
+    """Прогрев: воркер загружает шард заранее, до первого запроса"""
+    return len(_worker_shard(index_dir, shard_no, n_shards))
+
+def _search_shard(index_dir: str, shard_no: int, n_shards: int, queries: np.ndarray, top_k: int,
+                  n_probe: int, return_sample_ids: bool, unique_subjects: bool):
+    return _worker_shard(index_dir, shard_no, n_shards).search_batch(
+        queries, top_k=top_k, n_probe=n_probe,
+        return_sample_ids=return_sample_ids, unique_subjects=unique_subjects)
+
+def _range_search_shard(index_dir: str, shard_no: int, n_shards: int, query: np.ndarray, max_distance: float):
+    return _worker_shard(index_dir, shard_no, n_shards).range_search(query, max_distance)
+
+
+# Индексы с открытым пулом: при выходе пулы закрываются (как search_log_writer)
+_open_indexes = weakref.WeakSet()
+
+def _close_pools():
+    for index in list(_open_indexes):
+        index.close()
+
+atexit.register(_close_pools)
+
+
+class ShardedIndex(LockedIndex):
+    """
+    Индекс, разбитый по хэшу sample_id на n_shards независимых индексов
+    (IVF или HNSW). Поиск рассылается по шардам в пул процессов,
+    каждый воркер отвечает top-k (или range_search) своего шарда, результаты сливаются.
+    Воркеры читают шарды с диска, поэтому пул используется, только когда
+    в памяти нет изменений, не записанных в дельту (_unsaved == 0).
+
+    На диске: manifest.json с format='sharded', подкаталоги shard-NN
+    в обычном формате своего движка и общая delta.jsonl в корне.
+    Публичные методы выполняются под self.lock, каждый шард — ещё и под своим.
+    """
+    def __init__(self, n_shards: int, shard_factory=None, workers: int = None, top_k: int = 5):
+        self.n_shards = n_shards
+        self.shard_factory = shard_factory
+        self.workers = workers or min(n_shards, os.cpu_count() or 1)
+        self.top_k = top_k
+        self.shards = []
+        self.index_dir = None
+        self.recall = None
+        self._pool = None
+        self._warm = []
+        # add/remove, ещё не попавшие в delta.jsonl через save_delta
+        self._unsaved = 0
+        self._init_lock()
+
+    def __len__(self):
+        return sum(len(shard) for shard in self.shards)
+
+    def __contains__(self, sample_id):
+        return sample_id in self.shards[self._shard_of(sample_id)]
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state['_pool'] = None
+        state['_warm'] = []
+        state['shard_factory'] = None
+        return state
+
+    def _shard_of(self, sample_id: int):
+        return int(shard_of([sample_id], self.n_shards)[0])
+
+    @property
+    def dim(self):
+        return self.shards[0].dim if self.shards else None
+
+    @property
+    def logins(self):
+        logins = {}
+        for shard in self.shards:
+            logins.update(shard.logins)
+        return logins
+
+    @synchronized
+    def fit(self, sample_ids: List[int], subject_ids: List[int], vectors: np.ndarray, logins: dict = None):
+        if len(sample_ids) == 0:
+            raise ValueError("No vectors provided for training.")
+        sample_ids = np.asarray(sample_ids, dtype=np.int64)
+        subject_ids = np.asarray(subject_ids, dtype=np.int64)
+        vectors = normalize_rows(vectors)
+        logins = logins or {}
+
+        # Малая галерея: шардов становится столько, чтобы ни один не остался пустым
+        # (число шардов хранится в манифесте, по нему же маршрутизируются add/remove)
+        n_shards = min(self.n_shards, len(sample_ids))
+        while n_shards > 1 and len(np.unique(shard_of(sample_ids, n_shards))) < n_shards:
+            n_shards -= 1
+        if n_shards < self.n_shards:
+            print(f"Галерея из {len(sample_ids)} векторов: шардов {n_shards} вместо {self.n_shards}")
+            self.n_shards = n_shards
+            self.workers = min(self.workers, n_shards)
+
+        assignment = shard_of(sample_ids, self.n_shards)
+        self.shards = []
+        for shard_no in range(self.n_shards):
+            members = np.flatnonzero(assignment == shard_no)
+            shard = self.shard_factory()
+            shard_subjects = subject_ids[members]
+            shard.fit(sample_ids[members], shard_subjects, vectors[members],
+                      {int(sid): logins[sid] for sid in set(shard_subjects.tolist()) if sid in logins})
+            self.shards.append(shard)
+        self.index_dir = None
+
+    @synchronized
+    def add(self, sample_id: int, subject_id: int, vector: np.ndarray, login: str = None):
+        self.shards[self._shard_of(sample_id)].add(sample_id, subject_id, vector, login)
+        self._unsaved += 1
+
+    @synchronized
+    def remove(self, sample_id: int):
+        removed = self.shards[self._shard_of(sample_id)].remove(sample_id)
+        if removed:
+            self._unsaved += 1
+        return removed
+
+    def needs_retrain(self):
+        return any(shard.needs_retrain() for shard in self.shards)
+
+    @synchronized
+    def all_vectors(self):
+        parts = [shard.all_vectors() for shard in self.shards]
+        return np.concatenate([ids for ids, _ in parts]), np.concatenate([vecs for _, vecs in parts])
+
+    @synchronized
+    def range_search(self, query_vector: np.ndarray, max_distance: float):
+        """
+        Объединение range_search всех шардов в формате {subject_id: [(sample_id, distance), ...]}.
+        С прогретым пулом даже одиночный запрос (вход по биометрии) идёт по шардам параллельно.
+        """
+        query = normalize_rows(np.asarray(query_vector).reshape(1, -1))[0]
+        if self._use_pool(1):
+            pool = self._get_pool()
+            futures = [pool.submit(_range_search_shard, self.index_dir, shard_no, self.n_shards,
+                                   query, max_distance)
+                       for shard_no in range(self.n_shards)]
+            parts = [future.result() for future in futures]
+        else:
+            parts = [shard.range_search(query, max_distance) for shard in self.shards]
+
+        merged = {}
+        for part in parts:
+            for subject_id, samples in part.items():
+                merged.setdefault(subject_id, []).extend(samples)
+        for samples in merged.values():
+            samples.sort(key=lambda item: item[1])
+        return dict(sorted(merged.items(), key=lambda item: item[1][0][1]))
+
+    @synchronized
+    def search(self, query_vector: np.ndarray):
+        ids, dists = self.search_batch(np.asarray(query_vector).reshape(1, -1))
+        return [(int(sid), float(d)) for sid, d in zip(ids[0], dists[0]) if sid >= 0]
+
+    def _get_pool(self):
+        if self._pool is None:
+            # spawn: воркеры не наследуют потоки и соединения родителя
+            self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                             mp_context=multiprocessing.get_context('spawn'))
+            _open_indexes.add(self)
+        return self._pool
+
+    def _pool_ready(self):
+        return bool(self._warm) and all(f.done() and f.exception() is None for f in self._warm)
+
+    def _use_pool(self, n_queries: int):
+        """Пул — для сохранённого индекса без несохранённых изменений; холодный — только для больших пакетов"""
+        if self.index_dir is None or self.workers < 2 or self._unsaved:
+            return False
+        return self._pool_ready() or n_queries >= POOL_MIN_QUERIES
+
+    @synchronized
+    def warm_up(self):
+        """
+        Запускает пул и загрузку шардов в воркерах, не дожидаясь её: пока прогрев
+        не закончен, одиночные запросы ищутся в текущем процессе
+        """
+        if self.index_dir is None or self.workers < 2 or self._warm:
+            return
+        pool = self._get_pool()
+        # По одной загрузке шарда на воркер не гарантируется, поэтому шарды грузятся с запасом
+        rounds = -(-self.workers // self.n_shards)
+        self._warm = [pool.submit(_load_shard, self.index_dir, shard_no, self.n_shards)
+                      for _ in range(rounds) for shard_no in range(self.n_shards)]
+
+    @synchronized
+    def search_batch(self, query_vectors: np.ndarray, top_k: int = None, n_probe: int = None,
+                     return_sample_ids: bool = False, unique_subjects: bool = True):
+        """
+        Поиск по всем шардам; формат результата как у IVFIndex.search_batch.
+        Для сохранённого индекса запросы обрабатываются воркерами пула
+        (пока пул не прогрет — только пакеты от POOL_MIN_QUERIES запросов),
+        иначе шарды перебираются последовательно в текущем процессе.
+        """
+        top_k = top_k or self.top_k
+        unique_subjects = unique_subjects and not return_sample_ids
+        queries = normalize_rows(np.asarray(query_vectors).reshape(len(query_vectors), -1))
+        args = (top_k, n_probe, return_sample_ids, unique_subjects)
+
+        if self._use_pool(len(queries)):
+            pool = self._get_pool()
+            futures = [pool.submit(_search_shard, self.index_dir, shard_no, self.n_shards, queries, *args)
+                       for shard_no in range(self.n_shards)]
+            parts = [future.result() for future in futures]
+        else:
+            parts = [shard.search_batch(queries, top_k=top_k, n_probe=n_probe,
+                                        return_sample_ids=return_sample_ids,
+                                        unique_subjects=unique_subjects)
+                     for shard in self.shards]
+
+        ids = np.concatenate([part[0] for part in parts], axis=1)
+        dists = np.concatenate([part[1] for part in parts], axis=1)
+        result_ids = np.full((len(queries), top_k), -1, dtype=np.int64)
+        result_dists = np.full((len(queries), top_k), np.inf, dtype=np.float32)
+        for qi in range(len(queries)):
+            valid = np.flatnonzero(ids[qi] >= 0)
+            if unique_subjects:
+                # Образцы одного субъекта могут лежать в разных шардах
+                nearest = valid[unique_by_subject(ids[qi, valid], dists[qi, valid], top_k)]
+            else:
+                nearest = valid[top_k_smallest(dists[qi, valid], top_k)]
+            result_ids[qi, :len(nearest)] = ids[qi, nearest]
+            result_dists[qi, :len(nearest)] = dists[qi, nearest]
+        return result_ids, result_dists
+
+    @synchronized
+    def save(self, index_path: str):
+        os.makedirs(index_path, exist_ok=True)
+        for shard_no, shard in enumerate(self.shards):
+            shard.save(shard_dir(index_path, shard_no))
+        write_json(index_path, MANIFEST_FILE, {
+            'format': 'sharded',
+            'version': INDEX_FORMAT_VERSION,
+            'n_shards': self.n_shards,
+            'top_k': self.top_k,
+            'dim': self.dim,
+            'count': len(self),
+            'recall': self.recall
+        })
+        clear_delta(index_path)
+        self.index_dir = index_path
+        self._unsaved = 0
+
+    @synchronized
+    def save_delta(self, index_path: str, ops):
+        append_delta(index_path, ops)
+        self._unsaved = max(0, self._unsaved - len(ops))
+
+    def apply_delta(self, index_path: str):
+        apply_delta(self, index_path)
+
+    @synchronized
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+            self._warm = []
+            _open_indexes.discard(self)
+
+    @classmethod
+    def load(cls, index_path: str, mmap: bool = True):
+        """Загружает все шарды через mmap; воркеры пула открывают их сами при первом запросе"""
+        from utils.indexer import load_index
+
+        manifest = read_manifest(index_path)
+        if manifest.get('format') != 'sharded' or manifest.get('version') != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Неподдерживаемый формат индекса: {manifest.get('format')} v{manifest.get('version')}")
+
+        obj = cls(n_shards=manifest['n_shards'], top_k=manifest['top_k'])
+        obj.shards = [load_index(shard_dir(index_path, shard_no), mmap=mmap)
+                      for shard_no in range(obj.n_shards)]
+        obj.recall = manifest.get('recall')
+        obj.apply_delta(index_path)
+        obj.index_dir = index_path
+        obj._unsaved = 0
+        return obj
+
+
+def benchmark(n_vectors: int = 50000, dim: int = 128, n_shards: int = 4, n_queries: int = 200,
+              engine: str = 'ivf', max_distance: float = 0.3, seed: int = 0):
+    """
+    Сравнивает один шард с n_shards на синтетической галерее:
+    одиночный range_search (как при входе) и пакетный search_batch.
+    Возвращает {число шардов: {'range_ms': ..., 'batch_ms': ...}} — среднее на запрос.
+    """
+    import tempfile
+    from utils.indexer import make_index, load_index
+
+    rng = np.random.default_rng(seed)
+    vectors = normalize_rows(rng.standard_normal((n_vectors, dim)))
+    sample_ids = np.arange(1, n_vectors + 1)
+    subject_ids = (sample_ids + 1) // 2
+    picked = rng.choice(n_vectors, n_queries, replace=False)
+    queries = normalize_rows(vectors[picked] + 0.05 * rng.standard_normal((n_queries, dim)))
+
+    results = {}
+    for shards in (1, n_shards):
+        with tempfile.TemporaryDirectory() as tmp:
+            built = make_index({'engine': engine, 'shards': shards})
+            built.fit(sample_ids, subject_ids, vectors)
+            built.save(tmp)
+            index = load_index(tmp)
+            if isinstance(index, ShardedIndex):
+                index.warm_up()
+                for future in index._warm:
+                    future.result()
+            try:
+                start = time.perf_counter()
+                for query in queries:
+                    index.range_search(query, max_distance)
+                range_ms = (time.perf_counter() - start) * 1000 / n_queries
+
+                start = time.perf_counter()
+                index.search_batch(queries)
+                batch_ms = (time.perf_counter() - start) * 1000 / n_queries
+            finally:
+                if isinstance(index, ShardedIndex):
+                    index.close()
+        results[shards] = {'range_ms': range_ms, 'batch_ms': batch_ms}
+        print(f"{shards} шард(ов): range_search {range_ms:.2f} мс/запрос, "
+              f"search_batch {batch_ms:.3f} мс/запрос")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сравнение одного шарда с несколькими на синтетической галерее")
+    parser.add_argument('--vectors', type=int, default=50000, help="размер галереи")
+    parser.add_argument('--dim', type=int, default=128)
+    parser.add_argument('--shards', type=int, default=4)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--engine', choices=('ivf', 'hnsw'), default='ivf')
+    args = parser.parse_args()
+    benchmark(args.vectors, args.dim, args.shards, args.queries, args.engine)
@@ -0,0 +1,69 @@
+import numpy as np
+import psycopg2
+from psycopg2.extensions import register_adapter, register_type, new_type
+
+# Векторы хранятся в BYTEA как float32 little-endian подряд: 4 * dim байт
+VECTOR_DTYPE = np.dtype('<f4')
+
+
+def encode_vector(vector, dim: int = None):
+    """Вектор (список или массив) -> bytes фиксированной ширины; dim — ожидаемая размерность"""
+    array = np.asarray(vector, dtype=VECTOR_DTYPE)
+    if array.ndim != 1:
+        raise ValueError(f"Ожидался одномерный вектор, получена форма {array.shape}")
+    if dim is not None and array.shape[0] != dim:
+        raise ValueError(f"Неверная размерность вектора: {array.shape[0]} вместо {dim}")
+    return array.tobytes()
+
+def decode_vector(data, dim: int = None):
+    """bytes/memoryview из BYTEA -> float32-вектор без копирования текста"""
+    if data is None:
+        return None
+    if isinstance(data, np.ndarray):
+        array = data
+    else:
+        array = np.frombuffer(data, dtype=VECTOR_DTYPE)
+    if dim is not None and array.shape[0] != dim:
+        raise ValueError(f"Неверная размерность вектора: {array.shape[0]} вместо {dim}")
+    return array.astype(np.float32, copy=False)
+
+def decode_matrix(buffers, dim: int):
+    """Пачка BYTEA-значений одной размерности -> матрица (n, dim) одним np.frombuffer"""
+    data = b''.join(buffers)
+    if len(data) != len(buffers) * dim * VECTOR_DTYPE.itemsize:
+        raise ValueError(f"Векторы разной размерности в выборке (ожидалось {dim})")
+    return np.frombuffer(data, dtype=VECTOR_DTYPE).reshape(len(buffers), dim).astype(np.float32, copy=False)
+
+
+class Vector:
+    """
+    Вектор-параметр запроса: psycopg2 передаёт его в БД как float32 BYTEA.
+    Адаптер зарегистрирован только для этого класса, поэтому обычные
+    np.ndarray в параметрах других модулей адаптируются как раньше.
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, vector, dim: int = None):
+        self.data = encode_vector(vector, dim)
+
+    def __len__(self):
+        return len(self.data) // VECTOR_DTYPE.itemsize
+
+    def to_numpy(self):
+        return decode_vector(self.data)
+
+def adapt_vector(vector: Vector):
+    return psycopg2.Binary(vector.data)
+
+register_adapter(Vector, adapt_vector)
+
+def cast_vector(value, cursor):
+    data = psycopg2.BINARY(value, cursor)
+    return decode_vector(data) if data is not None else None
+
+# bytea в результатах -> float32-массив (других bytea-столбцов в схеме нет).
+# Регистрируется на соединении (register_vector_type), а не глобально
+VECTOR_TYPE = new_type(psycopg2.BINARY.values, 'VECTOR_F32', cast_vector)
+
+def register_vector_type(conn_or_curs):
+    register_type(VECTOR_TYPE, conn_or_curs)